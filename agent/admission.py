@@ -0,0 +1,165 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional
+from config import config
+from agent.run_context import RunContext
+
+
+class AdmissionRejected(Exception):
+    """Raised when a run cannot be admitted; carries the HTTP status to answer with"""
+
+    def __init__(self, message: str, status_code: int = 429, queue_position: int = None,
+                 queue_length: int = 0, retry_after: int = 5):
+        super().__init__(message)
+        self.status_code = status_code
+        self.queue_position = queue_position
+        self.queue_length = queue_length
+        self.retry_after = retry_after
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'error': str(self),
+            'queue_position': self.queue_position,
+            'queue_length': self.queue_length,
+            'retry_after': self.retry_after
+        }
+
+
+class AdmissionController:
+    """Global limits on concurrent agent runs, model streams and tool calls.
+
+    Runs beyond ``max_runs`` wait in a bounded FIFO queue; when the queue is
+    full, new runs are rejected immediately. Model and tool slots are plain
+    semaphores. All waiting happens on the agent runtime loop; ``check()`` may
+    be called from request threads as a fast pre-flight.
+    """
+
+    def __init__(self, max_runs: int = None, max_model_calls: int = None, max_tool_calls: int = None,
+                 max_queue: int = None, queue_timeout: float = None):
+        self.max_runs = max_runs or config.AGENT_MAX_CONCURRENT_RUNS
+        self.max_model_calls = max_model_calls or config.AGENT_MAX_CONCURRENT_MODEL_CALLS
+        self.max_tool_calls = max_tool_calls or config.AGENT_MAX_CONCURRENT_TOOL_CALLS
+        self.max_queue = config.AGENT_RUN_QUEUE_SIZE if max_queue is None else max_queue
+        self.queue_timeout = queue_timeout or config.AGENT_RUN_QUEUE_TIMEOUT
+        self._active_runs = 0
+        self._active_model_calls = 0
+        self._active_tool_calls = 0
+        self._waiters: deque = deque()
+        self._model_slots: Optional[asyncio.Semaphore] = None
+        self._tool_slots: Optional[asyncio.Semaphore] = None
+        self._stats = {'admitted': 0, 'queued': 0, 'rejected': 0, 'timed_out': 0}
+
+    def check(self) -> Optional[AdmissionRejected]:
+        """Fast pre-flight: the rejection a new run would get right now, if any"""
+        if self._active_runs >= self.max_runs and len(self._waiters) >= self.max_queue:
+            self._stats['rejected'] += 1
+            return AdmissionRejected(
+                "Server is at capacity, try again shortly",
+                status_code=429, queue_length=len(self._waiters)
+            )
+        return None
+
+    def queue_position(self, ctx: RunContext) -> Optional[int]:
+        for position, (waiting, _) in enumerate(self._waiters, start=1):
+            if waiting is ctx:
+                return position
+        return None
+
+    async def admit(self, ctx: RunContext):
+        """Wait for a run slot, yielding the queue position while queued.
+
+        Raises AdmissionRejected if the queue is full or the wait times out.
+        Callers must call ``release(ctx)`` once the run finishes.
+        """
+        if self._active_runs < self.max_runs and not self._waiters:
+            self._active_runs += 1
+            self._admitted(ctx)
+            return
+        if len(self._waiters) >= self.max_queue:
+            self._stats['rejected'] += 1
+            raise AdmissionRejected(
+                "Server is at capacity, try again shortly",
+                status_code=429, queue_length=len(self._waiters)
+            )
+
+        slot = asyncio.get_running_loop().create_future()
+        entry = (ctx, slot)
+        self._waiters.append(entry)
+        self._stats['queued'] += 1
+        deadline = asyncio.get_running_loop().time() + self.queue_timeout
+        try:
+            while not slot.done():
+                yield self.queue_position(ctx)
+                remaining = deadline - asyncio.get_running_loop().time()
+                if remaining <= 0:
+                    self._stats['timed_out'] += 1
+                    raise AdmissionRejected(
+                        "Timed out waiting for a free agent slot",
+                        status_code=503, queue_position=self.queue_position(ctx),
+                        queue_length=len(self._waiters)
+                    )
+                await asyncio.wait({slot}, timeout=min(1.0, remaining))
+        except BaseException:
+            if entry in self._waiters:
+                self._waiters.remove(entry)
+            elif slot.done() and not slot.cancelled():
+                # A slot was handed to us but we are not going to use it
+                self._release_slot()
+            raise
+        self._admitted(ctx)
+
+    def _admitted(self, ctx: RunContext):
+        ctx.admitted = True
+        ctx.status = 'thinking'
+        self._stats['admitted'] += 1
+
+    def release(self, ctx: RunContext):
+        if not ctx.admitted:
+            return
+        ctx.admitted = False
+        self._release_slot()
+
+    def _release_slot(self):
+        # Hand the slot straight to the next waiter, keeping the active count
+        while self._waiters:
+            _, slot = self._waiters.popleft()
+            if not slot.done():
+                slot.set_result(True)
+                return
+        self._active_runs -= 1
+
+    @asynccontextmanager
+    async def model_slot(self):
+        if self._model_slots is None:
+            self._model_slots = asyncio.Semaphore(self.max_model_calls)
+        async with self._model_slots:
+            self._active_model_calls += 1
+            try:
+                yield
+            finally:
+                self._active_model_calls -= 1
+
+    @asynccontextmanager
+    async def tool_slot(self):
+        if self._tool_slots is None:
+            self._tool_slots = asyncio.Semaphore(self.max_tool_calls)
+        async with self._tool_slots:
+            self._active_tool_calls += 1
+            try:
+                yield
+            finally:
+                self._active_tool_calls -= 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'active_runs': self._active_runs,
+            'max_runs': self.max_runs,
+            'queued': len(self._waiters),
+            'max_queue': self.max_queue,
+            'active_model_calls': self._active_model_calls,
+            'max_model_calls': self.max_model_calls,
+            'active_tool_calls': self._active_tool_calls,
+            'max_tool_calls': self.max_tool_calls,
+            'totals': dict(self._stats)
+        }
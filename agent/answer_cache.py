@@ -0,0 +1,182 @@
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+from config import config
+from utils.metrics import ANSWER_CACHE_LOOKUPS
+
+STOPWORDS = frozenset(
+    "a an and are about any can could do does find for from give has have how i in is it list "
+    "me my of on or please show some tell that the their there these this to what which with "
+    "would you your".split()
+)
+
+_MERSENNE = (1 << 61) - 1
+
+
+def normalize_query(text: str) -> str:
+    """Case-, width- and whitespace-insensitive form of a query, without trailing punctuation"""
+    text = unicodedata.normalize('NFKC', text).casefold()
+    return ' '.join(text.split()).rstrip(' ?!.')
+
+
+class MinHasher:
+    """MinHash signatures over character shingles, for near-duplicate queries.
+
+    Stopwords are dropped first, so "latest papers on X" and "what are the
+    latest papers about X" shingle the same. The share of equal signature
+    positions estimates the Jaccard similarity of two shingle sets.
+    """
+
+    def __init__(self, num_perm: int = 64, shingle: int = 3, seed: int = 1):
+        rng = random.Random(seed)
+        self.shingle = shingle
+        self._perms = [(rng.randrange(1, _MERSENNE), rng.randrange(0, _MERSENNE)) for _ in range(num_perm)]
+
+    def shingles(self, normalized: str) -> set:
+        words = [w for w in re.findall(r'\w+', normalized) if w not in STOPWORDS]
+        text = ' '.join(words) or normalized
+        k = self.shingle
+        return {text[i:i + k] for i in range(max(1, len(text) - k + 1))}
+
+    def signature(self, normalized: str) -> Tuple[int, ...]:
+        hashes = [int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'big')
+                  for s in self.shingles(normalized)]
+        return tuple(min((a * h + b) % _MERSENNE for h in hashes) for a, b in self._perms)
+
+    @staticmethod
+    def similarity(left: Tuple[int, ...], right: Tuple[int, ...]) -> float:
+        return sum(1 for x, y in zip(left, right) if x == y) / len(left)
+
+
+class AnswerCache:
+    """Finished agent runs, replayable for repeated queries.
+
+    Entries hold the event sequence of a run that completed without errors,
+    keyed on the normalized query plus a context of model, temperature and
+    tool catalog version, so switching models or a change in the available
+    tools never serves a stale answer. Like the tool result cache, entries
+    live in an LRU bounded by count and bytes and expire after ``ttl``.
+
+    With ``similarity`` above 0, a query with no exact match may be answered
+    by a cached query whose MinHash similarity reaches that threshold. Both
+    queries must be in the same context and contain the same numbers, so
+    "papers from 2023" never answers "papers from 2024".
+    """
+
+    def __init__(self, max_entries: int = None, max_bytes: int = None, ttl: float = None,
+                 similarity: float = None):
+        self.max_entries = max_entries or config.ANSWER_CACHE_MAX_ENTRIES
+        self.max_bytes = max_bytes or config.ANSWER_CACHE_MAX_BYTES
+        self.ttl = config.ANSWER_CACHE_TTL if ttl is None else ttl
+        self.similarity = config.ANSWER_CACHE_SIMILARITY if similarity is None else similarity
+        self.hasher = MinHasher(config.ANSWER_CACHE_MINHASH_PERM) if self.similarity > 0 else None
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'near_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'expired': 0}
+
+    @staticmethod
+    def make_key(normalized: str, context: Tuple[Any, ...]) -> str:
+        canonical = json.dumps([normalized, *context], separators=(',', ':'), ensure_ascii=False, default=str)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _partition(normalized: str, context: Tuple[Any, ...]) -> Tuple[Any, ...]:
+        """Entries that may answer each other as near duplicates"""
+        return (*context, tuple(sorted(set(re.findall(r'\d+', normalized)))))
+
+    def get(self, query: str, context: Tuple[Any, ...]) -> Optional[Dict[str, Any]]:
+        """Cached ``{'events', 'created_at', 'similarity'}`` for ``query``, or None"""
+        normalized = normalize_query(query)
+        key = self.make_key(normalized, context)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['expires_at'] <= now:
+                self._remove(key)
+                self._stats['expired'] += 1
+                entry = None
+            similarity = 1.0
+            result = 'hit'
+            if entry is None and self.hasher:
+                entry, similarity = self._nearest(normalized, context, now)
+                result = 'near_hit'
+            if entry is None:
+                self._stats['misses'] += 1
+                ANSWER_CACHE_LOOKUPS.labels('miss').inc()
+                return None
+            self._entries.move_to_end(entry['key'])
+            self._stats[result + 's'] += 1
+            ANSWER_CACHE_LOOKUPS.labels(result).inc()
+            return {'events': entry['events'], 'created_at': entry['created_at'], 'similarity': round(similarity, 3)}
+
+    def _nearest(self, normalized: str, context: Tuple[Any, ...], now: float):
+        # A linear scan; the cache is small and signatures are cheap to compare
+        partition = self._partition(normalized, context)
+        signature = self.hasher.signature(normalized)
+        best, best_score = None, self.similarity
+        for entry in self._entries.values():
+            if entry['partition'] != partition or entry['expires_at'] <= now:
+                continue
+            score = MinHasher.similarity(signature, entry['signature'])
+            if score >= best_score:
+                best, best_score = entry, score
+        return best, best_score
+
+    def set(self, query: str, context: Tuple[Any, ...], events: List[Dict[str, Any]]):
+        if self.ttl <= 0:
+            return
+        normalized = normalize_query(query)
+        key = self.make_key(normalized, context)
+        size = len(json.dumps(events, separators=(',', ':'), default=str))
+        now = time.time()
+        entry = {
+            'key': key,
+            'events': events,
+            'size': size,
+            'created_at': now,
+            'expires_at': now + self.ttl,
+            'partition': self._partition(normalized, context) if self.hasher else None,
+            'signature': self.hasher.signature(normalized) if self.hasher else None
+        }
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = entry
+            self._bytes += size
+            self._stats['stores'] += 1
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self._bytes -= entry['size']
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self._stats['hits'] + self._stats['near_hits']
+            lookups = hits + self._stats['misses']
+            return {
+                **self._stats,
+                'hit_rate': round(hits / lookups, 3) if lookups else 0.0,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'similarity': self.similarity
+            }
@@ -0,0 +1,271 @@
+import asyncio
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+from config import config
+from agent.runtime import get_runtime
+from agent.run_context import RunContext
+from utils.metrics import BATCH_QUERIES
+
+
+class BatchJob:
+    """A list of queries run as one batch; its results live in a session"""
+
+    def __init__(self, batch_id: str, queries: List[str], use_cache: bool = True):
+        self.batch_id = batch_id
+        self.queries = queries
+        self.use_cache = use_cache
+        self.status = 'queued'
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.completed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.running: Dict[int, str] = {}  # query index -> run id
+        self.cancelled = False
+
+    @property
+    def pending(self) -> int:
+        return len(self.queries) - self.completed - self.failed - self.skipped - len(self.running)
+
+    def to_dict(self) -> Dict[str, Any]:
+        end = self.finished_at or time.time()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        done = self.completed + self.failed
+        return {
+            'batch_id': self.batch_id,
+            'status': self.status,
+            'total': len(self.queries),
+            'completed': self.completed,
+            'failed': self.failed,
+            'skipped': self.skipped,
+            'running': len(self.running),
+            'pending': self.pending,
+            'created_at': datetime.fromtimestamp(self.created_at).isoformat(),
+            'started_at': datetime.fromtimestamp(self.started_at).isoformat() if self.started_at else None,
+            'finished_at': datetime.fromtimestamp(self.finished_at).isoformat() if self.finished_at else None,
+            'elapsed_s': round(elapsed, 2),
+            'queries_per_s': round(done / elapsed, 2) if elapsed else 0.0
+        }
+
+
+class BatchRunner:
+    """Runs batch queries through the agent on a fixed pool of workers.
+
+    All batches share one FIFO of queries and ``concurrency`` worker tasks on
+    the agent runtime loop, so throughput is set by configuration rather than
+    by how many HTTP connections a client holds open. Workers go through
+    ``stream_response`` like interactive chats do, sharing its admission
+    limits, pooled MCP sessions and caches; a run the admission controller
+    turns away is retried after its ``retry_after``.
+
+    Each batch is a session: every query is stored as a user message and its
+    answer as an assistant message whose metadata holds the query index,
+    status and timings, as soon as that query finishes.
+    """
+
+    def __init__(self, session_manager, concurrency: int = None, max_retries: int = 5):
+        self.session_manager = session_manager
+        self.concurrency = concurrency or config.BATCH_CONCURRENCY
+        self.max_retries = max_retries
+        self.jobs: Dict[str, BatchJob] = {}
+        self._queue: deque = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._workers: List[asyncio.Task] = []
+
+    def submit(self, queries: List[str], title: str = None, use_cache: bool = True) -> BatchJob:
+        """Persist a new batch and queue its queries; returns immediately"""
+        batch_id = self.session_manager.create_session(title=title or f"Batch: {queries[0][:40]}... ({len(queries)} queries)")
+        job = BatchJob(batch_id, queries, use_cache)
+        self.jobs[batch_id] = job
+        self._save_state(job)
+        get_runtime().run(self._enqueue(job))
+        return job
+
+    async def _enqueue(self, job: BatchJob):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._queue.extend((job, index) for index in range(len(job.queries)))
+        while len(self._workers) < self.concurrency:
+            self._workers.append(asyncio.create_task(self._worker(), name=f"batch-worker-{len(self._workers)}"))
+        self._wakeup.set()
+
+    async def _worker(self):
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            job, index = self._queue.popleft()
+            if job.cancelled:
+                continue
+            if job.status == 'queued':
+                job.status = 'running'
+                job.started_at = time.time()
+            try:
+                await self._run_query(job, index)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[{datetime.now().strftime('%H:%M:%S')}] Batch {job.batch_id} query {index} failed: {e}")
+                if job.running.pop(index, None) is not None:
+                    job.failed += 1
+            if job.pending == 0 and not job.running and job.finished_at is None:
+                job.status = 'cancelled' if job.cancelled else 'done'
+                job.finished_at = time.time()
+                await asyncio.to_thread(self._save_state, job)
+
+    async def _run_query(self, job: BatchJob, index: int):
+        query = job.queries[index]
+        queued_s = time.time() - job.created_at
+        started = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            run = RunContext(query)
+            job.running[index] = run.run_id
+            result = {'index': index, 'run_id': run.run_id, 'status': 'done'}
+            content: List[str] = []
+            # Its own task, so cancelling the run does not take the worker down with it
+            consume = asyncio.create_task(self._consume(job, query, run, result, content, started))
+            try:
+                first_token, rejected = await consume
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():
+                    raise
+                first_token, rejected = None, None
+                result['status'] = 'cancelled'
+            if rejected is None or attempt == self.max_retries or job.cancelled:
+                if rejected is not None:
+                    result['status'] = 'error'
+                    result['error'] = rejected['message']
+                break
+            # Turned away by admission control; wait for a free slot and retry
+            await asyncio.sleep(rejected.get('retry_after') or 1)
+        result['timings'] = {
+            'queued_s': round(queued_s, 3),
+            'ttft_s': round(first_token, 3) if first_token is not None else None,
+            'total_s': round(time.perf_counter() - started, 3)
+        }
+        await asyncio.to_thread(self._save_result, job, query, ''.join(content), result)
+        job.running.pop(index, None)
+        if result['status'] == 'done':
+            job.completed += 1
+        else:
+            job.failed += 1
+        BATCH_QUERIES.labels(result['status']).inc()
+
+    async def _consume(self, job: BatchJob, query: str, run: RunContext, result: Dict[str, Any],
+                       content: List[str], started: float):
+        """Drive one run to the end, collecting its answer; returns (time to first token, admission rejection)"""
+        first_token = None
+        rejected = None
+        async for event in self._agent().stream_response(query, run, use_cache=job.use_cache):
+            kind = event['type']
+            if kind == 'content':
+                if first_token is None:
+                    first_token = time.perf_counter() - started
+                content.append(event['content'])
+            elif kind == 'run' and event.get('cached'):
+                result['cached'] = True
+            elif kind == 'model':
+                result['model'] = event['model']
+            elif kind == 'usage':
+                result['usage'] = {'input_tokens': event['run_input_tokens'], 'output_tokens': event['run_output_tokens']}
+            elif kind == 'tool_start':
+                result['tool_calls'] = result.get('tool_calls', 0) + 1
+            elif kind == 'error':
+                if event.get('code') in (429, 503):
+                    rejected = event
+                else:
+                    result['status'] = 'error'
+                    result['error'] = event['message']
+        return first_token, rejected
+
+    def _save_result(self, job: BatchJob, query: str, answer: str, result: Dict[str, Any]):
+        self.session_manager.add_message(job.batch_id, 'user', query, metadata={'batch_index': result['index']})
+        self.session_manager.add_message(job.batch_id, 'assistant', answer, metadata={'batch': result})
+
+    def _save_state(self, job: BatchJob):
+        self.session_manager.update_session_metadata(job.batch_id, {'batch': job.to_dict()})
+
+    @staticmethod
+    def _agent():
+        from agent.mcp_agent import get_agent
+        return get_agent()
+
+    def get_status(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """Live status of a batch, or its last saved state after a restart"""
+        job = self.jobs.get(batch_id)
+        if job:
+            return job.to_dict()
+        session = self.session_manager.get_session(batch_id)
+        state = session and session['metadata'].get('batch')
+        if not state:
+            return None
+        if state['status'] in ('queued', 'running'):
+            # The process that ran it is gone
+            state['status'] = 'interrupted'
+        return state
+
+    def get_results(self, batch_id: str, offset: int = 0, limit: int = 100) -> Optional[Dict[str, Any]]:
+        """Finished queries so far, in query order, with their answers and timings"""
+        status = self.get_status(batch_id)
+        if status is None:
+            return None
+        session = self.session_manager.get_session(batch_id)
+        results = sorted(
+            ({**m['metadata']['batch'], 'answer': m['content']} for m in session['messages']
+             if m['role'] == 'assistant' and 'batch' in m['metadata']),
+            key=lambda r: r['index']
+        )
+        queries = {m['metadata']['batch_index']: m['content'] for m in session['messages']
+                   if m['role'] == 'user' and 'batch_index' in m['metadata']}
+        page = [{'query': queries.get(r['index']), **r} for r in results[offset:offset + limit]]
+        return {
+            'batch': status,
+            'results': page,
+            'offset': offset,
+            'next_offset': offset + limit if len(results) > offset + limit else None
+        }
+
+    def cancel(self, batch_id: str) -> bool:
+        """Drop a batch's pending queries and cancel the ones running"""
+        job = self.jobs.get(batch_id)
+        if not job or job.finished_at is not None:
+            return False
+        job.cancelled = True
+        agent = self._agent()
+        for run_id in list(job.running.values()):
+            agent.cancel_run(run_id)
+        # Queries still in the FIFO never start; settle the batch if nothing is running
+        get_runtime().run(self._settle(job))
+        return True
+
+    async def _settle(self, job: BatchJob):
+        before = len(self._queue)
+        self._queue = deque(item for item in self._queue if item[0] is not job)
+        job.skipped += before - len(self._queue)
+        if not job.running and job.finished_at is None:
+            job.status = 'cancelled'
+            job.finished_at = time.time()
+            await asyncio.to_thread(self._save_state, job)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'concurrency': self.concurrency,
+            'workers': len(self._workers),
+            'queued_queries': len(self._queue),
+            'active_batches': sum(1 for job in self.jobs.values() if job.finished_at is None)
+        }
+
+    async def _close(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def close(self):
+        runtime = get_runtime()
+        if runtime.is_running():
+            runtime.run(self._close(), timeout=5)
@@ -0,0 +1,75 @@
+import os
+import json
+import hashlib
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+
+def server_fingerprint(cfg: Dict[str, Any]) -> str:
+    """Hash of the parts of a server entry that determine which tools it exposes"""
+    identity = {
+        'command': cfg.get('command'),
+        'args': [str(arg) for arg in cfg.get('args', [])],
+        'env': cfg.get('env', {})
+    }
+    return hashlib.sha256(json.dumps(identity, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class ToolCatalogCache:
+    """On-disk snapshot of the tools discovered on each MCP server.
+
+    Each server's entry is keyed on its fingerprint, so editing a server's
+    command, args or env invalidates only that server's snapshot.
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self._data: Dict[str, Dict[str, Any]] = {}
+        self._loaded = False
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        self._loaded = True
+        if not self.path.exists():
+            return self._data
+        try:
+            with open(self.path, 'r') as f:
+                self._data = json.load(f).get('servers', {})
+        except (OSError, ValueError) as e:
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] Tool catalog cache unreadable, ignoring: {e}")
+            self._data = {}
+        return self._data
+
+    def get(self, name: str, fingerprint: str) -> Optional[List[Dict[str, Any]]]:
+        """Cached tools for a server, or None if missing or stale"""
+        if not self._loaded:
+            self.load()
+        entry = self._data.get(name)
+        if not entry or entry.get('fingerprint') != fingerprint:
+            return None
+        return entry.get('tools', [])
+
+    def put(self, name: str, fingerprint: str, tools: List[Dict[str, Any]]) -> bool:
+        """Store a server's tools; returns True if the catalog changed"""
+        if not self._loaded:
+            self.load()
+        entry = self._data.get(name)
+        if entry and entry.get('fingerprint') == fingerprint and entry.get('tools') == tools:
+            return False
+        self._data[name] = {
+            'fingerprint': fingerprint,
+            'tools': tools,
+            'updated_at': datetime.now().isoformat()
+        }
+        self._save()
+        return True
+
+    def _save(self):
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(self.path.suffix + '.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump({'servers': self._data}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] Could not write tool catalog cache: {e}")
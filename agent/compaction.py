@@ -0,0 +1,330 @@
+import re
+import json
+from fnmatch import fnmatch
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from langchain_core.messages import AIMessage, ToolMessage
+from config import config
+from utils.metrics import TOOL_RESULT_COMPACTION, TOOL_RESULT_TOKENS_SAVED
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count of a piece of text (~4 chars per token)"""
+    if not text:
+        return 0
+    return len(text) // 4 + 1
+
+
+def message_tokens(message) -> int:
+    """Rough token count of a chat message, including any tool call arguments"""
+    content = message.content if isinstance(message.content, str) else str(message.content)
+    tokens = estimate_tokens(content) + 4
+    for tc in getattr(message, 'tool_calls', None) or []:
+        tokens += estimate_tokens(tc.get('name', '')) + estimate_tokens(str(tc.get('args', '')))
+    return tokens
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to roughly ``max_tokens``, preferring a line boundary, and say how much was dropped"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    limit = max(0, max_tokens * 4)
+    head = text[:limit]
+    # Don't leave half a line behind unless the line is most of what we keep
+    newline = head.rfind('\n')
+    if newline > limit // 2:
+        head = head[:newline]
+    dropped = estimate_tokens(text[len(head):])
+    truncated = f"{head}\n... (~{dropped} tokens truncated) ..."
+    # Just over the cap, the note can cost more than the cut saves
+    return truncated if len(truncated) < len(text) else text
+
+
+def squeeze_whitespace(text: str) -> str:
+    """Collapse runs of spaces and blank lines, which cost tokens and carry nothing"""
+    text = re.sub(r'[ \t]+', ' ', text)
+    return re.sub(r'\n\s*\n', '\n', text).strip()
+
+
+@lru_cache(maxsize=64)
+def parse_fields(specs: Tuple[str, ...]) -> Dict[str, Optional[int]]:
+    """``("title", "abstract:300")`` -> ``{'title': None, 'abstract': 300}``, names lower-cased"""
+    fields = {}
+    for spec in specs:
+        name, _, limit = spec.partition(':')
+        fields[name.strip().lower()] = int(limit) if limit else None
+    return fields
+
+
+def _person_name(value: Dict[str, Any]) -> Optional[str]:
+    """Display name of an author object in the Crossref, PubMed or Semantic Scholar shape"""
+    for first, last in (('given', 'family'), ('foreName', 'lastName'), ('firstName', 'lastName')):
+        if value.get(last):
+            return ' '.join(str(value[k]) for k in (first, last) if value.get(k))
+    if value.get('name') and len(value) <= 3:
+        return str(value['name'])
+    return None
+
+
+def _compact_value(value: Any, limit: Optional[int]) -> Any:
+    """A field value without markup noise: whitespace squeezed, text cut to ``limit``
+    characters at a word boundary, lists to ``limit`` items, author objects to names"""
+    if isinstance(value, str):
+        value = ' '.join(value.split())
+        if limit and len(value) > limit:
+            value = value[:limit].rsplit(' ', 1)[0] + '…'
+        return value
+    if isinstance(value, list):
+        items = [item for item in (_compact_value(item, None) for item in value) if item not in (None, '', [], {})]
+        if len(items) == 1 and not isinstance(items[0], (list, dict)):
+            # Crossref wraps single titles and venues in lists; ``limit`` counted
+            # items here, so it does not apply to the unwrapped value
+            return items[0]
+        if limit and len(items) > limit:
+            return items[:limit] + [f"+{len(items) - limit} more"]
+        return items
+    if isinstance(value, dict):
+        parts = value.get('date-parts')
+        if parts:
+            return '-'.join(str(part) for part in parts[0])
+        name = _person_name(value)
+        if name:
+            return name
+        # Keep flat identifiers such as externalIds, drop anything nested deeper
+        return {k: v for k, v in value.items() if isinstance(v, (str, int, float)) and v != ''}
+    return value
+
+
+def _find_records(data: Any, fields: Dict[str, Optional[int]]) -> Tuple[Optional[List[Dict[str, Any]]], Dict[str, Any]]:
+    """The records in a parsed JSON result, and the counts beside them (e.g. ``total``)"""
+    def is_record(value) -> bool:
+        return isinstance(value, dict) and any(str(key).lower() in fields for key in value)
+
+    if isinstance(data, list):
+        return [item for item in data if is_record(item)] or None, {}
+    if not isinstance(data, dict):
+        return None, {}
+    # Lists of records directly under the result, or one level further down
+    # (Crossref puts them in message.items)
+    values = list(data.values())
+    values += [inner for value in data.values() if isinstance(value, dict) for inner in value.values()]
+    lists = [value for value in values if isinstance(value, list) and value and is_record(value[0])]
+    own_fields = sum(1 for key in data if str(key).lower() in fields)
+    if lists and own_fields < 2:
+        counts = {k: v for k, v in data.items() if isinstance(v, (int, float)) and not isinstance(v, bool)}
+        return [item for item in max(lists, key=len) if is_record(item)], counts
+    return ([data], {}) if own_fields else (None, {})
+
+
+def project_json(data: Any, fields: Dict[str, Optional[int]], max_tokens: int) -> Optional[str]:
+    """The listed fields of each record in ``data``, one compact JSON object per line,
+    as many records as fit ``max_tokens``; None if ``data`` holds no such records"""
+    records, counts = _find_records(data, fields)
+    if not records:
+        return None
+    projected = []
+    for record in records:
+        keys = {str(key).lower(): key for key in record}
+        kept = {}
+        for name, limit in fields.items():
+            if name in keys:
+                value = _compact_value(record[keys[name]], limit)
+                if value not in (None, '', [], {}):
+                    kept[keys[name]] = value
+        if kept:
+            projected.append(kept)
+    if not projected:
+        return None
+
+    lines = [json.dumps(counts, ensure_ascii=False, separators=(',', ':'))] if counts else []
+    used = sum(estimate_tokens(line) for line in lines)
+    for record in projected:
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+        if used + estimate_tokens(line) > max_tokens:
+            if len(lines) > bool(counts):
+                break
+            # Even the first record is over budget; shorten it rather than cut it mid-JSON
+            line = _shrink_record(record, max_tokens - used - 10)
+        lines.append(line)
+        used += estimate_tokens(line)
+    omitted = len(projected) - (len(lines) - bool(counts))
+    if omitted:
+        lines.append(f"... ({omitted} more results omitted) ...")
+    return truncate_to_tokens('\n'.join(lines), max_tokens)
+
+
+def _shrink_record(record: Dict[str, Any], max_tokens: int) -> str:
+    """A record as one JSON line, its longest text halved until it fits ``max_tokens``"""
+    record = dict(record)
+    while True:
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+        texts = [key for key, value in record.items() if isinstance(value, str) and len(value) > 40]
+        if estimate_tokens(line) <= max_tokens or not texts:
+            return line
+        longest = max(texts, key=lambda key: len(record[key]))
+        record[longest] = _compact_value(record[longest], len(record[longest]) // 2)
+
+
+class ResultCompactor:
+    """Fits a fresh tool result into its token cap, keeping the parts that matter.
+
+    For servers with a projection, JSON results are reduced to the listed
+    fields of each record, written one compact JSON object per line, with as
+    many records as fit the cap. When older results are truncated later, they
+    lose whole records instead of half an abstract. Other JSON is minified
+    and plain text has its whitespace squeezed before the usual truncation.
+
+    Projections come from the ``"compaction"`` entry of a server in the MCP
+    config file, falling back to ``TOOL_RESULT_FIELDS`` by server name::
+
+        "compaction": {"fields": ["title", "doi", "abstract:200"], "tokens": 400,
+                       "tools": {"get_paper*": {"fields": ["title", "abstract:2000"], "tokens": 900}}}
+
+    ``"name:N"`` cuts a text field to N characters or a list to N items, and
+    ``tokens`` overrides ``AGENT_TOOL_RESULT_TOKENS``. ``"compaction": false``
+    (for a server or one of its tools) leaves results to plain truncation.
+    Code can also ``register`` a function for a ``server:tool`` pattern; it
+    gets the raw text and the token cap, and returns the compacted text or
+    None to fall through to the above.
+    """
+
+    def __init__(self, result_tokens: int = None, defaults: Dict[str, List[str]] = None):
+        self.result_tokens = result_tokens or config.AGENT_TOOL_RESULT_TOKENS
+        self.defaults = config.TOOL_RESULT_FIELDS if defaults is None else defaults
+        self._servers: Dict[str, Any] = {}
+        self._plugins: List[Tuple[str, Callable[[str, int], Optional[str]]]] = []
+
+    def configure_server(self, server: str, settings):
+        """Apply the ``"compaction"`` entry of a server from the MCP config file"""
+        self._servers[server] = settings
+
+    def register(self, pattern: str, compact: Callable[[str, int], Optional[str]]):
+        """Compact results of tools matching ``server:tool`` ``pattern`` with ``compact(text, max_tokens)``"""
+        self._plugins.append((pattern, compact))
+
+    def settings_for(self, server: str, tool: str) -> Optional[Dict[str, Any]]:
+        """``{'fields', 'tokens'}`` for a tool's results, or None if they are only truncated"""
+        settings = self._servers.get(server, {})
+        if settings is False:
+            return None
+        if not isinstance(settings, dict):
+            settings = {}
+        tool_settings = next((v for p, v in settings.get('tools', {}).items() if fnmatch(tool, p)), None)
+        if tool_settings is False:
+            return None
+        if not isinstance(tool_settings, dict):
+            tool_settings = {}
+        fields = (tool_settings.get('fields') or settings.get('fields')
+                  or next((f for p, f in self.defaults.items() if fnmatch(server, p)), None))
+        return {
+            'fields': tuple(fields) if fields else None,
+            'tokens': int(tool_settings.get('tokens') or settings.get('tokens') or self.result_tokens)
+        }
+
+    def compact(self, text: str, server: str = None, tool: str = None) -> str:
+        settings = self.settings_for(server, tool or '') if server else {'fields': None, 'tokens': self.result_tokens}
+        if settings is None:
+            compacted, mode = truncate_to_tokens(text, self.result_tokens), 'truncated'
+        else:
+            compacted, mode = self._compact(text, server, tool, settings)
+        saved = estimate_tokens(text) - estimate_tokens(compacted)
+        if server and saved > 0:
+            TOOL_RESULT_COMPACTION.labels(server, mode).inc()
+            TOOL_RESULT_TOKENS_SAVED.labels(server, mode).inc(saved)
+        return compacted
+
+    def _compact(self, text: str, server: str, tool: str, settings: Dict[str, Any]) -> Tuple[str, str]:
+        max_tokens = settings['tokens']
+        for pattern, plugin in self._plugins:
+            if fnmatch(f"{server}:{tool}", pattern):
+                compacted = plugin(text, max_tokens)
+                if compacted is not None:
+                    return truncate_to_tokens(compacted, max_tokens), 'plugin'
+        stripped = text.strip()
+        if stripped.startswith(('{', '[')):
+            try:
+                data = json.loads(stripped)
+            except ValueError:
+                data = None
+            if data is not None:
+                if settings['fields']:
+                    projected = project_json(data, parse_fields(settings['fields']), max_tokens)
+                    if projected is not None:
+                        return projected, 'projected'
+                minified = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+                return truncate_to_tokens(minified, max_tokens), 'minified'
+        return truncate_to_tokens(squeeze_whitespace(text), max_tokens), 'truncated'
+
+
+class ContextCompactor:
+    """Keeps a run's prompt inside its token budget.
+
+    Each run may spend ``run_budget`` input tokens across all of its steps; a
+    step gets an even share of what is left. Fresh tool results are fitted to
+    ``result_tokens`` by a ResultCompactor. Results from earlier steps are
+    shrunk further the older they are and the closer the run gets to
+    ``max_steps``, and if the prompt still does not fit the step's share they
+    are cut down to ``min_tokens``, oldest first.
+    """
+
+    def __init__(self, run_budget: int = None, result_tokens: int = None, min_tokens: int = None,
+                 max_steps: int = None):
+        self.run_budget = run_budget or config.AGENT_RUN_TOKEN_BUDGET
+        self.result_tokens = result_tokens or config.AGENT_TOOL_RESULT_TOKENS
+        self.min_tokens = min_tokens or config.AGENT_TOOL_RESULT_MIN_TOKENS
+        self.max_steps = max_steps or config.AGENT_MAX_STEPS
+        self.results = ResultCompactor(self.result_tokens)
+
+    def compact_result(self, text: str, server: str = None, tool: str = None) -> str:
+        """Cap a fresh tool result before it enters the conversation"""
+        return self.results.compact(text, server, tool)
+
+    def step_budget(self, step: int, input_tokens_used: int) -> int:
+        """Prompt tokens the given step may use, from what is left of the run budget"""
+        steps_left = max(1, self.max_steps - step + 1)
+        return max(self.min_tokens, (self.run_budget - input_tokens_used) // steps_left)
+
+    def compact(self, messages: List[Any], step: int, input_tokens_used: int = 0, overhead: int = 0) -> Dict[str, int]:
+        """Shrink tool messages in place before the model call of ``step``.
+
+        ``overhead`` is the prompt cost that compaction cannot touch, such as the
+        bound tool schemas. Returns the prompt estimate before and after.
+        """
+        budget = self.step_budget(step, input_tokens_used)
+        before = overhead + sum(message_tokens(m) for m in messages)
+
+        # Age of each tool message, in model turns since it was produced
+        ages = {}
+        age = 0
+        for i in range(len(messages) - 1, -1, -1):
+            if isinstance(messages[i], AIMessage):
+                age += 1
+            elif isinstance(messages[i], ToolMessage):
+                ages[i] = age
+
+        # Older results get a smaller share, and every share shrinks as the run nears max_steps
+        pressure = min(1.0, step / self.max_steps)
+        for i, age in ages.items():
+            if age <= 0:
+                continue
+            cap = max(self.min_tokens, int(self.result_tokens * (1 - pressure) / age))
+            self._shrink(messages, i, cap)
+
+        total = overhead + sum(message_tokens(m) for m in messages)
+        for i in sorted(ages, key=lambda i: (-ages[i], i)):
+            if total <= budget:
+                break
+            saved = self._shrink(messages, i, self.min_tokens)
+            total -= saved
+        return {'budget': budget, 'before': before, 'after': total}
+
+    @staticmethod
+    def _shrink(messages: List[Any], index: int, max_tokens: int) -> int:
+        message = messages[index]
+        content = message.content if isinstance(message.content, str) else str(message.content)
+        compacted = truncate_to_tokens(content, max_tokens)
+        saved = estimate_tokens(content) - estimate_tokens(compacted)
+        if saved <= 0:
+            return 0
+        messages[index] = ToolMessage(content=compacted, tool_call_id=message.tool_call_id)
+        return saved
@@ -0,0 +1,180 @@
+import time
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Callable, Dict, Any, Optional
+from config import config
+from utils.metrics import MCP_BREAKER_STATE, MCP_BREAKER_TRIPS
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling a server whose circuit breaker is open"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ServerHealth:
+    """Rolling outcomes of the recent calls to one server, and its breaker state"""
+
+    def __init__(self, window: int):
+        self.calls = deque(maxlen=window)  # (ok, latency) per call
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.open_for = 0.0
+        self.trips = 0
+        self.last_error: Optional[str] = None
+        self.changed_at = time.time()
+
+    def failure_rate(self) -> float:
+        if not self.calls:
+            return 0.0
+        return sum(1 for ok, _ in self.calls if not ok) / len(self.calls)
+
+    def to_dict(self) -> Dict[str, Any]:
+        latencies = sorted(latency for _, latency in self.calls)
+        stats = {
+            'state': self.state,
+            'calls': len(self.calls),
+            'failure_rate': round(self.failure_rate(), 3),
+            'latency_p50_ms': round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+            'latency_p95_ms': round(latencies[int(0.95 * (len(latencies) - 1))] * 1000, 1) if latencies else None,
+            'trips': self.trips,
+            'last_error': self.last_error,
+            'changed_at': datetime.fromtimestamp(self.changed_at).isoformat()
+        }
+        if self.state != CLOSED:
+            stats['retry_in_s'] = round(max(0.0, self.opened_at + self.open_for - time.monotonic()), 1)
+        return stats
+
+
+class HealthTracker:
+    """Per-server health with a circuit breaker in front of every tool call.
+
+    Each server keeps its last ``window`` call outcomes. Once at least
+    ``min_calls`` are recorded and the failure rate reaches ``failure_rate``,
+    the breaker opens: calls fail fast with CircuitOpen instead of waiting out
+    session start and call timeouts. After ``open_seconds`` it goes half-open
+    and the agent probes the server in the background; a successful probe
+    closes it, a failed one re-opens it for twice as long (up to
+    ``max_open_seconds``). Tool results flagged ``isError`` do not count as
+    failures, since the server itself answered.
+
+    ``on_change(server, state)`` is called whenever a breaker changes state.
+    """
+
+    def __init__(self, window: int = None, min_calls: int = None, failure_rate: float = None,
+                 open_seconds: float = None, max_open_seconds: float = None,
+                 on_change: Callable[[str, str], None] = None):
+        self.window = window or config.MCP_BREAKER_WINDOW
+        self.min_calls = min_calls or config.MCP_BREAKER_MIN_CALLS
+        self.failure_rate = failure_rate or config.MCP_BREAKER_FAILURE_RATE
+        self.open_seconds = open_seconds or config.MCP_BREAKER_OPEN_SECONDS
+        self.max_open_seconds = max_open_seconds or config.MCP_BREAKER_MAX_OPEN_SECONDS
+        self.on_change = on_change
+        self._servers: Dict[str, ServerHealth] = {}
+        self._lock = threading.Lock()
+
+    def _health(self, server: str) -> ServerHealth:
+        health = self._servers.get(server)
+        if health is None:
+            health = self._servers[server] = ServerHealth(self.window)
+            MCP_BREAKER_STATE.labels(server).set(STATE_VALUES[CLOSED])
+        return health
+
+    def _set_state(self, server: str, health: ServerHealth, state: str) -> bool:
+        if health.state == state:
+            return False
+        health.state = state
+        health.changed_at = time.time()
+        MCP_BREAKER_STATE.labels(server).set(STATE_VALUES[state])
+        return True
+
+    def _open(self, server: str, health: ServerHealth, open_for: float) -> bool:
+        health.opened_at = time.monotonic()
+        health.open_for = open_for
+        health.trips += 1
+        MCP_BREAKER_TRIPS.labels(server).inc()
+        return self._set_state(server, health, OPEN)
+
+    def _notify(self, server: str, state: str):
+        if self.on_change:
+            self.on_change(server, state)
+
+    def register(self, server: str):
+        with self._lock:
+            self._health(server)
+
+    def is_available(self, server: str) -> bool:
+        health = self._servers.get(server)
+        return health is None or health.state == CLOSED
+
+    def check(self, server: str):
+        """Raise CircuitOpen unless calls to ``server`` may go through"""
+        health = self._servers.get(server)
+        if health is None or health.state == CLOSED:
+            return
+        retry_after = max(0.0, health.opened_at + health.open_for - time.monotonic())
+        raise CircuitOpen(
+            f"MCP server {server} is unavailable (circuit {health.state.replace('_', '-')}"
+            f" after {health.last_error or 'repeated failures'}); use another tool",
+            retry_after=retry_after
+        )
+
+    def record(self, server: str, ok: bool, latency: float, error: str = None):
+        """Record the outcome of one call; may open the breaker"""
+        with self._lock:
+            health = self._health(server)
+            health.calls.append((ok, latency))
+            if not ok:
+                health.last_error = error
+            tripped = (
+                health.state == CLOSED
+                and not ok
+                and len(health.calls) >= self.min_calls
+                and health.failure_rate() >= self.failure_rate
+            )
+            changed = tripped and self._open(server, health, self.open_seconds)
+        if changed:
+            self._notify(server, OPEN)
+
+    def probe_due(self, server: str) -> Optional[float]:
+        """Seconds until ``server`` should be probed, or None if its breaker is closed"""
+        health = self._servers.get(server)
+        if health is None or health.state == CLOSED:
+            return None
+        return max(0.0, health.opened_at + health.open_for - time.monotonic())
+
+    def begin_probe(self, server: str):
+        with self._lock:
+            changed = self._set_state(server, self._health(server), HALF_OPEN)
+        if changed:
+            self._notify(server, HALF_OPEN)
+
+    def probe_result(self, server: str, ok: bool, latency: float, error: str = None):
+        """Close the breaker after a successful probe, or re-open it with a longer wait"""
+        with self._lock:
+            health = self._health(server)
+            if ok:
+                # Start the window afresh so old failures do not trip it again
+                health.calls.clear()
+                health.calls.append((True, latency))
+                state = CLOSED
+                changed = self._set_state(server, health, CLOSED)
+            else:
+                health.last_error = error
+                state = OPEN
+                changed = self._open(server, health, min(self.max_open_seconds, max(self.open_seconds, health.open_for * 2)))
+        if changed:
+            self._notify(server, state)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {server: health.to_dict() for server, health in self._servers.items()}
@@ -1,15 +1,30 @@
 import asyncio
+import copy
 import json
 import os
 import time
 import traceback
-from typing import AsyncGenerator, Dict, Any, List
+from collections import OrderedDict
+from contextlib import aclosing
+from typing import AsyncGenerator, Dict, Any, List, Optional
 from datetime import datetime
-from mcp import ClientSession, StdioServerParameters
-from mcp.client.stdio import stdio_client
 from langchain_groq import ChatGroq
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, ToolMessage
+from mcp.shared.exceptions import McpError
 from config import config
+from agent.runtime import get_runtime
+from agent.session_pool import MCPSessionPool
+from agent.tool_cache import ToolResultCache
+from agent.catalog_cache import ToolCatalogCache, server_fingerprint
+from agent.tool_selector import ToolSelector, estimate_spec_tokens
+from agent.run_context import RunContext
+from agent.admission import AdmissionController, AdmissionRejected
+from agent.compaction import ContextCompactor, message_tokens
+from agent.rate_limiter import RateLimiter, RateLimitExceeded
+from agent.health import HealthTracker, OPEN, CLOSED
+from agent.model_router import ModelRouter
+from agent.answer_cache import AnswerCache
+from utils.metrics import MODEL_STREAM, RUNS_IN_FLIGHT, RUNS_QUEUED
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -17,25 +32,51 @@ load_dotenv()
 class EnhancedMCPAgent:
     def __init__(self):
         self.state = {
-            'status': 'idle',
-            'initialized': False,
-            'current_tool': None,
-            'tokens_used': 0
+            'initialized': False
         }
+        self.runs: Dict[str, RunContext] = {}
+        self.admission = AdmissionController()
+        self.compactor = ContextCompactor()
+        self.rate_limiter = RateLimiter()
+        self.health = HealthTracker(on_change=self._on_health_change)
+        self.model_router = ModelRouter()
+        self._probes = {}
         self.mcp_servers = {}
+        self.pool = MCPSessionPool()
+        self.tool_cache = ToolResultCache(disk_path=config.TOOL_CACHE_DISK_PATH) if config.TOOL_CACHE_ENABLED else None
+        self.answer_cache = AnswerCache() if config.ANSWER_CACHE_ENABLED else None
+        self.tool_catalog = ToolCatalogCache(config.TOOL_CATALOG_CACHE_PATH) if config.TOOL_CATALOG_CACHE_PATH else None
+        self._server_tools = {}
         self._available_tools_info = []
+        self._tool_index = {}
+        self._catalog_version = 0
+        self._tool_specs = None
+        self._tool_selector = ToolSelector()
+        self._bound_models = OrderedDict()
+        self._bound_models_key = None
+        self.server_status = {}
+        self._ready_event = None
+        self._discovery_task = None
+        self._revalidating = set()
         self.model_name = config.AGENT_MODEL
         self.temperature = config.AGENT_TEMPERATURE
         self.model = None
+        self._fallback_models = {}
 
     def update_config(self, model=None, temperature=None):
         """Update agent settings dynamically"""
-        if model:
+        changed = False
+        if model and model != self.model_name:
             self.model_name = model
-        if temperature is not None:
+            changed = True
+        if temperature is not None and temperature != self.temperature:
             self.temperature = temperature
+            changed = True
+        if not changed and self.model is not None:
+            return
         
-        # Re-initialize model with new settings
+        # Re-initialize model with new settings; the bound model is keyed on it
+        self._fallback_models = {}
         api_key = os.getenv("GROQ_API_KEY")
         if api_key:
             self.model = ChatGroq(
@@ -48,14 +89,8 @@ class EnhancedMCPAgent:
     def initialize_sync(self):
         """Initialize the agent synchronously"""
         try:
-            # Create a new event loop for this thread if needed
-            try:
-                loop = asyncio.get_event_loop()
-            except RuntimeError:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-            
-            return loop.run_until_complete(self.initialize_async())
+            # Run on the shared runtime loop so pooled sessions outlive this call
+            return get_runtime().run(self.initialize_async())
         except Exception as e:
             print(f"Agent initialization sync error: {e}")
             traceback.print_exc()
@@ -86,8 +121,19 @@ class EnhancedMCPAgent:
                     self.mcp_servers[name] = {
                         'command': cfg['command'],
                         'args': args,
-                        'env': env
+                        'env': env,
+                        'pool_size': cfg.get('poolSize'),
+                        'idle_ttl': cfg.get('idleTtl'),
+                        'lazy': cfg.get('lazy', config.MCP_LAZY_START),
+                        'fingerprint': server_fingerprint(cfg)
                     }
+                    self.pool.register(name, self.mcp_servers[name])
+                    self._mark_server(name, 'pending')
+                    if self.tool_cache:
+                        self.tool_cache.configure_server(name, cfg.get('cache', {}))
+                    self.rate_limiter.configure_server(name, cfg.get('rateLimit', {}))
+                    self.compactor.results.configure_server(name, cfg.get('compaction', {}))
+                    self.health.register(name)
                     print(f"Registered MCP server: {name}")
                 except Exception as e:
                     print(f"Failed to register server {name}: {e}")
@@ -105,12 +151,25 @@ class EnhancedMCPAgent:
                 max_retries=0
             )
 
-            # Collect all available tools
-            await self._refresh_tools()
+            # Start from the cached catalog if we have one, then discover the
+            # other servers in the background; tools join the live list as each
+            # server comes online, and we become ready once the minimum set is
+            # available. Lazy servers with cached tools are not started until
+            # one of their tools is called
+            self._ready_event = asyncio.Event()
+            if self.tool_catalog and self._load_tool_snapshot():
+                print(f"[{datetime.now().strftime('%H:%M:%S')}] Warm start from cached tool catalog, revalidating in background")
+            eager = [name for name, cfg in self.mcp_servers.items()
+                     if not cfg['lazy'] or self.server_status[name].get('state') != 'cached']
+            if len(eager) < len(self.mcp_servers):
+                print(f"[{datetime.now().strftime('%H:%M:%S')}] {len(self.mcp_servers) - len(eager)} servers will start on first use")
+            self._discovery_task = asyncio.create_task(self._discover_all(eager))
+            self._check_ready()
+            await self._ready_event.wait()
             
             self.state['initialized'] = True
-            self.state['status'] = 'idle'
-            print(f"Agent initialized successfully with {len(self._available_tools_info)} tools")
+            ready = sum(1 for name in self.mcp_servers if self._server_available(name))
+            print(f"Agent initialized successfully with {len(self._available_tools_info)} tools ({ready}/{len(self.mcp_servers)} servers ready)")
             return True
             
         except Exception as e:
@@ -118,174 +177,640 @@ class EnhancedMCPAgent:
             traceback.print_exc()
             return False
 
-    async def _refresh_tools(self):
-        """Fetch tools from all registered MCP servers in parallel"""
-        print(f"[{datetime.now().strftime('%H:%M:%S')}] Fetching tools from {len(self.mcp_servers)} MCP servers...")
+    @staticmethod
+    def _tool_infos(name: str, tools_result) -> List[Dict[str, Any]]:
+        return [{
+            'name': tool.name,
+            'description': tool.description,
+            'input_schema': tool.inputSchema,
+            'server': name
+        } for tool in tools_result.tools]
+
+    async def _fetch_server_tools(self, name: str) -> Optional[List[Dict[str, Any]]]:
+        """List the tools of one server, or None if it could not be reached"""
+        started = time.perf_counter()
+        try:
+            print(f"Connecting to {name}...")
+            self._mark_server(name, 'connecting')
+            # Use a longer timeout for server connection/initialization;
+            # the session stays warm in the pool for later tool calls
+            async with asyncio.timeout(config.MCP_DISCOVERY_TIMEOUT):
+                tools_result = await self.pool.list_tools(name)
+            if self.health.is_available(name):
+                self.health.record(name, True, time.perf_counter() - started)
+            else:
+                # Reaching a tripped server counts as a successful probe
+                self.health.probe_result(name, True, time.perf_counter() - started)
+            server_tools = self._tool_infos(name, tools_result)
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] Found {len(server_tools)} tools in {name}")
+            return server_tools
+        except Exception as e:
+            # Capture specific error info for Semantic Scholar or others
+            error_detail = str(e) or type(e).__name__
+            if "TaskGroup" in error_detail:
+                error_detail = "Server subprocess failed to start or exited early (check UV/NPX installation)"
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] Could not fetch tools from {name}: {error_detail}")
+            self._mark_server(name, 'failed', error=error_detail)
+            if self.health.is_available(name):
+                self.health.record(name, False, time.perf_counter() - started, error_detail)
+            return None
+
+    async def _discover_server(self, name: str, retries: Optional[int] = 0) -> bool:
+        """Fetch one server's tools and register them as soon as they arrive.
+
+        Failed servers are retried ``retries`` times, or with None for as long
+        as the agent runs, backing off up to MCP_DISCOVERY_MAX_DELAY, so a
+        server that comes up late joins the live tool list. Returns True if
+        the catalog changed.
+        """
+        attempt = 0
+        while True:
+            server_tools = await self._fetch_server_tools(name)
+            self.server_status[name]['attempts'] += 1
+            if server_tools is not None:
+                changed = self._set_server_tools(name, server_tools)
+                if changed:
+                    self._rebuild_tool_list()
+                self._mark_server(name, 'ready')
+                self._check_ready()
+                if attempt:
+                    print(f"[{datetime.now().strftime('%H:%M:%S')}] {name} came online after {attempt} retries, now {len(self._available_tools_info)} tools")
+                return changed
+            # Unreachable servers keep their last known tools
+            self._check_ready()
+            if retries is not None and attempt >= retries:
+                return False
+            # The exponent is capped too, so the delay cannot overflow on a long-running agent
+            await asyncio.sleep(min(config.MCP_DISCOVERY_RETRY_DELAY * (2 ** min(attempt, 16)), config.MCP_DISCOVERY_MAX_DELAY))
+            attempt += 1
+
+    async def _refresh_tools(self, retries: Optional[int] = 0, names: List[str] = None) -> bool:
+        """Fetch tools from the given (default: all) MCP servers in parallel; returns True if the catalog changed"""
+        names = list(self.mcp_servers) if names is None else names
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] Fetching tools from {len(names)} MCP servers...")
         
-        async def fetch_from_server(name, cfg):
-            server_tools = []
+        # Run all fetches in parallel; each server registers its tools on arrival
+        results = await asyncio.gather(*(self._discover_server(name, retries) for name in names))
+        return any(results)
+
+    async def _discover_all(self, names: List[str] = None):
+        """Background discovery of the given (default: all) servers, retrying ones that fail until they come up"""
+        try:
+            if await self._refresh_tools(retries=None, names=names):
+                print(f"[{datetime.now().strftime('%H:%M:%S')}] Tool catalog updated, now {len(self._available_tools_info)} tools")
+            else:
+                print(f"[{datetime.now().strftime('%H:%M:%S')}] Tool catalog is up to date")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] Tool discovery failed: {e}")
+
+    def _load_tool_snapshot(self) -> int:
+        """Load cached tools for servers whose config is unchanged; returns the number of servers hit"""
+        hits = 0
+        for name, cfg in self.mcp_servers.items():
+            server_tools = self.tool_catalog.get(name, cfg['fingerprint'])
+            if server_tools is not None:
+                self._server_tools[name] = server_tools
+                self._mark_server(name, 'cached')
+                hits += 1
+        self._rebuild_tool_list()
+        return hits
+
+    def _mark_server(self, name: str, state: str, error: str = None):
+        status = self.server_status.setdefault(name, {'attempts': 0})
+        if state == 'connecting' and status.get('state') in ('ready', 'cached'):
+            # Revalidating a server we can already serve from
+            return
+        status['state'] = state
+        status['error'] = error
+        status['tools'] = len(self._server_tools.get(name, []))
+        status['updated_at'] = datetime.now().isoformat()
+
+    def _revalidate(self, name: str):
+        """Refresh the cached tools of a lazily started server once its process is up"""
+        if name in self._revalidating:
+            return
+        self._revalidating.add(name)
+
+        async def revalidate():
+            if await self._discover_server(name):
+                print(f"[{datetime.now().strftime('%H:%M:%S')}] Tool catalog of {name} changed, now {len(self._available_tools_info)} tools")
+
+        get_runtime().submit(revalidate())
+
+    def _server_available(self, name: str) -> bool:
+        return self.server_status.get(name, {}).get('state') in ('ready', 'cached')
+
+    def _check_ready(self):
+        """Flip readiness once the minimum set of servers is available (or every server has settled)"""
+        if self._ready_event is None or self._ready_event.is_set():
+            return
+        available = [name for name in self.mcp_servers if self._server_available(name)]
+        required = [name for name in config.AGENT_REQUIRED_SERVERS if name in self.mcp_servers]
+        min_ready = min(config.AGENT_MIN_READY_SERVERS, len(self.mcp_servers))
+        # A server settles once it is up or has failed MCP_DISCOVERY_RETRIES retries;
+        # discovery keeps retrying it in the background either way
+        settled = all(self._server_available(name) or status.get('attempts', 0) > config.MCP_DISCOVERY_RETRIES
+                      for name, status in self.server_status.items())
+        if settled or (len(available) >= min_ready and all(self._server_available(name) for name in required)):
+            self._ready_event.set()
+
+    def get_server_status(self) -> Dict[str, Dict[str, Any]]:
+        health = self.health.get_stats()
+        return {name: {**status, 'health': health.get(name)} for name, status in self.server_status.items()}
+
+    def _on_health_change(self, name: str, state: str):
+        """Hide a tripped server's tools from the model until it recovers, probing it meanwhile"""
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] Circuit breaker for {name} is now {state}")
+        if state == OPEN:
+            probe = self._probes.get(name)
+            if probe is None or probe.done():
+                self._probes[name] = get_runtime().submit(self._probe_server(name))
+        if state in (OPEN, CLOSED):
+            self._rebuild_tool_list()
+
+    async def _probe_server(self, name: str):
+        """Probe a tripped server in the background until its breaker closes.
+
+        A successful probe also refreshes the server's tools, which it may never
+        have reported if it tripped during discovery.
+        """
+        while (delay := self.health.probe_due(name)) is not None:
+            await asyncio.sleep(delay)
+            self.health.begin_probe(name)
+            started = time.perf_counter()
             try:
-                print(f"Connecting to {name}...")
-                params = StdioServerParameters(
-                    command=cfg['command'],
-                    args=cfg['args'],
-                    env=cfg['env']
-                )
-                
-                # Use a longer timeout for server connection/initialization
-                async with asyncio.timeout(60):
-                    async with stdio_client(params) as (read, write):
-                        async with ClientSession(read, write) as session:
-                            await session.initialize()
-                            tools_result = await session.list_tools()
-                            for tool in tools_result.tools:
-                                server_tools.append({
-                                    'name': tool.name,
-                                    'description': tool.description,
-                                    'input_schema': tool.inputSchema,
-                                    'server': name
-                                })
-                            print(f"[{datetime.now().strftime('%H:%M:%S')}] Found {len(tools_result.tools)} tools in {name}")
+                async with asyncio.timeout(config.MCP_INIT_TIMEOUT):
+                    tools_result = await self.pool.list_tools(name)
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                # Capture specific error info for Semantic Scholar or others
-                error_detail = str(e)
-                if "TaskGroup" in error_detail:
-                    error_detail = "Server subprocess failed to start or exited early (check UV/NPX installation)"
-                print(f"[{datetime.now().strftime('%H:%M:%S')}] Could not fetch tools from {name}: {error_detail}")
-            return server_tools
+                self.health.probe_result(name, False, time.perf_counter() - started, str(e) or type(e).__name__)
+            else:
+                # Register the tools first; closing the breaker rebuilds the tool list
+                self._set_server_tools(name, self._tool_infos(name, tools_result))
+                self._mark_server(name, 'ready')
+                self.health.probe_result(name, True, time.perf_counter() - started)
+                self._check_ready()
 
-        # Run all fetches in parallel
-        tasks = [fetch_from_server(name, cfg) for name, cfg in self.mcp_servers.items()]
-        results = await asyncio.gather(*tasks)
-        
-        # Flatten results
-        all_tools = [tool for server_result in results for tool in server_result]
-        self._available_tools_info = all_tools
-
-    def get_langchain_tools(self):
-        """Convert MCP tools to an ultra-minimized format to fit within 2500 tokens"""
-        tools = []
-        for tool in self._available_tools_info:
-            desc = tool['description']
-            if len(desc) > 150:
-                desc = desc[:147] + "..."
-                
-            schema = json.loads(json.dumps(tool['input_schema'])) # Deep copy
-            if 'properties' in schema:
-                for prop in schema['properties']:
-                    if isinstance(schema['properties'][prop], dict):
-                        p_desc = schema['properties'][prop].get('description', '')
-                        if len(p_desc) > 50:
-                            schema['properties'][prop]['description'] = p_desc[:47] + "..."
-                        
-                        schema['properties'][prop].pop('example', None)
-                        schema['properties'][prop].pop('examples', None)
-                
-            tools.append({
-                "type": "function",
-                "function": {
-                    "name": tool['name'],
-                    "description": desc,
-                    "parameters": schema
-                }
-            })
-        return tools
+    def _set_server_tools(self, name: str, server_tools: List[Dict[str, Any]]) -> bool:
+        changed = self._server_tools.get(name) != server_tools
+        self._server_tools[name] = server_tools
+        if self.tool_catalog:
+            self.tool_catalog.put(name, self.mcp_servers[name]['fingerprint'], server_tools)
+        return changed
+
+    def _rebuild_tool_list(self):
+        # Swap in a new list rather than mutating the one in-flight requests are reading
+        tools = [tool for name in self.mcp_servers for tool in self._server_tools.get(name, [])]
+        index = {}
+        for tool in tools:
+            # First server wins on duplicate names, as with the old linear scan
+            index.setdefault(tool['name'], tool)
+        self._tool_index = index
+        # Tools of servers with an open breaker stay routable but are not offered
+        self._available_tools_info = [tool for tool in tools if self.health.is_available(tool['server'])]
+        self._catalog_version += 1
+
+    def get_tool_info(self, tool_name: str) -> Optional[Dict[str, Any]]:
+        return self._tool_index.get(tool_name)
+
+    @staticmethod
+    def _compile_tool_spec(tool: Dict[str, Any]) -> Dict[str, Any]:
+        """Convert one MCP tool to an ultra-minimized function spec"""
+        desc = tool['description'] or ''
+        if len(desc) > 150:
+            desc = desc[:147] + "..."
+            
+        schema = copy.deepcopy(tool['input_schema'] or {})
+        if 'properties' in schema:
+            for prop in schema['properties']:
+                if isinstance(schema['properties'][prop], dict):
+                    p_desc = schema['properties'][prop].get('description', '')
+                    if len(p_desc) > 50:
+                        schema['properties'][prop]['description'] = p_desc[:47] + "..."
+                    
+                    schema['properties'][prop].pop('example', None)
+                    schema['properties'][prop].pop('examples', None)
+            
+        return {
+            "type": "function",
+            "function": {
+                "name": tool['name'],
+                "description": desc,
+                "parameters": schema
+            }
+        }
+
+    def _compiled_tools(self):
+        """Minimized specs and their token estimates, compiled once per catalog version"""
+        cached = self._tool_specs
+        if cached is not None and cached[0] == self._catalog_version:
+            return cached
+        version = self._catalog_version
+        tools_info = self._available_tools_info
+        specs = [self._compile_tool_spec(tool) for tool in tools_info]
+        cached = (version, tools_info, specs, [estimate_spec_tokens(spec) for spec in specs])
+        self._tool_specs = cached
+        return cached
+
+    def get_langchain_tools(self, query: str = None):
+        """Convert MCP tools to an ultra-minimized format.
+
+        With a query, only the top-ranked tools that fit AGENT_TOOL_TOKEN_BUDGET
+        tokens are returned; without one (or if nothing matches) the full set is.
+        """
+        version, tools_info, specs, spec_tokens = self._compiled_tools()
+        if not query or config.AGENT_TOOL_TOP_K <= 0 or len(specs) <= config.AGENT_TOOL_TOP_K:
+            return specs
+        self._tool_selector.ensure_index(version, tools_info)
+        selected = self._tool_selector.select(query, spec_tokens, config.AGENT_TOOL_TOP_K, config.AGENT_TOOL_TOKEN_BUDGET)
+        if selected is None:
+            return specs
+        return [specs[i] for i in selected]
+
+    def _model_chain(self) -> List[str]:
+        """The selected model followed by its fallbacks"""
+        return [self.model_name] + [name for name in config.AGENT_FALLBACK_MODELS if name != self.model_name]
 
-    async def stream_response(self, user_input: str) -> AsyncGenerator[str, None]:
+    def _fallback_model(self, model_name: str):
+        """A fallback model with the current temperature, created on first use"""
+        model = self._fallback_models.get(model_name)
+        if model is None:
+            model = self._fallback_models[model_name] = ChatGroq(
+                api_key=os.getenv("GROQ_API_KEY"),
+                model_name=model_name,
+                temperature=self.temperature,
+                max_retries=0
+            )
+        return model
+
+    def _get_bound_model(self, tools=None, model_name: str = None):
+        """Model with the given tool specs bound, reused until the catalog or model changes"""
+        if tools is None:
+            tools = self.get_langchain_tools()
+        key = (self.model, self._catalog_version)
+        if self._bound_models_key is None or self._bound_models_key[0] is not key[0] or self._bound_models_key[1] != key[1]:
+            self._bound_models = OrderedDict()
+            self._bound_models_key = key
+        model_name = model_name or self.model_name
+        model = self.model if model_name == self.model_name else self._fallback_model(model_name)
+        names = (model_name, tuple(spec['function']['name'] for spec in tools))
+        bound = self._bound_models.get(names)
+        if bound is None:
+            bound = model.bind_tools(tools) if tools else model
+            self._bound_models[names] = bound
+            # Keep one entry per distinct tool subset, bounded
+            while len(self._bound_models) > 64:
+                self._bound_models.popitem(last=False)
+        else:
+            self._bound_models.move_to_end(names)
+        return bound
+
+    async def stream_response(self, user_input: str, run: RunContext = None, use_cache: bool = True) -> AsyncGenerator[Dict[str, Any], None]:
+        """Run the agent on ``user_input``, yielding its events.
+
+        A repeated query is answered from the answer cache by replaying the
+        events of the earlier run, unless ``use_cache`` is False; a fresh
+        answer is stored either way.
+        """
         if not self.state['initialized']:
-            yield json.dumps({'type': 'error', 'message': 'Agent not initialized'})
+            yield {'type': 'error', 'message': 'Agent not initialized'}
             return
 
-        self.state['status'] = 'thinking'
+        run = run or RunContext(user_input)
+        run.bind_task()
+        self.runs[run.run_id] = run
+        try:
+            cache_context = (self.model_name, self.temperature, self._catalog_version)
+            hit = self.answer_cache.get(user_input, cache_context) if use_cache and self.answer_cache else None
+            if hit:
+                yield {
+                    'type': 'run',
+                    'run_id': run.run_id,
+                    'cached': True,
+                    'cache_age': round(time.time() - hit['created_at'], 1),
+                    'similarity': hit['similarity']
+                }
+                for event in hit['events']:
+                    yield dict(event)
+                return
+            yield {'type': 'run', 'run_id': run.run_id, 'cached': False}
+            queued = False
+            try:
+                async with aclosing(self.admission.admit(run)) as queue_positions:
+                    async for position in queue_positions:
+                        if not queued:
+                            queued = True
+                            RUNS_QUEUED.inc()
+                        yield {'type': 'queued', 'run_id': run.run_id, 'position': position}
+            except AdmissionRejected as e:
+                run.status = 'rejected'
+                yield {'type': 'error', 'message': str(e), 'code': e.status_code, **e.to_dict()}
+                return
+            finally:
+                if queued:
+                    RUNS_QUEUED.dec()
+            RUNS_IN_FLIGHT.inc()
+            recorded = [] if self.answer_cache else None
+            try:
+                async for event in self._run_steps(run):
+                    if recorded is not None:
+                        recorded.append(event)
+                    yield event
+                # Only answers from runs that went through cleanly are reused
+                if recorded and self._cacheable(recorded):
+                    self.answer_cache.set(user_input, cache_context, recorded)
+            finally:
+                RUNS_IN_FLIGHT.dec()
+                self.admission.release(run)
+        except asyncio.CancelledError:
+            run.status = 'cancelled'
+            raise
+        finally:
+            if run.status not in ('cancelled', 'rejected'):
+                run.status = 'done'
+            self.runs.pop(run.run_id, None)
+
+    @staticmethod
+    def _cacheable(events: List[Dict[str, Any]]) -> bool:
+        """Whether a finished run's events may be replayed from the answer cache.
+
+        The run must have had no errors and no failed tool calls (an open
+        breaker or a rate limit would otherwise be replayed for the whole TTL),
+        and its last model step must be a final answer rather than tool calls
+        cut off by AGENT_MAX_STEPS.
+        """
+        last_usage = max((i for i, event in enumerate(events) if event['type'] == 'usage'), default=None)
+        if last_usage is None:
+            return False
+        for i, event in enumerate(events):
+            if event['type'] == 'error' or (event['type'] == 'tool_result' and not event['success']):
+                return False
+            if i > last_usage and event['type'] in ('tool_start', 'tool_result'):
+                return False
+        return True
+
+    async def _run_steps(self, run: RunContext) -> AsyncGenerator[Dict[str, Any], None]:
+        """The model/tool step loop of an admitted run"""
+        user_input = run.user_input
         system_msg = SystemMessage(content=config.AGENT_SYSTEM_PROMPT)
         messages = [system_msg, HumanMessage(content=user_input)]
         
-        tools = self.get_langchain_tools()
-        model_with_tools = self.model.bind_tools(tools) if tools else self.model
+        # Offer only the tools relevant to this query to keep the prompt small
+        tools_query = user_input
+        catalog_version = None
         
         max_steps = config.AGENT_MAX_STEPS
-        step = 0
         
-        while step < max_steps:
-            step += 1
+        while run.step < max_steps:
+            run.step += 1
+            if catalog_version != self._catalog_version:
+                # (Re)bind when servers join, trip or recover mid-run
+                catalog_version = self._catalog_version
+                tools = self.get_langchain_tools(tools_query)
+                offered = {spec['function']['name'] for spec in tools}
+                tools_tokens = sum(estimate_spec_tokens(spec) for spec in tools)
             response_text = ""
             current_tool_calls = []
+            input_tokens = output_tokens = 0
+            reported = False
+            
+            # Keep the prompt inside this step's share of the run's token budget
+            compaction = self.compactor.compact(messages, run.step, run.input_tokens, overhead=tools_tokens)
             
-            self.state['status'] = 'streaming'
+            run.status = 'streaming'
+            answered_by = self.model_name
             try:
-                async for chunk in model_with_tools.astream(messages):
+                started = time.perf_counter()
+                # Fails over along the fallback chain if a model is slow to start or stalls;
+                # every model stream, hedges included, takes its own model slot
+                chain = self._model_chain()
+                async for kind, chunk in self.model_router.stream(chain, lambda name: self._get_bound_model(tools, name), messages,
+                                                              slot=self.admission.model_slot):
+                    if kind == 'model':
+                        answered_by = chunk['model']
+                        # Tool calls of a model we failed over from are incomplete
+                        current_tool_calls = []
+                        yield {'type': 'model', 'step': run.step, **chunk}
+                        continue
                     if chunk.content:
                         response_text += chunk.content
-                        yield json.dumps({'type': 'content', 'content': chunk.content})
+                        yield {'type': 'content', 'content': chunk.content}
                     if chunk.tool_calls:
                         for tc in chunk.tool_calls:
                             current_tool_calls.append(tc)
+                    if chunk.usage_metadata:
+                        input_tokens += chunk.usage_metadata.get('input_tokens', 0)
+                        output_tokens += chunk.usage_metadata.get('output_tokens', 0)
+                        reported = True
+                MODEL_STREAM.labels(answered_by).observe(time.perf_counter() - started)
             except Exception as e:
-                yield json.dumps({'type': 'error', 'message': f"Model error: {str(e)}"})
+                yield {'type': 'error', 'message': f"Model error: {str(e)}"}
                 break
 
+            ai_msg = AIMessage(content=response_text, tool_calls=current_tool_calls)
+            if not reported:
+                # Provider sent no usage metadata; fall back to an estimate
+                input_tokens = compaction['after']
+                output_tokens = message_tokens(ai_msg)
+            step_usage = run.record_usage(input_tokens, output_tokens, estimated=not reported)
+            yield {
+                'type': 'usage',
+                **step_usage,
+                'model': answered_by,
+                'run_input_tokens': run.input_tokens,
+                'run_output_tokens': run.output_tokens,
+                'compacted_tokens': compaction['before'] - compaction['after']
+            }
+
             if current_tool_calls:
-                ai_msg = AIMessage(content=response_text, tool_calls=current_tool_calls)
                 messages.append(ai_msg)
                 
+                # The model asked for a tool we didn't offer: widen to the full catalog
+                if any(tc['name'] not in offered for tc in current_tool_calls) and len(offered) < len(self._available_tools_info):
+                    tools_query = None
+                    catalog_version = None
+                
+                # Run independent calls concurrently; events stream as each finishes
+                results = {}
+                async for event in self._run_tool_calls(run, current_tool_calls, results):
+                    yield event
+                
+                # Tool messages must follow the order of the model's tool_calls
                 for tc in current_tool_calls:
-                    tool_name = tc['name']
-                    args = tc['args']
-                    tc_id = tc['id']
-                    
-                    tool_info = next((t for t in self._available_tools_info if t['name'] == tool_name), None)
-                    if not tool_info:
-                        error_msg = f"Tool {tool_name} not found"
-                        yield json.dumps({'type': 'error', 'message': error_msg})
-                        messages.append(ToolMessage(content=error_msg, tool_call_id=tc_id))
-                        continue
-                    
-                    server_name = tool_info['server']
-                    yield json.dumps({'type': 'tool_start', 'tool': tool_name, 'args': args})
-                    
-                    # Prevent rapid-fire search calls that trigger bot detection
-                    if 'search' in tool_name.lower():
-                        await asyncio.sleep(0.5)
-                    
-                    self.state['status'] = 'executing'
-                    
-                    # Store results locally to yield OUTSIDE context manager
-                    tool_res = ""
-                    is_ok = False
-                    try:
-                        cfg = self.mcp_servers[server_name]
-                        params = StdioServerParameters(command=cfg['command'], args=cfg['args'], env=cfg['env'])
-                        
-                        async with stdio_client(params) as (read, write):
-                            async with ClientSession(read, write) as session:
-                                await asyncio.wait_for(session.initialize(), timeout=20.0)
-                                call_res = await asyncio.wait_for(session.call_tool(tool_name, args), timeout=60.0)
-                                tool_res = "\n".join([i.text if hasattr(i, "text") else str(i) for i in call_res.content])
-                                is_ok = not call_res.isError
-                    except Exception as e:
-                        tool_res = f"Execution error: {str(e)}"
-                        is_ok = False
-
-                    # Tight truncation for speed and token savings
-                    if len(tool_res) > 1000:
-                        tool_res = tool_res[:1000] + "\n... (result truncated) ..."
-                    
-                    yield json.dumps({
-                        'type': 'tool_result',
-                        'tool': tool_name,
-                        'result': tool_res,
-                        'success': is_ok
-                    })
-                    messages.append(ToolMessage(content=tool_res, tool_call_id=tc_id))
+                    messages.append(ToolMessage(content=results[tc['id']], tool_call_id=tc['id']))
                 
                 continue
             else:
                 break
+
+    async def _execute_tool(self, server_name: str, tool_name: str, args: Dict[str, Any]):
+        """Call a tool on its server and return (result_text, success, cached)"""
+        cached = self.tool_cache.get(server_name, tool_name, args) if self.tool_cache else None
+        if cached is not None:
+            return self.compactor.compact_result(cached, server_name, tool_name), True, True
         
-        self.state['status'] = 'idle'
+        try:
+            # Fail fast while the server's breaker is open
+            self.health.check(server_name)
+            # Shared budget per server/tool; only waits once it is used up
+            await self.rate_limiter.acquire(server_name, tool_name)
+            async with self.admission.tool_slot():
+                started = time.perf_counter()
+                try:
+                    call_res = await self.pool.call_tool(server_name, tool_name, args)
+                except McpError:
+                    # The server answered, just with an error
+                    self.health.record(server_name, True, time.perf_counter() - started)
+                    raise
+                except Exception as e:
+                    self.health.record(server_name, False, time.perf_counter() - started, str(e) or type(e).__name__)
+                    raise
+                self.health.record(server_name, True, time.perf_counter() - started)
+            if self.server_status.get(server_name, {}).get('state') == 'cached':
+                # First call started this server; check its catalog on the warm session
+                self._revalidate(server_name)
+            tool_res = "\n".join([i.text if hasattr(i, "text") else str(i) for i in call_res.content])
+            is_ok = not call_res.isError
+            if is_ok and self.tool_cache:
+                self.tool_cache.set(server_name, tool_name, args, tool_res)
+        except RateLimitExceeded as e:
+            # Not a tool failure; tell the model it can wait or pick another source
+            tool_res = f"Rate limited: {e}. Try a different tool or call this one again later."
+            is_ok = False
+        except Exception as e:
+            tool_res = f"Execution error: {str(e)}"
+            is_ok = False
+
+        return self.compactor.compact_result(tool_res, server_name, tool_name), is_ok, False
+
+    async def _run_tool_calls(self, run: RunContext, tool_calls: List[Dict[str, Any]], results: Dict[str, str]) -> AsyncGenerator[Dict[str, Any], None]:
+        """Execute one step's tool calls with bounded fan-out, yielding events as they happen.
+
+        Fills ``results`` with the ToolMessage content for every tool_call_id.
+        """
+        events = asyncio.Queue()
+        limit = asyncio.Semaphore(max(1, config.AGENT_MAX_PARALLEL_TOOLS))
+        
+        async def run_one(tc):
+            tool_name = tc['name']
+            args = tc['args']
+            tc_id = tc['id']
+            
+            tool_info = self.get_tool_info(tool_name)
+            if not tool_info:
+                error_msg = f"Tool {tool_name} not found"
+                results[tc_id] = error_msg
+                await events.put({'type': 'error', 'message': error_msg})
+                return
+            
+            async with limit:
+                run.status = 'executing'
+                run.current_tool = tool_name
+                await events.put({'type': 'tool_start', 'id': tc_id, 'tool': tool_name, 'args': args})
+                tool_res, is_ok, cached = await self._execute_tool(tool_info['server'], tool_name, args)
+            
+            results[tc_id] = tool_res
+            await events.put({
+                'type': 'tool_result',
+                'id': tc_id,
+                'tool': tool_name,
+                'result': tool_res,
+                'success': is_ok,
+                'cached': cached
+            })
+        
+        async def run_and_signal(tc):
+            try:
+                await run_one(tc)
+            finally:
+                events.put_nowait(None)
+        
+        for i, tc in enumerate(tool_calls):
+            if not tc.get('id'):
+                tc['id'] = f"call_{i}"
+        
+        tasks = [asyncio.create_task(run_and_signal(tc)) for tc in tool_calls]
+        try:
+            remaining = len(tasks)
+            while remaining:
+                event = await events.get()
+                if event is None:
+                    remaining -= 1
+                    continue
+                yield event
+            
+            for task in tasks:
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            run.current_tool = None
 
     def get_state(self) -> Dict[str, Any]:
-        return self.state.copy()
+        runs = [run.to_dict() for run in list(self.runs.values())]
+        active = [run for run in runs if run['status'] != 'queued']
+        if not active:
+            status = 'idle'
+        elif len(active) == 1:
+            status = active[0]['status']
+        else:
+            status = 'busy'
+        return {
+            **self.state,
+            'status': status,
+            'active_runs': len(active),
+            'queued_runs': len(runs) - len(active),
+            'runs': runs
+        }
+
+    def get_run(self, run_id: str) -> Optional[RunContext]:
+        return self.runs.get(run_id)
+
+    def cancel_run(self, run_id: str) -> bool:
+        run = self.runs.get(run_id)
+        return run.cancel() if run else False
+
+    def get_admission_stats(self) -> Dict[str, Any]:
+        return self.admission.get_stats()
+
+    def get_pool_stats(self) -> Dict[str, Any]:
+        return self.pool.get_stats()
+
+    def get_pool_capacity(self) -> Dict[str, Any]:
+        return self.pool.get_capacity()
+
+    def get_rate_limit_stats(self) -> Dict[str, Any]:
+        return self.rate_limiter.get_stats()
+
+    def get_health_stats(self) -> Dict[str, Any]:
+        return self.health.get_stats()
+
+    def get_cache_stats(self) -> Dict[str, Any]:
+        return self.tool_cache.get_stats() if self.tool_cache else {'enabled': False}
+
+    def get_answer_cache_stats(self) -> Dict[str, Any]:
+        return self.answer_cache.get_stats() if self.answer_cache else {'enabled': False}
+
+    async def _close(self):
+        if self._discovery_task and not self._discovery_task.done():
+            self._discovery_task.cancel()
+        for probe in self._probes.values():
+            probe.cancel()
+        await self.pool.close()
+
+    def shutdown(self):
+        """Close pooled MCP sessions and stop the runtime loop"""
+        runtime = get_runtime()
+        if not runtime.is_running():
+            return
+        try:
+            runtime.run(self._close(), timeout=15)
+        except Exception as e:
+            print(f"Agent shutdown error: {e}")
+        runtime.stop()
     
     def get_context_info(self) -> Dict[str, Any]:
         return {
@@ -293,7 +818,8 @@ class EnhancedMCPAgent:
             'system_prompt': config.AGENT_SYSTEM_PROMPT,
             'model': self.model_name,
             'temperature': self.temperature,
-            'max_steps': config.AGENT_MAX_STEPS
+            'max_steps': config.AGENT_MAX_STEPS,
+            'run_token_budget': self.compactor.run_budget
         }
 
 # Global agent instance
@@ -303,4 +829,7 @@ def get_agent():
     return agent_instance
 
 def init_agent():
-    return agent_instance.initialize_sync()
\ No newline at end of file
+    return agent_instance.initialize_sync()
+
+def shutdown_agent():
+    agent_instance.shutdown()
\ No newline at end of file
@@ -0,0 +1,163 @@
+import asyncio
+import time
+from contextlib import nullcontext
+from typing import Any, AsyncGenerator, Callable, List, Optional, Tuple
+from langchain_core.messages import AIMessage, HumanMessage
+from config import config
+from utils.metrics import MODEL_TTFT, MODEL_FALLBACKS
+
+CONTINUE_PROMPT = "Your previous reply was cut off. Continue exactly where it stopped, without repeating anything."
+
+
+class ModelStalled(Exception):
+    """Raised when every model in the fallback chain missed its deadline"""
+
+
+def _has_token(chunk) -> bool:
+    return bool(chunk.content or getattr(chunk, 'tool_call_chunks', None) or chunk.tool_calls)
+
+
+class ModelRouter:
+    """Streams one model turn, failing over along a chain of models on deadlines.
+
+    A model that has not produced its first token within ``first_token_timeout``
+    is hedged: the next model in the chain starts on the same prompt, the
+    first of them to produce a token answers, and the other is cancelled.
+    With ``hedge`` off, the slow model is cancelled before the next one
+    starts. A model that errors before its first token is replaced right away.
+
+    Once a model has answered, only its chunks are passed on, so the client
+    never sees two answers. If it then goes silent for ``stall_timeout``
+    (or fails), the next model is asked to continue from the text already
+    sent rather than start over. Timeouts of 0 disable the deadline.
+
+    Each model stream holds its own ``slot`` while it runs, and the deadlines
+    only start once it has one. When every model in the chain has been
+    hedged, the router waits for the race to finish instead of giving up.
+    """
+
+    def __init__(self, first_token_timeout: float = None, stall_timeout: float = None, hedge: bool = None):
+        self.first_token_timeout = config.AGENT_FIRST_TOKEN_TIMEOUT if first_token_timeout is None else first_token_timeout
+        self.stall_timeout = config.AGENT_STALL_TIMEOUT if stall_timeout is None else stall_timeout
+        self.hedge = config.AGENT_HEDGE_ENABLED if hedge is None else hedge
+
+    async def stream(self, chain: List[str], bind: Callable[[str], Any], messages: List[Any],
+                     slot: Callable[[], Any] = None) -> AsyncGenerator[Tuple[str, Any], None]:
+        """Yield ``('model', info)`` once a model answers (again after a failover), then ``('chunk', chunk)``.
+
+        ``bind(name)`` returns the runnable to stream for a model in ``chain``;
+        ``slot()``, if given, is the async context manager each stream runs in.
+        """
+        queue = asyncio.Queue()
+        tasks = {}
+        dropped = set()
+        started = {}
+        admitted = set()
+        held = {}
+        reasons = {}
+        winner: Optional[int] = None
+        next_index = 0
+        reason = None
+        partial = ''
+
+        async def pump(index: int, prompt: List[Any]):
+            try:
+                async with slot() if slot else nullcontext():
+                    await queue.put((index, 'admitted', None))
+                    async for chunk in bind(chain[index]).astream(prompt):
+                        await queue.put((index, 'chunk', chunk))
+                await queue.put((index, 'done', None))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await queue.put((index, 'error', e))
+
+        def launch(prompt: List[Any]):
+            nonlocal next_index
+            index = next_index
+            next_index += 1
+            started[index] = time.perf_counter()
+            reasons[index] = reason
+            tasks[index] = asyncio.create_task(pump(index, prompt), name=f"model:{chain[index]}")
+            if index:
+                MODEL_FALLBACKS.labels(chain[index], reason).inc()
+
+        def cancel(keep: int = None):
+            for index, task in tasks.items():
+                if index != keep:
+                    task.cancel()
+                    dropped.add(index)
+
+        def resume_prompt() -> List[Any]:
+            if not partial:
+                return messages
+            return messages + [AIMessage(content=partial), HumanMessage(content=CONTINUE_PROMPT)]
+
+        launch(messages)
+        try:
+            while True:
+                timeout = self.first_token_timeout if winner is None else self.stall_timeout
+                running = [i for i in tasks if i not in dropped]
+                if winner is None and not admitted.intersection(running):
+                    # Still queued for a slot; the model has not been asked yet
+                    timeout = None
+                elif winner is None and next_index >= len(chain) and len(running) > 1:
+                    # No fallback left, so let the hedged models finish the race
+                    timeout = None
+                try:
+                    index, kind, payload = await asyncio.wait_for(queue.get(), timeout or None)
+                except asyncio.TimeoutError:
+                    if next_index >= len(chain):
+                        waited = 'its first token' if winner is None else 'more tokens'
+                        raise ModelStalled(f"{chain[next_index - 1]} timed out waiting for {waited} and no fallback model is left")
+                    if winner is None:
+                        reason = 'first_token_timeout'
+                        if not self.hedge:
+                            cancel()
+                        launch(messages)
+                    else:
+                        reason = 'stall'
+                        cancel()
+                        winner = None
+                        launch(resume_prompt())
+                    continue
+
+                if index in dropped:
+                    # Left over from a model we already gave up on
+                    continue
+                if kind == 'admitted':
+                    admitted.add(index)
+                    started[index] = time.perf_counter()
+                    continue
+                if kind == 'error':
+                    dropped.add(index)
+                    running = any(i not in dropped for i in tasks)
+                    if winner is None and running:
+                        # A hedged model is still in the race
+                        continue
+                    if next_index >= len(chain):
+                        raise payload
+                    reason = 'error'
+                    winner = None
+                    launch(resume_prompt())
+                    continue
+                if winner is None:
+                    if kind == 'chunk' and not _has_token(payload):
+                        # Some providers report usage ahead of the first token;
+                        # hold it until we know whether this model answers
+                        held.setdefault(index, []).append(payload)
+                        continue
+                    winner = index
+                    cancel(keep=index)
+                    MODEL_TTFT.labels(chain[index]).observe(time.perf_counter() - started[index])
+                    yield 'model', {'model': chain[index], 'fallback': index > 0, 'reason': reasons[index]}
+                    for chunk in held.pop(index, []):
+                        yield 'chunk', chunk
+                    held.clear()
+                if kind == 'done':
+                    return
+                partial += payload.content or ''
+                yield 'chunk', payload
+        finally:
+            cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
@@ -0,0 +1,155 @@
+import asyncio
+import time
+import threading
+from fnmatch import fnmatch
+from typing import Dict, Any, List, Optional, Tuple
+from config import config
+from utils.metrics import RATE_LIMIT_DELAYED, RATE_LIMIT_REJECTED
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a call would have to wait longer than the limiter allows"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Classic token bucket: ``rate`` tokens per second, holding at most ``burst``"""
+
+    def __init__(self, rate: float, burst: float = 1):
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.calls = 0
+        self.delayed = 0
+        self.rejected = 0
+        self.waited = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until one token is free, counting tokens already promised to waiting calls"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def to_dict(self) -> Dict[str, Any]:
+        self._refill(time.monotonic())
+        return {
+            'rate': self.rate,
+            'burst': self.burst,
+            'available': round(max(0.0, self.tokens), 2),
+            'calls': self.calls,
+            'delayed': self.delayed,
+            'rejected': self.rejected,
+            'waited_s': round(self.waited, 2)
+        }
+
+
+class RateLimiter:
+    """Token buckets per server and per tool, shared by every run.
+
+    Limits come from the ``"rateLimit"`` entry of a server in the MCP config
+    file, falling back to ``TOOL_RATE_LIMITS`` for tools::
+
+        "rateLimit": {"rate": 5, "burst": 10, "maxWait": 5,
+                      "tools": {"search_*": {"rate": 1, "burst": 2}}}
+
+    ``rate`` is calls per second. A call takes a token from the server bucket
+    and from the first matching tool bucket. It waits only when a bucket is
+    empty, and is rejected right away if the wait would exceed ``maxWait``.
+    ``"rateLimit": false`` disables limiting for a server.
+    """
+
+    def __init__(self, defaults: Dict[str, Dict[str, float]] = None, max_wait: float = None):
+        self.defaults = config.TOOL_RATE_LIMITS if defaults is None else defaults
+        self.max_wait = config.TOOL_RATE_LIMIT_MAX_WAIT if max_wait is None else max_wait
+        self._servers: Dict[str, Any] = {}
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def configure_server(self, server: str, settings):
+        """Apply the ``"rateLimit"`` entry of a server from the MCP config file"""
+        self._servers[server] = settings
+        for key in [key for key in self._buckets if key[0] == server]:
+            del self._buckets[key]
+
+    def _bucket(self, key: Tuple[str, str], limit: Dict[str, float]) -> Optional[TokenBucket]:
+        if not limit or not limit.get('rate'):
+            return None
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(limit['rate'], limit.get('burst', 1))
+        return bucket
+
+    def _buckets_for(self, server: str, tool: str) -> List[TokenBucket]:
+        settings = self._servers.get(server, {})
+        if settings is False:
+            return []
+        if not isinstance(settings, dict):
+            settings = {}
+        buckets = []
+        server_bucket = self._bucket((server, '*'), settings)
+        if server_bucket:
+            buckets.append(server_bucket)
+        # Per-server tool patterns win over the global defaults
+        for patterns in (settings.get('tools', {}), self.defaults):
+            match = next((p for p in patterns if fnmatch(tool, p)), None)
+            if match is not None:
+                tool_bucket = self._bucket((server, tool), patterns[match])
+                if tool_bucket:
+                    buckets.append(tool_bucket)
+                break
+        return buckets
+
+    def _max_wait(self, server: str) -> float:
+        settings = self._servers.get(server)
+        if isinstance(settings, dict) and 'maxWait' in settings:
+            return float(settings['maxWait'])
+        return self.max_wait
+
+    async def acquire(self, server: str, tool: str):
+        """Take a token for ``server:tool``, sleeping only if its budget is used up"""
+        with self._lock:
+            buckets = self._buckets_for(server, tool)
+            if not buckets:
+                return
+            now = time.monotonic()
+            wait = max(bucket.wait_time(now) for bucket in buckets)
+            if wait > self._max_wait(server):
+                for bucket in buckets:
+                    bucket.rejected += 1
+                RATE_LIMIT_REJECTED.labels(server, tool).inc()
+                raise RateLimitExceeded(
+                    f"Rate limit for {server}:{tool} exhausted, retry in {wait:.1f}s", retry_after=wait
+                )
+            # Reserve now so concurrent callers queue up behind us instead of racing
+            for bucket in buckets:
+                bucket.tokens -= 1
+                bucket.calls += 1
+                if wait > 0:
+                    bucket.delayed += 1
+                    bucket.waited += wait
+        if wait <= 0:
+            return
+        RATE_LIMIT_DELAYED.labels(server, tool).inc()
+        try:
+            await asyncio.sleep(wait)
+        except asyncio.CancelledError:
+            with self._lock:
+                for bucket in buckets:
+                    bucket.tokens = min(bucket.burst, bucket.tokens + 1)
+            raise
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = {}
+            for (server, tool), bucket in self._buckets.items():
+                stats.setdefault(server, {})[tool] = bucket.to_dict()
+            return stats
@@ -0,0 +1,79 @@
+import time
+import uuid
+import asyncio
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+
+class RunContext:
+    """State of a single agent run.
+
+    Each ``stream_response`` call gets its own context, so concurrent runs no
+    longer overwrite each other's status. ``cancel()`` is safe to call from any
+    thread.
+    """
+
+    def __init__(self, user_input: str = "", run_id: str = None):
+        self.run_id = run_id or uuid.uuid4().hex
+        self.user_input = user_input
+        self.status = 'queued'
+        self.step = 0
+        self.current_tool: Optional[str] = None
+        self.tokens_used = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.steps = []  # per-step token usage
+        self.created_at = datetime.now().isoformat()
+        self.started = time.monotonic()
+        self.admitted = False
+        self.cancelled = False
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def bind_task(self):
+        """Attach the task driving this run so it can be cancelled later"""
+        self._task = asyncio.current_task()
+        self._loop = asyncio.get_running_loop()
+
+    def cancel(self) -> bool:
+        self.cancelled = True
+        if self._task is None or self._task.done():
+            return False
+        self._loop.call_soon_threadsafe(self._task.cancel)
+        return True
+
+    def record_usage(self, input_tokens: int, output_tokens: int, estimated: bool = False) -> Dict[str, Any]:
+        """Add one model call's token usage to the run totals and return the step entry"""
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+        self.tokens_used = self.input_tokens + self.output_tokens
+        usage = {
+            'step': self.step,
+            'input_tokens': input_tokens,
+            'output_tokens': output_tokens,
+            'estimated': estimated
+        }
+        self.steps.append(usage)
+        return usage
+
+    def usage(self) -> Dict[str, Any]:
+        return {
+            'input_tokens': self.input_tokens,
+            'output_tokens': self.output_tokens,
+            'total_tokens': self.tokens_used,
+            'steps': list(self.steps)
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'run_id': self.run_id,
+            'status': self.status,
+            'step': self.step,
+            'current_tool': self.current_tool,
+            'tokens_used': self.tokens_used,
+            'input_tokens': self.input_tokens,
+            'output_tokens': self.output_tokens,
+            'created_at': self.created_at,
+            'elapsed': round(time.monotonic() - self.started, 2),
+            'cancelled': self.cancelled
+        }
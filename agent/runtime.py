@@ -0,0 +1,131 @@
+import asyncio
+import queue
+import threading
+import concurrent.futures
+from datetime import datetime
+
+
+class AgentRuntime:
+    """Long-lived asyncio event loop running on a dedicated daemon thread.
+
+    MCP sessions, pools and caches are bound to the loop they were created on,
+    so anything that must outlive a single request is scheduled here.
+    """
+
+    def __init__(self, name: str = "agent-runtime"):
+        self.name = name
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        self.start()
+        return self._loop
+
+    def is_running(self) -> bool:
+        return self._loop is not None and self._thread is not None and self._thread.is_alive()
+
+    def in_runtime(self) -> bool:
+        """True when called from a coroutine running on the runtime loop"""
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    def start(self):
+        """Start the loop thread if it is not running yet"""
+        with self._lock:
+            if self.is_running():
+                return
+            ready = threading.Event()
+
+            def run():
+                loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(loop)
+                self._loop = loop
+                ready.set()
+                try:
+                    loop.run_forever()
+                finally:
+                    try:
+                        loop.run_until_complete(loop.shutdown_asyncgens())
+                    except Exception:
+                        pass
+                    loop.close()
+
+            self._thread = threading.Thread(target=run, name=self.name, daemon=True)
+            self._thread.start()
+            ready.wait()
+
+    def submit(self, coro) -> concurrent.futures.Future:
+        """Schedule a coroutine on the runtime loop from any thread"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout: float = None):
+        """Run a coroutine on the runtime loop and block until it finishes"""
+        if self.in_runtime():
+            raise RuntimeError("AgentRuntime.run() cannot be called from the runtime loop")
+        return self.submit(coro).result(timeout)
+
+    async def call(self, coro):
+        """Await a coroutine on the runtime loop from any event loop"""
+        if self.in_runtime():
+            return await coro
+        return await asyncio.wrap_future(self.submit(coro))
+
+    def iterate(self, agen):
+        """Drive an async generator on the runtime loop and yield its items in the calling thread.
+
+        Lets a synchronous WSGI response stream an agent run while the run itself
+        is multiplexed with every other run on the shared loop. Closing the sync
+        generator (e.g. client disconnect) cancels the run.
+        """
+        items = queue.Queue()
+        done = object()
+
+        async def pump():
+            try:
+                async for item in agen:
+                    items.put_nowait((item, None))
+            except asyncio.CancelledError:
+                items.put_nowait((done, None))
+                raise
+            except Exception as e:
+                items.put_nowait((done, e))
+            else:
+                items.put_nowait((done, None))
+            finally:
+                await agen.aclose()
+
+        future = self.submit(pump())
+        try:
+            while True:
+                item, error = items.get()
+                if item is done:
+                    if error is not None:
+                        raise error
+                    return
+                yield item
+        finally:
+            if not future.done():
+                future.cancel()
+
+    def stop(self, timeout: float = 5.0):
+        """Stop the loop and wait for the thread to exit"""
+        with self._lock:
+            if not self.is_running():
+                return
+            loop, thread = self._loop, self._thread
+            loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+        self._loop = None
+        self._thread = None
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] Agent runtime stopped")
+
+
+# Global runtime instance
+runtime_instance = AgentRuntime()
+
+def get_runtime():
+    return runtime_instance
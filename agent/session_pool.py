@@ -0,0 +1,359 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Dict, Any, Optional
+import anyio
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.stdio import stdio_client
+from mcp.shared.exceptions import McpError
+from config import config
+from agent.runtime import get_runtime
+from utils.metrics import MCP_SESSION_INIT, MCP_CALL, MCP_TOOL_ERRORS, MCP_TOOL_TIMEOUTS, MCP_LIVE_SESSIONS, MCP_SESSION_EVICTIONS
+
+# Raised by the session's write stream when its transport has already shut
+# down, i.e. before the request was handed to the server. A connection lost
+# after sending surfaces as McpError or EndOfStream instead.
+UNSENT_REQUEST_ERRORS = (anyio.ClosedResourceError, anyio.BrokenResourceError)
+
+
+class PooledSession:
+    """A single long-lived, initialized MCP client session.
+
+    The stdio transport and ClientSession context managers are held open by a
+    dedicated task, since anyio requires them to be exited by the task that
+    entered them.
+    """
+
+    def __init__(self, server: str, cfg: Dict[str, Any]):
+        self.server = server
+        self.cfg = cfg
+        self.session: Optional[ClientSession] = None
+        self.error: Optional[BaseException] = None
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.calls = 0
+        self._discarded = False
+        self._ready = asyncio.Event()
+        self._closing = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def alive(self) -> bool:
+        return (
+            self.session is not None
+            and not self._discarded
+            and self._task is not None
+            and not self._task.done()
+        )
+
+    async def start(self, timeout: float):
+        self._task = asyncio.create_task(self._run(), name=f"mcp-session:{self.server}")
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            await self.close()
+            raise TimeoutError(f"MCP server {self.server} did not initialize within {timeout:.0f}s")
+        if not self.alive:
+            error = self.error or RuntimeError("session closed during initialization")
+            detail = str(error)
+            if "TaskGroup" in detail:
+                detail = "Server subprocess failed to start or exited early (check UV/NPX installation)"
+            raise ConnectionError(f"MCP server {self.server} failed to start: {detail}")
+
+    async def _run(self):
+        params = StdioServerParameters(
+            command=self.cfg['command'],
+            args=self.cfg['args'],
+            env=self.cfg['env']
+        )
+        try:
+            async with stdio_client(params) as (read, write):
+                async with ClientSession(read, write) as session:
+                    await session.initialize()
+                    self.session = session
+                    self._ready.set()
+                    await self._closing.wait()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.error = e
+        finally:
+            self.session = None
+            self._ready.set()
+
+    def discard(self):
+        """Mark the session unusable; it will be closed instead of returned to the pool"""
+        self._discarded = True
+
+    async def close(self):
+        self._discarded = True
+        self._closing.set()
+        if self._task is None or self._task.done():
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout=5.0)
+        except Exception:
+            self._task.cancel()
+            try:
+                await self._task
+            except BaseException:
+                pass
+
+
+class MCPSessionPool:
+    """Keeps warm, initialized MCP sessions per server and hands them out to tool calls.
+
+    Each server gets up to ``poolSize`` concurrent sessions (``MCP_POOL_SIZE`` by
+    default). Sessions whose subprocess has died are replaced on the next acquire.
+    All pool state lives on the shared agent runtime loop, so calls can be made
+    from any event loop.
+
+    Sessions (each one a server subprocess) are started on first use. One left
+    idle for ``idleTtl`` seconds (``MCP_IDLE_TTL`` by default, 0 keeps it) is
+    closed by a background reaper. At most ``max_live`` sessions run at once
+    across all servers: opening one more first closes the least recently used
+    idle session, or waits up to the init timeout for one to be returned.
+    """
+
+    def __init__(self, size: int = None, init_timeout: float = None, call_timeout: float = None,
+                 idle_ttl: float = None, max_live: int = None):
+        self.default_size = size or config.MCP_POOL_SIZE
+        self.init_timeout = init_timeout or config.MCP_INIT_TIMEOUT
+        self.call_timeout = call_timeout or config.MCP_CALL_TIMEOUT
+        self.idle_ttl = config.MCP_IDLE_TTL if idle_ttl is None else idle_ttl
+        self.max_live = config.MCP_MAX_LIVE_SESSIONS if max_live is None else max_live
+        self.runtime = get_runtime()
+        self._servers: Dict[str, Dict[str, Any]] = {}
+        self._idle: Dict[str, deque] = {}
+        self._live: Dict[str, set] = {}
+        self._slots: Dict[str, asyncio.Semaphore] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._starting = 0
+        self._returned = asyncio.Condition()
+        self._reaper: Optional[asyncio.Task] = None
+        self._closed = False
+
+    def register(self, name: str, cfg: Dict[str, Any]):
+        """Register (or replace) the launch configuration for a server"""
+        self._servers[name] = cfg
+        self._idle.setdefault(name, deque())
+        self._live.setdefault(name, set())
+        self._stats.setdefault(name, {'started': 0, 'reconnects': 0, 'failures': 0, 'calls': 0,
+                                      'idle_evictions': 0, 'capacity_evictions': 0})
+
+    def pool_size(self, name: str) -> int:
+        return max(1, int(self._servers.get(name, {}).get('pool_size') or self.default_size))
+
+    def idle_ttl_for(self, name: str) -> float:
+        ttl = self._servers.get(name, {}).get('idle_ttl')
+        return float(self.idle_ttl if ttl is None else ttl)
+
+    def _live_count(self) -> int:
+        return sum(len(live) for live in self._live.values()) + self._starting
+
+    def _track(self, name: str):
+        MCP_LIVE_SESSIONS.labels(name).set(len(self._live[name]))
+
+    async def _evict(self, pooled: PooledSession, reason: str):
+        """Close an idle session to free its process"""
+        try:
+            self._idle[pooled.server].remove(pooled)
+        except ValueError:
+            pass
+        self._live[pooled.server].discard(pooled)
+        self._stats[pooled.server][f'{reason}_evictions'] += 1
+        self._track(pooled.server)
+        MCP_SESSION_EVICTIONS.labels(pooled.server, reason).inc()
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] Pool: closed {reason} session for {pooled.server}")
+        await pooled.close()
+
+    async def _make_room(self, name: str) -> bool:
+        """Wait until one more session fits under ``max_live``, evicting idle ones as needed.
+
+        Returns False instead if an idle session of ``name`` turns up to be reused.
+        """
+        if not self.max_live:
+            return True
+        deadline = time.monotonic() + self.init_timeout
+        while self._live_count() >= self.max_live:
+            if self._idle[name]:
+                return False
+            idle = [pooled for queue in self._idle.values() for pooled in queue]
+            if idle:
+                await self._evict(min(idle, key=lambda pooled: pooled.last_used), 'capacity')
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RuntimeError(f"All {self.max_live} MCP server sessions are busy")
+            async with self._returned:
+                try:
+                    await asyncio.wait_for(self._returned.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    pass
+        return True
+
+    async def _reap(self):
+        """Close sessions that have sat idle longer than their server's idle TTL"""
+        while not self._closed:
+            ttls = [ttl for ttl in (self.idle_ttl_for(name) for name in self._servers) if ttl > 0]
+            if not ttls:
+                return
+            await asyncio.sleep(max(1.0, min(30.0, min(ttls) / 4)))
+            now = time.monotonic()
+            for name, idle in list(self._idle.items()):
+                ttl = self.idle_ttl_for(name)
+                if ttl <= 0:
+                    continue
+                for pooled in [pooled for pooled in idle if now - pooled.last_used >= ttl]:
+                    await self._evict(pooled, 'idle')
+
+    def _slot(self, name: str) -> asyncio.Semaphore:
+        if name not in self._slots:
+            self._slots[name] = asyncio.Semaphore(self.pool_size(name))
+        return self._slots[name]
+
+    async def _open(self, name: str) -> PooledSession:
+        if name not in self._servers:
+            raise KeyError(f"Unknown MCP server: {name}")
+        stats = self._stats[name]
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap(), name="mcp-pool-reaper")
+        pooled = PooledSession(name, self._servers[name])
+        started = time.perf_counter()
+        self._starting += 1
+        try:
+            await pooled.start(self.init_timeout)
+        except Exception:
+            stats['failures'] += 1
+            raise
+        finally:
+            self._starting -= 1
+        MCP_SESSION_INIT.labels(name).observe(time.perf_counter() - started)
+        if stats['started']:
+            stats['reconnects'] += 1
+        stats['started'] += 1
+        self._live[name].add(pooled)
+        self._track(name)
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] Pool: opened session for {name} ({len(self._live[name])}/{self.pool_size(name)})")
+        return pooled
+
+    async def _release(self, pooled: PooledSession):
+        if pooled.alive and not self._closed:
+            pooled.last_used = time.monotonic()
+            self._idle[pooled.server].append(pooled)
+        else:
+            self._live[pooled.server].discard(pooled)
+            self._track(pooled.server)
+            await pooled.close()
+        async with self._returned:
+            self._returned.notify_all()
+
+    @asynccontextmanager
+    async def session(self, name: str):
+        """Borrow a live session for ``name``, reconnecting if the pooled one died"""
+        if self._closed:
+            raise RuntimeError("MCP session pool is closed")
+        async with self._slot(name):
+            pooled = None
+            idle = self._idle.setdefault(name, deque())
+            while pooled is None:
+                while idle:
+                    candidate = idle.pop()
+                    if candidate.alive:
+                        pooled = candidate
+                        break
+                    self._live[name].discard(candidate)
+                    self._track(name)
+                    await candidate.close()
+                if pooled is None and await self._make_room(name):
+                    pooled = await self._open(name)
+            try:
+                yield pooled
+            finally:
+                await self._release(pooled)
+
+    async def _call_tool(self, name: str, tool_name: str, args: Dict[str, Any], timeout: float):
+        started = time.perf_counter()
+        try:
+            result = await self._call_tool_with_retry(name, tool_name, args, timeout)
+        except asyncio.TimeoutError:
+            MCP_TOOL_TIMEOUTS.labels(name, tool_name).inc()
+            raise
+        except Exception:
+            MCP_TOOL_ERRORS.labels(name, tool_name).inc()
+            raise
+        finally:
+            MCP_CALL.labels(name, tool_name).observe(time.perf_counter() - started)
+        if result.isError:
+            MCP_TOOL_ERRORS.labels(name, tool_name).inc()
+        return result
+
+    async def _call_tool_with_retry(self, name: str, tool_name: str, args: Dict[str, Any], timeout: float):
+        self._stats[name]['calls'] += 1
+        for attempt in range(2):
+            async with self.session(name) as pooled:
+                pooled.calls += 1
+                try:
+                    return await asyncio.wait_for(pooled.session.call_tool(tool_name, args), timeout=timeout)
+                except McpError:
+                    raise
+                except UNSENT_REQUEST_ERRORS:
+                    # The subprocess died while idle and the request could not be
+                    # written, so the tool never ran; reconnect and retry once
+                    pooled.discard()
+                    if attempt:
+                        raise
+                except Exception:
+                    # Timeouts, a connection lost mid-call and other errors leave the
+                    # session in an unknown state, and the tool may have run: no retry
+                    pooled.discard()
+                    raise
+
+    async def call_tool(self, name: str, tool_name: str, args: Dict[str, Any], timeout: float = None):
+        """Call a tool on a pooled session; safe to await from any event loop"""
+        return await self.runtime.call(self._call_tool(name, tool_name, args, timeout or self.call_timeout))
+
+    async def _list_tools(self, name: str):
+        async with self.session(name) as pooled:
+            return await pooled.session.list_tools()
+
+    async def list_tools(self, name: str):
+        return await self.runtime.call(self._list_tools(name))
+
+    async def _close(self):
+        self._closed = True
+        if self._reaper:
+            self._reaper.cancel()
+        sessions = [s for live in self._live.values() for s in live]
+        for name, live in self._live.items():
+            live.clear()
+            self._track(name)
+        for idle in self._idle.values():
+            idle.clear()
+        await asyncio.gather(*(s.close() for s in sessions), return_exceptions=True)
+        if sessions:
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] Pool: closed {len(sessions)} MCP sessions")
+
+    async def close(self):
+        """Close every pooled session and stop accepting new borrows"""
+        if not self.runtime.is_running():
+            self._closed = True
+            return
+        await self.runtime.call(self._close())
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            name: {
+                'size': self.pool_size(name),
+                'live': sum(1 for s in self._live.get(name, ()) if s.alive),
+                'idle': len(self._idle.get(name, ())),
+                'idle_ttl': self.idle_ttl_for(name),
+                **self._stats.get(name, {})
+            }
+            for name in self._servers
+        }
+
+    def get_capacity(self) -> Dict[str, Any]:
+        return {'live': self._live_count(), 'max_live': self.max_live or None}
@@ -1,33 +1,232 @@
 import json
+import time
 import asyncio
-from typing import AsyncGenerator
+import threading
+from collections import deque
+from contextlib import aclosing
+from typing import AsyncGenerator, Callable, Dict, Any, Iterator, List, Optional, Tuple
 from datetime import datetime
+from config import config
+from agent.runtime import get_runtime
 
 class EventStream:
     @staticmethod
-    def format_sse(data: dict, event: str = None) -> str:
+    def format_sse(data: dict, event: str = None, event_id: int = None) -> str:
         """Format data for Server-Sent Events"""
+        payload = json.dumps(data, separators=(',', ':'))
+        frame = f"id: {event_id}\n" if event_id is not None else ""
         if event:
-            return f"event: {event}\ndata: {json.dumps(data)}\n\n"
-        return f"data: {json.dumps(data)}\n\n"
-    
+            frame += f"event: {event}\n"
+        return f"{frame}data: {payload}\n\n"
+
+    @staticmethod
+    def format_retry(milliseconds: int) -> str:
+        """Tell the client how long to wait before reconnecting"""
+        return f"retry: {int(milliseconds)}\n\n"
+
     @staticmethod
     async def heartbeat() -> AsyncGenerator[str, None]:
         """Generate heartbeat events"""
         while True:
             yield EventStream.format_sse({'timestamp': datetime.now().isoformat()}, 'heartbeat')
             await asyncio.sleep(15)  # Send every 15 seconds
-    
+
     @staticmethod
-    async def create_response_stream(generator: AsyncGenerator[str, None]):
+    async def create_response_stream(generator: AsyncGenerator[Dict[str, Any], None]):
         """Create Flask response from async generator"""
         try:
-            async for chunk in generator:
-                yield EventStream.format_sse(json.loads(chunk))
+            async for event in generator:
+                yield EventStream.format_sse(event)
         except Exception as e:
             yield EventStream.format_sse({
                 'type': 'error',
                 'message': str(e)
             }, 'error')
         finally:
-            yield EventStream.format_sse({'type': 'complete'}, 'complete')
\ No newline at end of file
+            yield EventStream.format_sse({'type': 'complete'}, 'complete')
+
+
+class RunStream:
+    """Numbered events of one run, kept in a bounded replay buffer.
+
+    The run publishes from the agent runtime loop; any number of HTTP
+    connections read from request threads, starting after the last event id
+    they saw. Content deltas can be coalesced here (``coalesce_ms``) so that
+    every reader sees the same frames under the same ids. When a reader asks
+    for events that have already been evicted, it gets a ``snapshot`` event
+    carrying the answer text up to the oldest buffered event instead.
+    """
+
+    def __init__(self, run_id: str, maxlen: int = None, coalesce_ms: int = None, coalesce_bytes: int = None):
+        self.run_id = run_id
+        self.maxlen = maxlen or config.SSE_REPLAY_BUFFER
+        self.window = (config.SSE_COALESCE_MS if coalesce_ms is None else coalesce_ms) / 1000
+        self.max_bytes = coalesce_bytes or config.SSE_COALESCE_BYTES
+        self.done = False
+        self.finished_at: Optional[float] = None
+        self._events: deque = deque()
+        self._next_id = 1
+        self._evicted_content: List[str] = []
+        self._pending: List[str] = []
+        self._pending_bytes = 0
+        self._pending_since = 0.0
+        self._cond = threading.Condition()
+
+    @property
+    def last_id(self) -> int:
+        return self._next_id - 1
+
+    def publish(self, event: Dict[str, Any]):
+        with self._cond:
+            if event.get('type') == 'content' and self.window > 0:
+                if not self._pending:
+                    # Wake readers so they can time the flush of this batch
+                    self._pending_since = time.monotonic()
+                    self._cond.notify_all()
+                self._pending.append(event['content'])
+                self._pending_bytes += len(event['content'])
+                if self._pending_bytes >= self.max_bytes:
+                    self._seal()
+                    self._cond.notify_all()
+                return
+            self._seal()
+            self._append(event)
+            self._cond.notify_all()
+
+    def finish(self):
+        with self._cond:
+            self._seal()
+            self.done = True
+            self.finished_at = time.monotonic()
+            self._cond.notify_all()
+
+    def _seal(self):
+        """Turn buffered content deltas into one numbered event"""
+        if self._pending:
+            content = ''.join(self._pending)
+            self._pending = []
+            self._pending_bytes = 0
+            self._append({'type': 'content', 'content': content})
+
+    def _append(self, event: Dict[str, Any]):
+        self._events.append((self._next_id, event))
+        self._next_id += 1
+        while len(self._events) > self.maxlen:
+            _, evicted = self._events.popleft()
+            if evicted.get('type') == 'content':
+                self._evicted_content.append(evicted['content'])
+
+    def _after(self, last_id: int) -> List[Tuple[int, Dict[str, Any]]]:
+        if not self._events or last_id >= self._events[-1][0]:
+            return []
+        first_id = self._events[0][0]
+        if last_id >= first_id:
+            return list(self._events)[last_id - first_id + 1:]
+        # Part of what the reader missed is gone: resync its text, then replay the rest
+        batch = list(self._events)
+        if self._evicted_content and last_id < first_id - 1:
+            batch.insert(0, (first_id - 1, {'type': 'snapshot', 'content': ''.join(self._evicted_content)}))
+        return batch
+
+    def events(self, last_id: int = 0, keepalive: float = None) -> Iterator[Optional[Tuple[int, Dict[str, Any]]]]:
+        """Yield ``(id, event)`` after ``last_id`` until the run is done.
+
+        Blocks between events; yields ``None`` every ``keepalive`` seconds of
+        silence so the caller can send a keep-alive comment.
+        """
+        keepalive = keepalive or config.SSE_KEEPALIVE
+        idle_since = time.monotonic()
+        while True:
+            with self._cond:
+                batch = self._after(last_id)
+                if not batch:
+                    if self.done:
+                        return
+                    if self._pending:
+                        due = self._pending_since + self.window - time.monotonic()
+                        if due <= 0:
+                            self._seal()
+                            continue
+                        self._cond.wait(min(due, keepalive))
+                    else:
+                        self._cond.wait(keepalive)
+                    batch = self._after(last_id)
+            if batch:
+                idle_since = time.monotonic()
+                for item in batch:
+                    yield item
+                last_id = batch[-1][0]
+            elif time.monotonic() - idle_since >= keepalive:
+                idle_since = time.monotonic()
+                yield None
+
+
+class StreamRegistry:
+    """Runs whose events can be (re)read by run id.
+
+    A run is driven by a task on the agent runtime loop, independent of any
+    HTTP connection, so it keeps going (and its answer still gets saved) if
+    the client disconnects. Finished streams stay readable for
+    ``SSE_REPLAY_TTL`` seconds.
+    """
+
+    def __init__(self, ttl: float = None):
+        self.ttl = config.SSE_REPLAY_TTL if ttl is None else ttl
+        self._streams: Dict[str, RunStream] = {}
+        self._lock = threading.Lock()
+
+    def start(self, run_id: str, events: AsyncGenerator[Dict[str, Any], None],
+              on_event: Callable[[Dict[str, Any]], None] = None,
+              on_finish: Callable[[], Optional[Dict[str, Any]]] = None) -> RunStream:
+        """Drive ``events`` on the runtime loop, publishing each one to a new RunStream.
+
+        ``on_event`` sees every event as it is published. ``on_finish`` runs in
+        a worker thread once the run ends for any reason; an event it returns
+        is published last.
+        """
+        self._purge()
+        stream = RunStream(run_id)
+        with self._lock:
+            self._streams[run_id] = stream
+
+        async def drive():
+            try:
+                async with aclosing(events):
+                    async for event in events:
+                        if on_event:
+                            on_event(event)
+                        stream.publish(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                stream.publish({'type': 'error', 'message': f'Streaming Error: {str(e)}'})
+            finally:
+                try:
+                    final = await asyncio.to_thread(on_finish) if on_finish else None
+                    if final:
+                        stream.publish(final)
+                except Exception as e:
+                    stream.publish({'type': 'error', 'message': f'Could not save response: {str(e)}'})
+                stream.finish()
+
+        get_runtime().submit(drive())
+        return stream
+
+    def get(self, run_id: str) -> Optional[RunStream]:
+        self._purge()
+        return self._streams.get(run_id)
+
+    def _purge(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [run_id for run_id, stream in self._streams.items()
+                       if stream.done and now - stream.finished_at > self.ttl]
+            for run_id in expired:
+                del self._streams[run_id]
+
+
+# Global stream registry
+stream_registry = StreamRegistry()
+
+def get_stream_registry():
+    return stream_registry
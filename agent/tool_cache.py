@@ -0,0 +1,167 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from fnmatch import fnmatch
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple
+from config import config
+
+
+class ToolResultCache:
+    """Cross-request cache for MCP tool results.
+
+    Entries are keyed on (server, tool, canonical args) and kept in an in-memory
+    LRU bounded by entry count and total bytes. An optional SQLite tier keeps
+    results across restarts. Per-server settings come from the ``"cache"`` entry
+    of a server in the MCP config file::
+
+        "cache": {"ttl": 3600, "tools": {"search_arxiv": 600}, "exclude": ["download_*"]}
+
+    or ``"cache": false`` to disable caching for that server entirely.
+    """
+
+    def __init__(self, max_entries: int = None, max_bytes: int = None, default_ttl: float = None,
+                 exclude=None, disk_path: Optional[str] = None):
+        self.max_entries = max_entries or config.TOOL_CACHE_MAX_ENTRIES
+        self.max_bytes = max_bytes or config.TOOL_CACHE_MAX_BYTES
+        self.default_ttl = config.TOOL_CACHE_DEFAULT_TTL if default_ttl is None else default_ttl
+        self.exclude = list(config.TOOL_CACHE_EXCLUDE if exclude is None else exclude)
+        self._servers: Dict[str, Any] = {}
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'expired': 0, 'bypassed': 0}
+        self._db = None
+        self._writes = 0
+        if disk_path:
+            self._open_disk(disk_path)
+
+    def _open_disk(self, disk_path: str):
+        try:
+            path = Path(disk_path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS tool_results ("
+                "key TEXT PRIMARY KEY, server TEXT, tool TEXT, value TEXT, expires_at REAL)"
+            )
+            self._db.execute("DELETE FROM tool_results WHERE expires_at < ?", (time.time(),))
+        except sqlite3.Error as e:
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] Tool cache: disk tier disabled ({e})")
+            self._db = None
+
+    def configure_server(self, server: str, settings):
+        """Apply the ``"cache"`` entry of a server from the MCP config file"""
+        self._servers[server] = settings
+
+    @staticmethod
+    def make_key(server: str, tool: str, args: Dict[str, Any]) -> str:
+        canonical = json.dumps([server, tool, args or {}], sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def ttl_for(self, server: str, tool: str) -> float:
+        """Seconds to keep a result for this tool; 0 means never cache it"""
+        settings = self._servers.get(server, {})
+        if settings is False:
+            return 0
+        if not isinstance(settings, dict):
+            settings = {}
+        excluded = self.exclude + [f"{server}:{p}" for p in settings.get('exclude', [])]
+        if any(fnmatch(f"{server}:{tool}", pattern) for pattern in excluded):
+            return 0
+        tools = settings.get('tools', {})
+        if tool in tools:
+            return float(tools[tool])
+        return float(settings.get('ttl', self.default_ttl))
+
+    def get(self, server: str, tool: str, args: Dict[str, Any]) -> Optional[str]:
+        if self.ttl_for(server, tool) <= 0:
+            with self._lock:
+                self._stats['bypassed'] += 1
+            return None
+        key = self.make_key(server, tool, args)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return value
+                self._remove(key)
+                self._stats['expired'] += 1
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM tool_results WHERE key = ?", (key,)
+                ).fetchone()
+                if row and row[1] > now:
+                    self._insert(key, row[0], row[1])
+                    self._stats['hits'] += 1
+                    self._stats['disk_hits'] += 1
+                    return row[0]
+            self._stats['misses'] += 1
+        return None
+
+    def set(self, server: str, tool: str, args: Dict[str, Any], value: str):
+        ttl = self.ttl_for(server, tool)
+        if ttl <= 0:
+            return
+        key = self.make_key(server, tool, args)
+        expires_at = time.time() + ttl
+        with self._lock:
+            self._insert(key, value, expires_at)
+            self._stats['stores'] += 1
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO tool_results (key, server, tool, value, expires_at) VALUES (?, ?, ?, ?, ?)",
+                        (key, server, tool, value, expires_at)
+                    )
+                    self._writes += 1
+                    if self._writes % 500 == 0:
+                        self._db.execute("DELETE FROM tool_results WHERE expires_at < ?", (time.time(),))
+                except sqlite3.Error as e:
+                    print(f"[{datetime.now().strftime('%H:%M:%S')}] Tool cache: disk write failed ({e})")
+
+    def _insert(self, key: str, value: str, expires_at: float):
+        if key in self._entries:
+            self._remove(key)
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (value, expires_at)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._stats['evictions'] += 1
+
+    def _remove(self, key: str):
+        value, _ = self._entries.pop(key)
+        self._bytes -= len(value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM tool_results")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return {
+                **self._stats,
+                'hit_rate': round(self._stats['hits'] / lookups, 3) if lookups else 0.0,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'disk': self._db is not None
+            }
@@ -0,0 +1,111 @@
+import re
+import json
+import math
+from collections import Counter
+from typing import Dict, Any, List, Optional
+
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'can', 'do', 'for', 'from', 'get', 'give', 'how',
+    'i', 'in', 'is', 'it', 'me', 'my', 'of', 'on', 'or', 'please', 'show', 'that', 'the', 'this', 'to',
+    'use', 'what', 'which', 'who', 'with', 'you', 'your'
+}
+
+# Field weights: a query term in the tool name counts more than one in its description
+NAME_WEIGHT = 3
+SERVER_WEIGHT = 2
+PARAM_WEIGHT = 1
+DESCRIPTION_WEIGHT = 1
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens, splitting snake_case and camelCase and dropping stopwords"""
+    if not text:
+        return []
+    text = re.sub(r'([a-z0-9])([A-Z])', r'\1 \2', text)
+    tokens = []
+    for token in re.findall(r'[a-z0-9]+', text.lower()):
+        if token in STOPWORDS or len(token) < 2:
+            continue
+        # Crude plural folding so "papers" matches "paper"
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def estimate_spec_tokens(spec: Dict[str, Any]) -> int:
+    """Rough token count of a function spec as sent to the model (~4 chars per token)"""
+    return len(json.dumps(spec, separators=(',', ':'))) // 4 + 1
+
+
+class ToolSelector:
+    """BM25 ranking of tools against the user's query.
+
+    Each tool is indexed on its name, server name, parameter names and
+    description. The index is rebuilt only when the catalog version changes.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        # (version, docs, lengths, df, avgdl), swapped as a whole so readers never see a mix
+        self._index = (None, [], [], Counter(), 0.0)
+
+    def _document(self, tool: Dict[str, Any]) -> List[str]:
+        schema = tool.get('input_schema') or {}
+        params = ' '.join(schema.get('properties', {}).keys()) if isinstance(schema, dict) else ''
+        return (
+            tokenize(tool['name']) * NAME_WEIGHT
+            + tokenize(tool.get('server', '')) * SERVER_WEIGHT
+            + tokenize(params) * PARAM_WEIGHT
+            + tokenize(tool.get('description') or '') * DESCRIPTION_WEIGHT
+        )
+
+    def ensure_index(self, version: int, tools: List[Dict[str, Any]]):
+        if version == self._index[0]:
+            return
+        docs = [Counter(self._document(tool)) for tool in tools]
+        lengths = [sum(doc.values()) for doc in docs]
+        df = Counter()
+        for doc in docs:
+            df.update(doc.keys())
+        avgdl = (sum(lengths) / len(lengths)) if lengths else 0.0
+        self._index = (version, docs, lengths, df, avgdl)
+
+    def scores(self, query: str) -> List[float]:
+        _, docs, lengths, df, avgdl = self._index
+        terms = set(tokenize(query))
+        n = len(docs)
+        results = []
+        for doc, length in zip(docs, lengths):
+            score = 0.0
+            for term in terms:
+                tf = doc.get(term)
+                if not tf:
+                    continue
+                idf = math.log(1 + (n - df[term] + 0.5) / (df[term] + 0.5))
+                norm = 1 - self.b + self.b * (length / avgdl if avgdl else 1)
+                score += idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+            results.append(score)
+        return results
+
+    def select(self, query: str, spec_tokens: List[int], top_k: int, token_budget: int) -> Optional[List[int]]:
+        """Indices of the specs to offer for this query, best first.
+
+        Returns None when no tool matches the query at all, meaning the caller
+        should offer its default set.
+        """
+        scores = self.scores(query)
+        ranked = sorted((i for i, score in enumerate(scores) if score > 0), key=lambda i: -scores[i])
+        if not ranked:
+            return None
+        selected = []
+        used = 0
+        for i in ranked:
+            if len(selected) >= top_k:
+                break
+            if selected and used + spec_tokens[i] > token_budget:
+                continue
+            selected.append(i)
+            used += spec_tokens[i]
+        return selected
@@ -1,16 +1,20 @@
 from flask import Flask, render_template, request, jsonify, Response, stream_with_context, redirect, url_for
 from flask_cors import CORS
-import asyncio
-import json
 import os
 import time
 from datetime import datetime
 import threading
+import atexit
 from pathlib import Path
 
 # Import your agent and session manager
-from agent.mcp_agent import get_agent, init_agent
+from agent.mcp_agent import get_agent, init_agent, shutdown_agent
+from agent.run_context import RunContext
+from agent.streaming import EventStream, get_stream_registry
+from agent.batch import BatchRunner
 from utils.session_manager import SessionManager
+from utils.session_io import export_ndjson, import_ndjson
+from utils.metrics import registry as metrics_registry, SSE_BYTES, SSE_EVENTS
 from config import config
 import warnings
 
@@ -28,6 +32,7 @@ app.config['SECRET_KEY'] = config.SECRET_KEY
 agent = None
 agent_initialized = False
 session_manager = SessionManager(storage_path="sessions")
+batch_runner = BatchRunner(session_manager)
 
 def initialize_agent_background():
     """Initialize agent in background thread"""
@@ -48,14 +53,28 @@ def initialize_agent_background():
 init_thread = threading.Thread(target=initialize_agent_background, daemon=True)
 init_thread.start()
 
+# Close pooled MCP sessions (and their subprocesses) on exit; atexit runs
+# handlers last-in first-out, so batch workers stop before the agent does
+atexit.register(shutdown_agent)
+atexit.register(batch_runner.close)
+
 @app.route('/')
 def index():
     return render_template('index.html', theme=config.THEME_DEFAULT)
 
 @app.route('/sessions')
 def sessions_page():
-    sessions = session_manager.list_sessions()
-    return render_template('sessions.html', sessions=sessions, theme=config.THEME_DEFAULT)
+    query = request.args.get('q', '').strip()
+    if query:
+        offset = max(0, request.args.get('offset', 0, type=int))
+        page = session_manager.search_sessions(query, limit=50, offset=offset)
+        return render_template('sessions.html', sessions=page['results'], query=query,
+                               next_offset=page['next_offset'], theme=config.THEME_DEFAULT)
+    try:
+        page = session_manager.list_sessions_page(limit=50, cursor=request.args.get('cursor'))
+    except ValueError:
+        return redirect(url_for('sessions_page'))
+    return render_template('sessions.html', sessions=page['sessions'], next_cursor=page['next_cursor'], theme=config.THEME_DEFAULT)
 
 @app.route('/settings')
 def settings_page():
@@ -90,6 +109,8 @@ def chat():
     
     user_input = data.get('message', '').strip()
     session_id = data.get('session_id')
+    # "cache": false skips the answer cache and always runs the agent
+    use_cache = data.get('cache', True) is not False
     
     if not user_input:
         return jsonify({'error': 'Message is required'}), 400
@@ -101,6 +122,11 @@ def chat():
             'message': 'Please wait a moment and try again'
         }), 503
     
+    # Reject fast when every run slot and the wait queue are taken
+    rejection = agent.admission.check()
+    if rejection:
+        return jsonify(rejection.to_dict()), rejection.status_code, {'Retry-After': str(rejection.retry_after)}
+    
     # Create session if it doesn't exist
     if not session_id:
         session_id = session_manager.create_session(title=user_input[:50] + "...")
@@ -108,53 +134,63 @@ def chat():
     # Add user message to session
     session_manager.add_message(session_id, 'user', user_input)
     
+    # The run is driven on the agent loop and outlives this connection; the
+    # response below (and any reconnect) only reads its event buffer
+    run = RunContext(user_input)
+    content_parts = []
+    usage = {'input_tokens': 0, 'output_tokens': 0, 'steps': []}
+    replay = {}
+    
+    def collect(data):
+        # Accumulate for session storage
+        if data['type'] == 'run' and data.get('cached'):
+            replay.update(cached=True, similarity=data['similarity'])
+        elif data['type'] == 'content':
+            content_parts.append(data['content'])
+        elif data['type'] == 'usage':
+            usage['input_tokens'] = data['run_input_tokens']
+            usage['output_tokens'] = data['run_output_tokens']
+            usage['steps'].append({k: data[k] for k in ('step', 'model', 'input_tokens', 'output_tokens', 'estimated')})
+    
+    def save_response():
+        # Save assistant response to session, with the run's token usage; runs
+        # even if the client went away or the run was cancelled
+        usage['total_tokens'] = usage['input_tokens'] + usage['output_tokens']
+        metadata = {'usage': usage, 'run_id': run.run_id}
+        if run.status == 'cancelled':
+            metadata['status'] = 'cancelled'
+        if replay:
+            # Answered from the answer cache; the usage is that of the original run
+            metadata['answer_cache'] = replay
+        session_manager.add_message(session_id, 'assistant', ''.join(content_parts), metadata=metadata)
+        return {'type': 'complete', 'session_id': session_id, 'run_id': run.run_id}
+    
+    stream = get_stream_registry().start(run.run_id, agent.stream_response(user_input, run, use_cache=use_cache),
+                                         on_event=collect, on_finish=save_response)
+    return sse_response(stream)
+
+def sse_response(stream, last_event_id: int = 0):
+    """SSE response replaying a run's events after ``last_event_id``, then following it live"""
     def generate():
-        """Generate streaming response"""
-        full_response = ""
-        
-        # Bridge async to sync for Flask streaming
-        async def async_generator():
-            try:
-                state = agent.get_state()
-                if not state.get('initialized'):
-                    yield json.dumps({'type': 'error', 'message': 'Agent not properly initialized'})
-                    return
-                
-                async for chunk in agent.stream_response(user_input):
-                    yield chunk
-            except Exception as e:
-                yield json.dumps({'type': 'error', 'message': f'Streaming Error: {str(e)}'})
-
-        # Run async loop
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
+        sent_bytes = 0
+        sent_events = 0
         try:
-            async_gen = async_generator()
-            while True:
-                try:
-                    chunk = loop.run_until_complete(async_gen.__anext__())
-                    if not chunk:
-                        break
-                    
-                    # Accumulate for session storage
-                    data = json.loads(chunk)
-                    if data.get('type') == 'content':
-                        full_response += data.get('content', '')
-                    
-                    yield f"data: {chunk}\n\n"
-                except StopAsyncIteration:
-                    # Save assistant response to session
-                    session_manager.add_message(session_id, 'assistant', full_response)
-                    yield f"data: {json.dumps({'type': 'complete', 'session_id': session_id})}\n\n"
-                    break
+            frame = EventStream.format_retry(config.SSE_RETRY_TIMEOUT)
+            sent_bytes += len(frame)
+            yield frame
+            for item in stream.events(last_event_id):
+                if item is None:
+                    frame = ": keep-alive\n\n"
+                else:
+                    # Serialized exactly once, here at the edge
+                    event_id, data = item
+                    frame = EventStream.format_sse(data, event_id=event_id)
+                    sent_events += 1
+                sent_bytes += len(frame.encode('utf-8'))
+                yield frame
         finally:
-            # Crucial: Allow async tasks (like httpx aclose) to finish before closing loop
-            try:
-                loop.run_until_complete(loop.shutdown_asyncgens())
-                loop.close()
-            except Exception:
-                pass
+            SSE_BYTES.labels('chat').observe(sent_bytes)
+            SSE_EVENTS.labels('chat').observe(sent_events)
     
     return Response(
         stream_with_context(generate()),
@@ -166,21 +202,140 @@ def chat():
         }
     )
 
+@app.route('/api/runs/<run_id>/events', methods=['GET'])
+def run_events(run_id):
+    """Reconnect to a run's stream, replaying events after Last-Event-ID"""
+    stream = get_stream_registry().get(run_id)
+    if not stream:
+        return jsonify({'error': 'Run not found or expired'}), 404
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or 0
+    try:
+        last_event_id = int(last_event_id)
+    except ValueError:
+        return jsonify({'error': 'Invalid Last-Event-ID'}), 400
+    return sse_response(stream, last_event_id)
+
+@app.route('/api/runs/<run_id>', methods=['GET'])
+def get_run(run_id):
+    run = agent.get_run(run_id) if agent else None
+    if not run:
+        return jsonify({'error': 'Run not found'}), 404
+    return jsonify(run.to_dict())
+
+@app.route('/api/runs/<run_id>/cancel', methods=['POST'])
+def cancel_run(run_id):
+    if not agent or not agent.get_run(run_id):
+        return jsonify({'error': 'Run not found'}), 404
+    agent.cancel_run(run_id)
+    return jsonify({'status': 'cancelled', 'run_id': run_id})
+
+@app.route('/api/batch', methods=['POST'])
+def create_batch():
+    """Queue a list of queries; poll the status and results endpoints for progress"""
+    data = request.get_json()
+    if not data:
+        return jsonify({'error': 'No JSON data provided'}), 400
+    
+    queries = data.get('queries')
+    if not isinstance(queries, list) or not queries:
+        return jsonify({'error': 'queries must be a non-empty list of strings'}), 400
+    queries = [q.strip() for q in queries if isinstance(q, str) and q.strip()]
+    if len(queries) != len(data['queries']):
+        return jsonify({'error': 'queries must be a non-empty list of strings'}), 400
+    if len(queries) > config.BATCH_MAX_QUERIES:
+        return jsonify({'error': f'At most {config.BATCH_MAX_QUERIES} queries per batch'}), 400
+    
+    if not agent_initialized or agent is None:
+        return jsonify({
+            'error': 'Agent not initialized yet',
+            'message': 'Please wait a moment and try again'
+        }), 503
+    
+    job = batch_runner.submit(queries, title=data.get('title'), use_cache=data.get('cache', True) is not False)
+    return jsonify({
+        **job.to_dict(),
+        'status_url': url_for('batch_status', batch_id=job.batch_id),
+        'results_url': url_for('batch_results', batch_id=job.batch_id)
+    }), 202
+
+@app.route('/api/batch/<batch_id>', methods=['GET'])
+def batch_status(batch_id):
+    status = batch_runner.get_status(batch_id)
+    if not status:
+        return jsonify({'error': 'Batch not found'}), 404
+    return jsonify(status)
+
+@app.route('/api/batch/<batch_id>/results', methods=['GET'])
+def batch_results(batch_id):
+    """Results of the queries finished so far, in query order; page with ?offset= and ?limit="""
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = max(1, min(request.args.get('limit', 100, type=int), 500))
+    results = batch_runner.get_results(batch_id, offset=offset, limit=limit)
+    if results is None:
+        return jsonify({'error': 'Batch not found'}), 404
+    return jsonify(results)
+
+@app.route('/api/batch/<batch_id>/cancel', methods=['POST'])
+def cancel_batch(batch_id):
+    if not batch_runner.cancel(batch_id):
+        return jsonify({'error': 'Batch not found or already finished'}), 404
+    return jsonify(batch_runner.get_status(batch_id))
+
 @app.route('/api/tools', methods=['GET'])
 def list_tools():
     """List available tools"""
     if not agent_initialized or agent is None:
-        return jsonify({'tools': [], 'status': 'not_ready'})
+        return jsonify({'tools': [], 'status': 'not_ready', 'servers': get_agent().get_server_status()})
     
     context = agent.get_context_info()
+    servers = agent.get_server_status()
+    all_ready = all(s.get('state') == 'ready' for s in servers.values())
     return jsonify({
         'tools': context.get('available_tools', []),
-        'status': 'ready'
+        'status': 'ready' if all_ready else 'partial',
+        'servers': servers
     })
 
 @app.route('/api/sessions', methods=['GET'])
 def list_sessions():
-    return jsonify({'sessions': session_manager.list_sessions()})
+    """List sessions by updated_at, newest first; pass next_cursor back as ?cursor= for the next page"""
+    limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+    try:
+        page = session_manager.list_sessions_page(limit=limit, cursor=request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(page)
+
+@app.route('/api/sessions/search', methods=['GET'])
+def search_sessions():
+    """Sessions whose title or messages match ?q=, best match first, with highlighted snippets"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'q is required'}), 400
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    return jsonify({'query': query, **session_manager.search_sessions(query, limit=limit, offset=offset)})
+
+@app.route('/api/sessions/export', methods=['GET'])
+def export_sessions():
+    """Stream every session as NDJSON, gzipped with ?gzip=1; ?since= exports only those updated after it.
+
+    The X-Export-Watermark header is the ?since= value for the next incremental export.
+    """
+    compress = request.args.get('gzip') == '1'
+    watermark, chunks = export_ndjson(session_manager, since=request.args.get('since'), compress=compress)
+    filename = f"sessions-{datetime.now().strftime('%Y%m%d-%H%M%S')}.ndjson" + ('.gz' if compress else '')
+    return Response(
+        stream_with_context(chunks),
+        mimetype='application/gzip' if compress else 'application/x-ndjson',
+        headers={'X-Export-Watermark': watermark or '', 'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+@app.route('/api/sessions/import', methods=['POST'])
+def import_sessions():
+    """Store sessions from an NDJSON body, plain or gzipped; a stored session is replaced only by a newer copy"""
+    report = import_ndjson(session_manager, request.stream)
+    return jsonify(report), 400 if 'error' in report else 200
 
 @app.route('/api/sessions/<session_id>', methods=['GET'])
 def get_session(session_id):
@@ -200,14 +355,28 @@ def status():
         'agent': {
             'initialized': agent_initialized,
             'status': agent.get_state().get('status', 'unknown') if agent else 'initializing',
+            'runs': agent.get_state().get('runs', []) if agent else [],
+            'admission': agent.get_admission_stats() if agent else {},
             'system_prompt': config.AGENT_SYSTEM_PROMPT,
             'current_model': agent.model_name if agent else config.AGENT_MODEL,
             'temperature': agent.temperature if agent else config.AGENT_TEMPERATURE,
-            'available_models': config.AVAILABLE_MODELS
+            'available_models': config.AVAILABLE_MODELS,
+            'servers': get_agent().get_server_status(),
+            'mcp_pool': agent.get_pool_stats() if agent else {},
+            'mcp_processes': agent.get_pool_capacity() if agent else {},
+            'tool_cache': agent.get_cache_stats() if agent else {},
+            'answer_cache': agent.get_answer_cache_stats() if agent else {},
+            'batch': batch_runner.get_stats(),
+            'rate_limits': agent.get_rate_limit_stats() if agent else {}
         },
         'system': {'timestamp': datetime.now().isoformat(), 'status': 'running'}
     })
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Metrics in the Prometheus text exposition format"""
+    return Response(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/favicon.ico')
 def favicon():
     return '', 204
@@ -0,0 +1,58 @@
+import asyncio
+import json
+from typing import List
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+class FakeStreamingChatModel(BaseChatModel):
+    """Chat model that streams a scripted answer, with no network involved.
+
+    The first ``tool_steps`` turns each request ``tool_calls`` calls to the
+    tools in ``tools`` (round robin); the next turn streams ``answer_tokens``
+    content chunks. Every turn ends with a usage chunk, like Groq does.
+    """
+
+    tools: List[str] = ['search_papers']
+    tool_steps: int = 1
+    tool_calls: int = 2
+    answer_tokens: int = 50
+    first_token_delay: float = 0.05
+    token_delay: float = 0.005
+
+    @property
+    def _llm_type(self) -> str:
+        return 'bench-fake'
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content='benchmark answer'))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        turn = sum(1 for m in messages if isinstance(m, AIMessage))
+        prompt_chars = sum(len(str(m.content)) for m in messages)
+        await asyncio.sleep(self.first_token_delay)
+
+        if turn < self.tool_steps:
+            calls = []
+            for i in range(self.tool_calls):
+                name = self.tools[(turn * self.tool_calls + i) % len(self.tools)]
+                args = {'query': f'benchmark topic {turn}.{i}'} if 'search' in name else {'doi': f'10.0000/bench.{i}'}
+                calls.append({'name': name, 'args': json.dumps(args), 'id': f'call_{turn}_{i}', 'index': i})
+            yield ChatGenerationChunk(message=AIMessageChunk(content='', tool_call_chunks=calls))
+            output_tokens = 20 * self.tool_calls
+        else:
+            for i in range(self.answer_tokens):
+                if i:
+                    await asyncio.sleep(self.token_delay)
+                yield ChatGenerationChunk(message=AIMessageChunk(content=f'token{i} '))
+            output_tokens = self.answer_tokens
+
+        yield ChatGenerationChunk(message=AIMessageChunk(content='', usage_metadata={
+            'input_tokens': prompt_chars // 4,
+            'output_tokens': output_tokens,
+            'total_tokens': prompt_chars // 4 + output_tokens
+        }))
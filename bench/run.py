@@ -0,0 +1,295 @@
+"""Offline benchmark for the agent and the /api/chat SSE endpoint.
+
+Runs entirely locally: tools come from bench/stub_server.py over stdio and
+the model is FakeStreamingChatModel, so no Groq key or npm/uvx servers are
+needed. Example:
+
+    python -m bench.run --mode agent --requests 64 --concurrency 8
+    python -m bench.run --mode http --save-baseline
+
+Results are compared against bench/baseline.json when it has an entry for
+the same mode.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+BASELINE_PATH = ROOT / 'bench' / 'baseline.json'
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline agent benchmark")
+    parser.add_argument('--mode', choices=['agent', 'http'], default='agent',
+                        help="drive EnhancedMCPAgent.stream_response directly, or /api/chat over the Flask test client")
+    parser.add_argument('--requests', type=int, default=64)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--servers', type=int, default=2, help="number of stub MCP servers")
+    parser.add_argument('--tool-latency', type=float, default=0.05, help="seconds per stub tool call")
+    parser.add_argument('--payload-bytes', type=int, default=4096, help="approximate size of each tool result")
+    parser.add_argument('--tool-steps', type=int, default=1, help="model turns that request tools")
+    parser.add_argument('--tool-calls', type=int, default=2, help="tool calls per tool turn")
+    parser.add_argument('--answer-tokens', type=int, default=50)
+    parser.add_argument('--first-token-delay', type=float, default=0.05)
+    parser.add_argument('--token-delay', type=float, default=0.005)
+    parser.add_argument('--tool-cache', action='store_true', help="leave the tool result cache on")
+    parser.add_argument('--rate-limit', action='store_true', help="apply the default tool rate limits to the stubs")
+    parser.add_argument('--baseline', default=str(BASELINE_PATH))
+    parser.add_argument('--save-baseline', action='store_true', help="store this run as the baseline for its mode")
+    parser.add_argument('--output', help="also write the report to this JSON file")
+    return parser.parse_args(argv)
+
+
+def write_mcp_config(workdir: Path, args) -> Path:
+    servers = {}
+    for i in range(args.servers):
+        env = {
+            'BENCH_TOOL_LATENCY': str(args.tool_latency),
+            'BENCH_PAYLOAD_BYTES': str(args.payload_bytes),
+            'BENCH_TOOL_PREFIX': f'bench{i}_'
+        }
+        servers[f'bench{i}'] = {'command': sys.executable, 'args': [str(ROOT / 'bench' / 'stub_server.py')], 'env': env}
+        if not args.rate_limit:
+            servers[f'bench{i}']['rateLimit'] = False
+    path = workdir / 'bench_mcp.json'
+    path.write_text(json.dumps({'mcpServers': servers}, indent=2))
+    return path
+
+
+def make_model(args, tools):
+    from bench.fake_model import FakeStreamingChatModel
+    return FakeStreamingChatModel(
+        tools=tools,
+        tool_steps=args.tool_steps,
+        tool_calls=args.tool_calls,
+        answer_tokens=args.answer_tokens,
+        first_token_delay=args.first_token_delay,
+        token_delay=args.token_delay
+    )
+
+
+def rss_mb() -> float:
+    """Current resident set size, where the platform exposes it"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def peak_rss_mb() -> float:
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    return {
+        'p50': round(pick(0.50) * 1000, 2),
+        'p95': round(pick(0.95) * 1000, 2),
+        'p99': round(pick(0.99) * 1000, 2),
+        'mean': round(statistics.fmean(ordered) * 1000, 2),
+        'max': round(ordered[-1] * 1000, 2)
+    }
+
+
+def bench_agent(args, prompts):
+    """Run every prompt through stream_response on the shared runtime loop"""
+    from agent.mcp_agent import get_agent
+    from agent.runtime import get_runtime
+    agent = get_agent()
+
+    async def one(prompt):
+        started = time.perf_counter()
+        first = None
+        events = 0
+        errors = 0
+        async for event in agent.stream_response(prompt):
+            events += 1
+            if event['type'] == 'content' and first is None:
+                first = time.perf_counter() - started
+            elif event['type'] == 'error':
+                errors += 1
+        return {'latency': time.perf_counter() - started, 'ttft': first, 'events': events, 'errors': errors}
+
+    async def drive(batch):
+        limit = asyncio.Semaphore(args.concurrency)
+
+        async def bounded(prompt):
+            async with limit:
+                return await one(prompt)
+
+        return await asyncio.gather(*(bounded(p) for p in batch))
+
+    runtime = get_runtime()
+    runtime.run(drive(prompts[:args.warmup]))
+    started = time.perf_counter()
+    samples = runtime.run(drive(prompts[args.warmup:]))
+    return samples, time.perf_counter() - started
+
+
+def bench_http(args, prompts, app_module):
+    """POST every prompt to /api/chat and read the SSE stream to the end"""
+    client = app_module.app.test_client()
+
+    def one(prompt):
+        started = time.perf_counter()
+        first = None
+        events = 0
+        errors = 0
+        nbytes = 0
+        buffer = ''
+        response = client.post('/api/chat', json={'message': prompt}, buffered=False)
+        for chunk in response.response:
+            nbytes += len(chunk)
+            buffer += chunk.decode('utf-8')
+            # An event may span chunks; only parse the complete ones
+            *complete, buffer = buffer.split('\n\n')
+            for block in complete:
+                data = [line[6:] for line in block.splitlines() if line.startswith('data: ')]
+                if not data:
+                    continue
+                event = json.loads('\n'.join(data))
+                events += 1
+                if event['type'] == 'content' and first is None:
+                    first = time.perf_counter() - started
+                elif event['type'] == 'error':
+                    errors += 1
+        response.close()
+        return {'latency': time.perf_counter() - started, 'ttft': first, 'events': events,
+                'errors': errors, 'bytes': nbytes}
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(one, prompts[:args.warmup]))
+        started = time.perf_counter()
+        samples = list(pool.map(one, prompts[args.warmup:]))
+    return samples, time.perf_counter() - started
+
+
+def summarize(args, samples, elapsed, rss_before):
+    events = sum(s['events'] for s in samples)
+    report = {
+        'mode': args.mode,
+        'params': {k: getattr(args, k) for k in (
+            'requests', 'concurrency', 'servers', 'tool_latency', 'payload_bytes', 'tool_steps',
+            'tool_calls', 'answer_tokens', 'first_token_delay', 'token_delay', 'tool_cache')},
+        'requests': len(samples),
+        'errors': sum(s['errors'] for s in samples),
+        'elapsed_s': round(elapsed, 3),
+        'requests_per_s': round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        'events_per_s': round(events / elapsed, 1) if elapsed else 0.0,
+        'latency_ms': percentiles([s['latency'] for s in samples]),
+        'ttft_ms': percentiles([s['ttft'] for s in samples if s['ttft'] is not None]),
+        'rss_mb': round(rss_mb(), 1),
+        'rss_growth_mb': round(rss_mb() - rss_before, 1),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'python': sys.version.split()[0],
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')
+    }
+    if samples and 'bytes' in samples[0]:
+        report['sse_bytes_per_request'] = round(statistics.fmean(s['bytes'] for s in samples))
+    return report
+
+
+def compare(report, baseline):
+    """Print the change of each headline number relative to the baseline"""
+    rows = [
+        ('latency p50 (ms)', report['latency_ms'].get('p50'), baseline['latency_ms'].get('p50')),
+        ('latency p95 (ms)', report['latency_ms'].get('p95'), baseline['latency_ms'].get('p95')),
+        ('latency p99 (ms)', report['latency_ms'].get('p99'), baseline['latency_ms'].get('p99')),
+        ('ttft p50 (ms)', report['ttft_ms'].get('p50'), baseline['ttft_ms'].get('p50')),
+        ('events/s', report['events_per_s'], baseline['events_per_s']),
+        ('peak rss (MB)', report['peak_rss_mb'], baseline['peak_rss_mb']),
+    ]
+    if report['params'] != baseline.get('params'):
+        print("note: baseline was recorded with different parameters")
+    print(f"{'metric':<20}{'current':>12}{'baseline':>12}{'change':>10}")
+    for name, current, base in rows:
+        change = f"{(current - base) / base * 100:+.1f}%" if current is not None and base else "n/a"
+        print(f"{name:<20}{current if current is not None else 'n/a':>12}{base if base is not None else 'n/a':>12}{change:>10}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.requests < 1 or args.concurrency < 1:
+        raise SystemExit("--requests and --concurrency must be positive")
+
+    baseline_path = Path(args.baseline).resolve()
+    output_path = Path(args.output).resolve() if args.output else None
+
+    # Everything the app writes (sessions, caches) goes to a scratch directory
+    workdir = Path(tempfile.mkdtemp(prefix='mcp-bench-'))
+    sys.path.insert(0, str(ROOT))
+    os.chdir(workdir)
+    os.environ.setdefault('GROQ_API_KEY', 'bench-offline')
+
+    from config import config
+    config.MCP_CONFIG_FILE = str(write_mcp_config(workdir, args))
+    config.TOOL_CATALOG_CACHE_PATH = ''
+    config.TOOL_CACHE_ENABLED = args.tool_cache
+    config.TOOL_CACHE_DISK_PATH = None
+    config.AGENT_MIN_READY_SERVERS = args.servers
+
+    app_module = None
+    if args.mode == 'http':
+        import app as app_module
+        app_module.init_thread.join()
+        agent = app_module.agent
+    else:
+        from agent.mcp_agent import init_agent, get_agent
+        agent = get_agent() if init_agent() else None
+    if agent is None or not agent.state['initialized']:
+        raise SystemExit("Agent failed to initialize against the stub servers")
+
+    agent.model = make_model(args, sorted({tool['name'] for tool in agent.get_context_info()['available_tools']}))
+
+    prompts = [f"find recent papers on benchmark topic {i}" for i in range(args.warmup + args.requests)]
+    rss_before = rss_mb()
+    if args.mode == 'http':
+        samples, elapsed = bench_http(args, prompts, app_module)
+    else:
+        samples, elapsed = bench_agent(args, prompts)
+    report = summarize(args, samples, elapsed, rss_before)
+
+    print(json.dumps(report, indent=2))
+    baselines = json.loads(baseline_path.read_text()) if baseline_path.exists() else {}
+    if args.mode in baselines and not args.save_baseline:
+        compare(report, baselines[args.mode])
+    if args.save_baseline:
+        baselines[args.mode] = report
+        baseline_path.write_text(json.dumps(baselines, indent=2) + "\n")
+        print(f"Saved baseline for '{args.mode}' to {baseline_path}")
+    if output_path:
+        output_path.write_text(json.dumps(report, indent=2) + "\n")
+
+    from agent.mcp_agent import shutdown_agent
+    shutdown_agent()
+
+
+if __name__ == '__main__':
+    main()
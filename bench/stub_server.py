@@ -0,0 +1,48 @@
+"""Local stdio MCP server used by the benchmark.
+
+Tool latency and payload size are set through the environment so one script
+can stand in for fast and slow research servers:
+
+    BENCH_TOOL_LATENCY   seconds each tool call sleeps (default 0.05)
+    BENCH_PAYLOAD_BYTES  approximate size of each search result (default 4096)
+    BENCH_TOOL_PREFIX    prefix for the tool names, so several stubs don't collide
+"""
+import asyncio
+import json
+import os
+from mcp.server.fastmcp import FastMCP
+
+mcp = FastMCP("bench-stub", log_level="WARNING")
+
+LATENCY = float(os.getenv("BENCH_TOOL_LATENCY", "0.05"))
+PAYLOAD_BYTES = int(os.getenv("BENCH_PAYLOAD_BYTES", "4096"))
+PREFIX = os.getenv("BENCH_TOOL_PREFIX", "")
+
+
+def _papers(query: str, limit: int):
+    filler = max(0, PAYLOAD_BYTES // max(1, limit) - 120)
+    return [{
+        "title": f"{query} paper {i}",
+        "doi": f"10.0000/bench.{i}",
+        "year": 2024,
+        "authors": ["A. Author", "B. Author"],
+        "abstract": "x" * filler
+    } for i in range(limit)]
+
+
+@mcp.tool(name=f"{PREFIX}search_papers")
+async def search_papers(query: str, limit: int = 5) -> str:
+    """Search academic papers by keyword query"""
+    await asyncio.sleep(LATENCY)
+    return json.dumps(_papers(query, limit))
+
+
+@mcp.tool(name=f"{PREFIX}get_paper_details")
+async def get_paper_details(doi: str) -> str:
+    """Get metadata for a paper by DOI"""
+    await asyncio.sleep(LATENCY)
+    return json.dumps(_papers(doi, 1)[0])
+
+
+if __name__ == "__main__":
+    mcp.run()
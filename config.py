@@ -21,8 +21,31 @@ class Config:
         "groq/compound",
         "groq/compound-mini"
     ]
+    AGENT_FALLBACK_MODELS = [m for m in os.getenv('AGENT_FALLBACK_MODELS', 'llama-3.1-8b-instant,openai/gpt-oss-20b').split(',') if m]
+    AGENT_FIRST_TOKEN_TIMEOUT = float(os.getenv('AGENT_FIRST_TOKEN_TIMEOUT', '10'))  # seconds before the next fallback model is tried, 0 waits forever
+    AGENT_STALL_TIMEOUT = float(os.getenv('AGENT_STALL_TIMEOUT', '15'))  # seconds of silence mid-stream before failing over, 0 waits forever
+    AGENT_HEDGE_ENABLED = os.getenv('AGENT_HEDGE_ENABLED', '1') == '1'  # keep the slow model racing the fallback instead of cancelling it
     AGENT_TEMPERATURE = 0.4
     AGENT_MAX_STEPS = 10
+    AGENT_TOOL_TOP_K = int(os.getenv('AGENT_TOOL_TOP_K', '8'))  # tools offered per query, 0 offers all
+    AGENT_TOOL_TOKEN_BUDGET = int(os.getenv('AGENT_TOOL_TOKEN_BUDGET', '2500'))  # approx. tokens of tool schemas per request
+    AGENT_MAX_CONCURRENT_RUNS = int(os.getenv('AGENT_MAX_CONCURRENT_RUNS', '8'))
+    AGENT_MAX_CONCURRENT_MODEL_CALLS = int(os.getenv('AGENT_MAX_CONCURRENT_MODEL_CALLS', '8'))
+    AGENT_MAX_CONCURRENT_TOOL_CALLS = int(os.getenv('AGENT_MAX_CONCURRENT_TOOL_CALLS', '16'))
+    AGENT_RUN_QUEUE_SIZE = int(os.getenv('AGENT_RUN_QUEUE_SIZE', '32'))  # runs waiting for a slot before 429s
+    AGENT_RUN_QUEUE_TIMEOUT = float(os.getenv('AGENT_RUN_QUEUE_TIMEOUT', '30'))  # seconds before a queued run gets 503
+    AGENT_MIN_READY_SERVERS = int(os.getenv('AGENT_MIN_READY_SERVERS', '1'))  # servers needed before /api/chat opens
+    AGENT_REQUIRED_SERVERS = [s for s in os.getenv('AGENT_REQUIRED_SERVERS', '').split(',') if s]
+    AGENT_MAX_PARALLEL_TOOLS = int(os.getenv('AGENT_MAX_PARALLEL_TOOLS', '4'))  # concurrent tool calls per step
+    AGENT_RUN_TOKEN_BUDGET = int(os.getenv('AGENT_RUN_TOKEN_BUDGET', '60000'))  # input tokens a run may spend across its steps
+    AGENT_TOOL_RESULT_TOKENS = int(os.getenv('AGENT_TOOL_RESULT_TOKENS', '500'))  # cap for a fresh tool result
+    AGENT_TOOL_RESULT_MIN_TOKENS = int(os.getenv('AGENT_TOOL_RESULT_MIN_TOKENS', '60'))  # floor when compacting old results
+    # Fields kept from JSON paper records; "name:N" cuts text to N chars and lists to N items
+    _PAPER_FIELDS = ['title', 'id', 'paperId', 'arxiv_id', 'pmid', 'doi', 'externalIds', 'url', 'year', 'published',
+                     'publicationDate', 'pubDate', 'issued', 'authors:3', 'author:3', 'venue', 'journal',
+                     'container-title', 'citationCount', 'abstract:300', 'summary:300']
+    TOOL_RESULT_FIELDS = {'*arxiv*': _PAPER_FIELDS, '*crossref*': _PAPER_FIELDS, '*pubmed*': _PAPER_FIELDS,
+                          '*scholar*': _PAPER_FIELDS}  # server pattern -> default projection, overridable via "compaction"
     AGENT_SYSTEM_PROMPT = """You are a highly efficient MCP Research Assistant. 
 Your goal is to provide concise, direct, and token-efficient answers.
 
@@ -33,13 +56,59 @@ STRICT PROTOCOL:
 4. CITATIONS: Provide short ArXiv IDs or DOIs only.
 5. FAILOVER: If a tool fails once, switch immediately to another or answer with what you have. Do not retry."""
     
+    # MCP client settings
+    MCP_POOL_SIZE = int(os.getenv('MCP_POOL_SIZE', '2'))  # sessions per server, overridable via "poolSize"
+    MCP_INIT_TIMEOUT = float(os.getenv('MCP_INIT_TIMEOUT', '20'))  # seconds
+    MCP_CALL_TIMEOUT = float(os.getenv('MCP_CALL_TIMEOUT', '60'))  # seconds
+    MCP_IDLE_TTL = float(os.getenv('MCP_IDLE_TTL', '600'))  # seconds an idle server session is kept, overridable via "idleTtl"; 0 keeps it
+    MCP_MAX_LIVE_SESSIONS = int(os.getenv('MCP_MAX_LIVE_SESSIONS', '12'))  # server processes across all servers, 0 for no cap
+    MCP_LAZY_START = os.getenv('MCP_LAZY_START', '1') == '1'  # start servers with a cached catalog on first call, overridable via "lazy"
+    MCP_DISCOVERY_TIMEOUT = float(os.getenv('MCP_DISCOVERY_TIMEOUT', '60'))  # seconds
+    MCP_DISCOVERY_RETRIES = int(os.getenv('MCP_DISCOVERY_RETRIES', '3'))  # failed retries before a server stops holding up readiness
+    MCP_DISCOVERY_RETRY_DELAY = float(os.getenv('MCP_DISCOVERY_RETRY_DELAY', '15'))  # seconds, doubled per retry
+    MCP_DISCOVERY_MAX_DELAY = float(os.getenv('MCP_DISCOVERY_MAX_DELAY', '300'))  # seconds, ceiling on the retry delay
+    MCP_BREAKER_WINDOW = int(os.getenv('MCP_BREAKER_WINDOW', '20'))  # recent calls per server used for the failure rate
+    MCP_BREAKER_MIN_CALLS = int(os.getenv('MCP_BREAKER_MIN_CALLS', '3'))  # calls in the window before the breaker may open
+    MCP_BREAKER_FAILURE_RATE = float(os.getenv('MCP_BREAKER_FAILURE_RATE', '0.5'))  # failure share that opens the breaker
+    MCP_BREAKER_OPEN_SECONDS = float(os.getenv('MCP_BREAKER_OPEN_SECONDS', '30'))  # fail fast this long before probing
+    MCP_BREAKER_MAX_OPEN_SECONDS = float(os.getenv('MCP_BREAKER_MAX_OPEN_SECONDS', '300'))  # cap when failed probes double the wait
+    TOOL_CATALOG_CACHE_PATH = os.getenv('TOOL_CATALOG_CACHE_PATH', 'cache/tool_catalog.json')  # empty to disable warm start
+    TOOL_RATE_LIMITS = {'*search*': {'rate': 2, 'burst': 3}}  # default per-tool limits (calls/s), overridable via "rateLimit"
+    TOOL_RATE_LIMIT_MAX_WAIT = float(os.getenv('TOOL_RATE_LIMIT_MAX_WAIT', '10'))  # seconds a call may wait for a token
+    
+    # Tool result cache
+    TOOL_CACHE_ENABLED = os.getenv('TOOL_CACHE_ENABLED', '1') == '1'
+    TOOL_CACHE_MAX_ENTRIES = int(os.getenv('TOOL_CACHE_MAX_ENTRIES', '2000'))
+    TOOL_CACHE_MAX_BYTES = int(os.getenv('TOOL_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+    TOOL_CACHE_DEFAULT_TTL = float(os.getenv('TOOL_CACHE_DEFAULT_TTL', '3600'))  # seconds
+    TOOL_CACHE_EXCLUDE = ['playwright:*', '*:download*']  # "server:tool" patterns that are never cached
+    TOOL_CACHE_DISK_PATH = os.getenv('TOOL_CACHE_DISK_PATH')  # e.g. cache/tool_results.db
+    
+    # Answer cache
+    ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', '1') == '1'
+    ANSWER_CACHE_TTL = float(os.getenv('ANSWER_CACHE_TTL', '600'))  # seconds
+    ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', '256'))
+    ANSWER_CACHE_MAX_BYTES = int(os.getenv('ANSWER_CACHE_MAX_BYTES', str(8 * 1024 * 1024)))
+    ANSWER_CACHE_SIMILARITY = float(os.getenv('ANSWER_CACHE_SIMILARITY', '0'))  # e.g. 0.85 to match rephrased queries, 0 for exact only
+    ANSWER_CACHE_MINHASH_PERM = int(os.getenv('ANSWER_CACHE_MINHASH_PERM', '64'))  # signature length for near-duplicate matching
+    
+    # Batch jobs
+    BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '4'))  # batch queries run at once, across all batches
+    BATCH_MAX_QUERIES = int(os.getenv('BATCH_MAX_QUERIES', '500'))  # queries accepted per batch
+    
     # Session settings
     SESSION_TYPE = 'filesystem'
     SESSION_PERMANENT = False
+    SESSION_SEARCH_MAX_CANDIDATES = int(os.getenv('SESSION_SEARCH_MAX_CANDIDATES', '2000'))  # newest matching messages ranked per search, 0 ranks all
     
     # Streaming
     STREAMING_ENABLED = True
     SSE_RETRY_TIMEOUT = 30000  # ms
+    SSE_COALESCE_MS = int(os.getenv('SSE_COALESCE_MS', '0'))  # batch content deltas over this window, 0 sends each delta
+    SSE_COALESCE_BYTES = int(os.getenv('SSE_COALESCE_BYTES', '1024'))  # flush a batch early once it reaches this size
+    SSE_REPLAY_BUFFER = int(os.getenv('SSE_REPLAY_BUFFER', '2048'))  # events kept per run for reconnects
+    SSE_REPLAY_TTL = float(os.getenv('SSE_REPLAY_TTL', '300'))  # seconds a finished run stays replayable
+    SSE_KEEPALIVE = float(os.getenv('SSE_KEEPALIVE', '15'))  # seconds of silence before a keep-alive comment
     
     # UI settings
     THEME_DEFAULT = 'dark'
@@ -1,9 +1,9 @@
 from flask import Blueprint, request, Response, jsonify, stream_with_context
-import asyncio
 import json
 import datetime
 
 from agent.mcp_agent import get_agent
+from agent.runtime import get_runtime
 from agent.streaming import EventStream
 
 chat_bp = Blueprint('chat', __name__)
@@ -32,12 +32,12 @@ def chat():
     
     # Create async generator function
     async def generate():
-        async for chunk in agent.stream_response(user_input):
-            yield chunk
+        async for event in agent.stream_response(user_input):
+            yield event
     
-    # Create Flask response with proper streaming
-    async def stream():
-        async for chunk in EventStream.create_response_stream(generate()):
+    # Drive the run on the shared agent loop and relay events from this thread
+    def stream():
+        for chunk in get_runtime().iterate(EventStream.create_response_stream(generate())):
             yield chunk.encode('utf-8')
     
     return Response(
@@ -3,6 +3,7 @@ class MCPAgentUI {
         this.isStreaming = false;
         this.currentStream = null;
         this.abortController = null;
+        this.currentRunId = null;
         this.currentSessionId = localStorage.getItem('current_session_id');
         this.messageCount = 0;
 
@@ -203,7 +204,7 @@ class MCPAgentUI {
 
         // Create assistant message container
         const messageId = this.addMessage('assistant', '');
-        let fullContent = '';
+        const stream = { content: '', lastEventId: 0, retry: 1000, complete: false };
 
         this.abortController = new AbortController();
 
@@ -224,47 +225,43 @@ class MCPAgentUI {
                 if (response.status === 503) {
                     throw new Error('Agent is still connecting to MCP servers. Please wait a few seconds and try again.');
                 }
+                if (response.status === 429) {
+                    throw new Error('The agent is busy with other requests. Please try again in a few seconds.');
+                }
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
 
-            const reader = response.body.getReader();
-            const decoder = new TextDecoder('utf-8');
-
-            while (true) {
-                const { done, value } = await reader.read();
-                if (done) break;
-
-                const chunk = decoder.decode(value);
-                const lines = chunk.split('\n');
-
-                for (const line of lines) {
-                    if (line.startsWith('data: ')) {
-                        try {
-                            const data = JSON.parse(line.substring(6));
-
-                            // Accumulate content and handle events
-                            if (data.type === 'content') {
-                                fullContent += data.content;
-                                this.updateMessageContent(messageId, fullContent);
-                            } else {
-                                this.handleStreamEvent(data, messageId);
-                            }
-
-                            if (data.type === 'complete' && data.session_id) {
-                                this.currentSessionId = data.session_id;
-                                localStorage.setItem('current_session_id', data.session_id);
-                            }
-                        } catch (e) {
-                            console.warn('Error parsing SSE data:', e, line);
-                        }
-                    }
+            await this.readEventStream(response, messageId, stream);
+
+            // The run keeps going server-side if the connection drops: reconnect and resume
+            let attempt = 0;
+            while (!stream.complete && this.currentRunId && attempt < 5) {
+                const delay = Math.min(stream.retry, 1000 * 2 ** attempt);
+                attempt += 1;
+                this.updateStatus('reconnecting');
+                await new Promise(resolve => setTimeout(resolve, delay));
+                try {
+                    const resumed = await fetch(`/api/runs/${this.currentRunId}/events`, {
+                        headers: { 'Last-Event-ID': String(stream.lastEventId) },
+                        signal: this.abortController.signal
+                    });
+                    if (resumed.status === 404) break;
+                    if (!resumed.ok) continue;
+                    attempt = 0;
+                    await this.readEventStream(resumed, messageId, stream);
+                } catch (error) {
+                    if (error.name === 'AbortError') throw error;
+                    console.warn('Reconnect failed:', error);
                 }
             }
+            if (!stream.complete && !this.abortController.signal.aborted) {
+                throw new Error('Lost connection to the agent. The answer will be in the session history once it finishes.');
+            }
 
         } catch (error) {
             console.error('Streaming error:', error);
             // Remove the empty assistant message if nothing was received
-            if (!fullContent) {
+            if (!stream.content) {
                 const messageElement = document.querySelector(`[data-message-id="${messageId}"]`);
                 if (messageElement) messageElement.remove();
             }
@@ -274,13 +271,14 @@ class MCPAgentUI {
         } finally {
             this.isStreaming = false;
             this.abortController = null;
+            this.currentRunId = null;
             this.updateStatus('idle');
             this.elements.stopButton.classList.add('hidden');
 
             // Add copy button to final message
             const messageElement = document.querySelector(`[data-message-id="${messageId}"]`);
-            if (messageElement && fullContent) {
-                this.addCopyButton(messageElement, fullContent);
+            if (messageElement && stream.content) {
+                this.addCopyButton(messageElement, stream.content);
             }
 
             // Re-enable send button
@@ -288,6 +286,83 @@ class MCPAgentUI {
         }
     }
 
+    async readEventStream(response, messageId, stream) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder('utf-8');
+        let buffer = '';
+
+        try {
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+
+                // Network chunks don't align with events: keep any partial event for the next read
+                buffer += decoder.decode(value, { stream: true });
+                const blocks = buffer.split('\n\n');
+                buffer = blocks.pop();
+
+                let contentChanged = false;
+                for (const block of blocks) {
+                    const frame = this.parseSSEBlock(block);
+                    if (frame.retry) stream.retry = frame.retry;
+                    if (frame.id) stream.lastEventId = frame.id;
+                    const data = frame.data;
+                    if (!data) continue;
+
+                    // Accumulate content and handle events
+                    if (data.type === 'content') {
+                        stream.content += data.content;
+                        contentChanged = true;
+                    } else if (data.type === 'snapshot') {
+                        // Resumed after some events were dropped from the server's buffer
+                        stream.content = data.content;
+                        contentChanged = true;
+                    } else {
+                        this.handleStreamEvent(data, messageId);
+                    }
+
+                    if (data.type === 'complete') {
+                        stream.complete = true;
+                        if (data.session_id) {
+                            this.currentSessionId = data.session_id;
+                            localStorage.setItem('current_session_id', data.session_id);
+                        }
+                    }
+                }
+                // Render once per read rather than once per delta
+                if (contentChanged) {
+                    this.updateMessageContent(messageId, stream.content);
+                }
+            }
+        } catch (error) {
+            if (error.name === 'AbortError') throw error;
+            console.warn('Stream interrupted:', error);
+        }
+    }
+
+    parseSSEBlock(block) {
+        const frame = { id: null, retry: null, data: null };
+        const dataLines = [];
+        for (const line of block.split('\n')) {
+            const colon = line.indexOf(':');
+            if (colon <= 0) continue;  // blank lines and ": keep-alive" comments
+            const field = line.substring(0, colon);
+            let value = line.substring(colon + 1);
+            if (value.startsWith(' ')) value = value.substring(1);
+            if (field === 'data') dataLines.push(value);
+            else if (field === 'id') frame.id = parseInt(value, 10) || null;
+            else if (field === 'retry') frame.retry = parseInt(value, 10) || null;
+        }
+        if (dataLines.length) {
+            try {
+                frame.data = JSON.parse(dataLines.join('\n'));
+            } catch (e) {
+                console.warn('Error parsing SSE data:', e, block);
+            }
+        }
+        return frame;
+    }
+
     handleStreamEvent(data, messageId) {
         const messageElement = document.querySelector(`[data-message-id="${messageId}"]`);
         if (!messageElement) return;
@@ -295,6 +370,17 @@ class MCPAgentUI {
         const contentElement = messageElement.querySelector('.prose');
 
         switch (data.type) {
+            case 'run':
+                this.currentRunId = data.run_id;
+                if (data.cached) {
+                    messageElement.dataset.cached = 'true';
+                }
+                break;
+
+            case 'queued':
+                this.updateStatus(`Queued (#${data.position})`);
+                break;
+
             case 'tool_start':
                 this.addToolCall(data);
                 break;
@@ -303,6 +389,17 @@ class MCPAgentUI {
                 this.updateToolResult(data);
                 break;
 
+            case 'model':
+                messageElement.dataset.model = data.model;
+                if (data.fallback) {
+                    this.updateStatus(`Answering with ${data.model}`);
+                }
+                break;
+
+            case 'usage':
+                messageElement.title = `${data.model}: ${data.run_input_tokens} input / ${data.run_output_tokens} output tokens`;
+                break;
+
             case 'error':
                 this.addSystemMessage(data.message, 'error');
                 break;
@@ -314,6 +411,11 @@ class MCPAgentUI {
     }
 
     stopGeneration() {
+        if (this.currentRunId) {
+            // Stop the run server-side too, not just our connection to it
+            fetch(`/api/runs/${this.currentRunId}/cancel`, { method: 'POST' }).catch(() => {});
+            this.currentRunId = null;
+        }
         if (this.abortController) {
             this.abortController.abort();
         }
@@ -431,6 +533,7 @@ class MCPAgentUI {
         const toolDiv = document.createElement('div');
         toolDiv.className = 'mb-4 p-3 bg-gray-50 dark:bg-gray-800/80 border border-gray-200 dark:border-gray-700 rounded-xl shadow-sm animate-in fade-in slide-in-from-right-4 duration-300';
         toolDiv.dataset.toolName = data.tool;
+        if (data.id) toolDiv.dataset.toolCallId = data.id;
 
         toolDiv.innerHTML = `
             <div class="flex items-center justify-between mb-2">
@@ -456,8 +559,10 @@ class MCPAgentUI {
     }
 
     updateToolResult(data) {
+        // Concurrent calls may finish out of order, so match on the call id when we have one
+        const byId = data.id ? document.querySelector(`[data-tool-call-id="${CSS.escape(data.id)}"]`) : null;
         const entries = Array.from(document.querySelectorAll(`[data-tool-name="${data.tool}"]`));
-        const toolDiv = entries[entries.length - 1];
+        const toolDiv = byId || entries[entries.length - 1];
         if (!toolDiv) return;
 
         const resultContainer = toolDiv.querySelector('.tool-result-container');
@@ -470,7 +575,7 @@ class MCPAgentUI {
         }
 
         if (statusBadge) {
-            statusBadge.textContent = data.success ? 'Success' : 'Failed';
+            statusBadge.textContent = data.success ? (data.cached ? 'Cached' : 'Success') : 'Failed';
             statusBadge.className = `status-badge text-[9px] px-2 py-0.5 rounded-full font-bold uppercase ${data.success ? 'bg-green-100 dark:bg-green-900/40 text-green-600 dark:text-green-400' : 'bg-red-100 dark:bg-red-900/40 text-red-600 dark:text-red-400'}`;
         }
 
@@ -542,6 +647,12 @@ class MCPAgentUI {
             } else {
                 if (contextToolsList) contextToolsList.innerHTML = '<div class="text-center py-4 text-xs text-gray-400 italic">No tools found</div>';
             }
+
+            // Servers that are still starting join the tool list later
+            const starting = Object.values(data.servers || {}).some(s => ['pending', 'connecting'].includes(s.state));
+            if (data.status === 'not_ready' || starting) {
+                setTimeout(() => this.loadTools(), 5000);
+            }
         } catch (error) {
             console.error('Failed to load tools:', error);
         }
@@ -600,7 +711,8 @@ class MCPAgentUI {
             executing: 'text-blue-500',
             streaming: 'text-purple-500',
             error: 'text-red-500',
-            initializing: 'text-yellow-500'
+            initializing: 'text-yellow-500',
+            reconnecting: 'text-yellow-500'
         };
 
         const statusText = {
@@ -609,7 +721,8 @@ class MCPAgentUI {
             executing: 'Executing tool...',
             streaming: 'Streaming...',
             error: 'Error',
-            initializing: 'Initializing Agent...'
+            initializing: 'Initializing Agent...',
+            reconnecting: 'Reconnecting...'
         };
 
         const statusIndicator = this.elements.statusIndicator;
@@ -0,0 +1,265 @@
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, List, Tuple
+
+# Default latency buckets in seconds, from a fast cache hit to a slow tool call
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+COUNT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            # Unlabelled metrics are exported as zero before their first update
+            self._children[()] = self._new_child()
+
+    def labels(self, *values, **kwargs):
+        """Child metric for one combination of label values"""
+        if kwargs:
+            values = tuple(str(kwargs[name]) for name in self.labelnames)
+        else:
+            values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _default(self):
+        return self.labels(*([''] * len(self.labelnames))) if self.labelnames else self.labels()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class _Value:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self._default().inc(amount)
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1):
+        self._default().dec(amount)
+
+    def set(self, value: float):
+        self._default().set(value)
+
+
+class _HistogramValue:
+    __slots__ = ('buckets', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+    def _render_child(self, values, child):
+        with child._lock:
+            counts, total, count = list(child.counts), child.sum, child.count
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            le = 'le="' + _format_value(bound) + '"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """In-process metrics rendered in the Prometheus text exposition format.
+
+    Updating a metric is a dict lookup plus a short locked add, cheap enough
+    to leave on in the request hot path.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def timed(histogram: Histogram, *label_values):
+    """Decorator observing the wall time of every call to the wrapped function"""
+    child = histogram.labels(*label_values)
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+# Global registry and the metrics recorded by the agent and the web app
+registry = MetricsRegistry()
+
+MODEL_TTFT = registry.histogram(
+    'agent_model_ttft_seconds', 'Time from sending a model request to its first streamed chunk', ('model',))
+MODEL_STREAM = registry.histogram(
+    'agent_model_stream_seconds', 'Total time of a streamed model response', ('model',))
+MODEL_FALLBACKS = registry.counter(
+    'agent_model_fallbacks_total', 'Model turns handed to a fallback model', ('model', 'reason'))
+MCP_SESSION_INIT = registry.histogram(
+    'mcp_session_init_seconds', 'Time to start and initialize an MCP session', ('server',))
+MCP_LIVE_SESSIONS = registry.gauge(
+    'mcp_live_sessions', 'Running MCP server sessions (one subprocess each)', ('server',))
+MCP_SESSION_EVICTIONS = registry.counter(
+    'mcp_session_evictions_total', 'MCP sessions closed by the pool, by reason (idle, capacity)', ('server', 'reason'))
+MCP_CALL = registry.histogram(
+    'mcp_call_tool_seconds', 'Latency of MCP call_tool requests', ('server', 'tool'))
+MCP_TOOL_ERRORS = registry.counter(
+    'mcp_tool_errors_total', 'MCP tool calls that raised or returned an error result', ('server', 'tool'))
+MCP_TOOL_TIMEOUTS = registry.counter(
+    'mcp_tool_timeouts_total', 'MCP tool calls that timed out', ('server', 'tool'))
+MCP_BREAKER_STATE = registry.gauge(
+    'mcp_breaker_state', 'Circuit breaker state per server (0 closed, 1 half-open, 2 open)', ('server',))
+MCP_BREAKER_TRIPS = registry.counter(
+    'mcp_breaker_trips_total', 'Times a server circuit breaker opened', ('server',))
+RATE_LIMIT_DELAYED = registry.counter(
+    'mcp_rate_limit_delayed_total', 'Tool calls delayed by the rate limiter', ('server', 'tool'))
+RATE_LIMIT_REJECTED = registry.counter(
+    'mcp_rate_limit_rejected_total', 'Tool calls rejected because the rate limit wait was too long', ('server', 'tool'))
+TOOL_RESULT_COMPACTION = registry.counter(
+    'mcp_tool_result_compaction_total', 'Tool results compacted, by mode (projected, minified, truncated, plugin)', ('server', 'mode'))
+TOOL_RESULT_TOKENS_SAVED = registry.counter(
+    'mcp_tool_result_tokens_saved_total', 'Estimated tokens removed from tool results by compaction', ('server', 'mode'))
+ANSWER_CACHE_LOOKUPS = registry.counter(
+    'agent_answer_cache_lookups_total', 'Answer cache lookups by result (hit, near_hit, miss)', ('result',))
+RUNS_IN_FLIGHT = registry.gauge(
+    'agent_runs_in_flight', 'Agent runs currently admitted and executing')
+RUNS_QUEUED = registry.gauge(
+    'agent_runs_queued', 'Agent runs waiting for a free slot')
+BATCH_QUERIES = registry.counter(
+    'batch_queries_total', 'Batch queries finished, by status', ('status',))
+SSE_BYTES = registry.histogram(
+    'sse_response_bytes', 'Bytes sent per SSE response', ('endpoint',), SIZE_BUCKETS)
+SSE_EVENTS = registry.histogram(
+    'sse_response_events', 'Events sent per SSE response', ('endpoint',), COUNT_BUCKETS)
+SESSION_STORE = registry.histogram(
+    'session_store_seconds', 'Latency of session store operations', ('operation',))
@@ -0,0 +1,162 @@
+"""Streaming NDJSON export and import of stored sessions.
+
+Each line is one full session, as returned by ``SessionManager.get_session``.
+Sessions are read and written a page or batch at a time, so memory use does
+not grow with the size of the store. Backs the /api/sessions/export and
+/api/sessions/import endpoints, and runs from the command line:
+
+    python -m utils.session_io export --gzip -o sessions.ndjson.gz
+    python -m utils.session_io export --since 2025-01-31T09:00:00 -o delta.ndjson
+    python -m utils.session_io import sessions.ndjson.gz
+
+An export covers the sessions updated up to the moment it started and reports
+that watermark; pass it as ``since`` next time to export only what changed.
+"""
+import argparse
+import gzip
+import io
+import json
+import sys
+import zlib
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+GZIP_MAGIC = b'\x1f\x8b'
+SESSION_FIELDS = ('id', 'title', 'created_at', 'updated_at')
+MESSAGE_FIELDS = ('role', 'content')
+OPTIONAL_MESSAGE_FIELDS = ('id', 'timestamp')
+MAX_REPORTED_ERRORS = 20
+
+
+def export_ndjson(session_manager, since: str = None, compress: bool = False
+                  ) -> Tuple[Optional[str], Iterator[bytes]]:
+    """``(watermark, chunks)`` for the sessions updated after ``since``.
+
+    The watermark is the newest ``updated_at`` when the export starts; sessions
+    updated while it runs are left for the next export.
+    """
+    watermark = session_manager.latest_update()
+    if watermark is None or (since and watermark <= since):
+        return since or watermark, iter(())
+    lines = (
+        json.dumps(session, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+        for session in session_manager.iter_sessions(since=since, until=watermark)
+    )
+    return watermark, gzip_chunks(lines) if compress else lines
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Gzip a byte stream as it is produced"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def open_input(stream) -> io.BufferedIOBase:
+    """Binary reader over ``stream``, gunzipped if it starts with the gzip magic"""
+    if not hasattr(stream, 'peek'):
+        stream = io.BufferedReader(stream)
+    if stream.peek(2)[:2] == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=stream)
+    return stream
+
+
+def parse_session(line: bytes) -> Dict[str, Any]:
+    """One NDJSON line as a session dict; raises ValueError if it is not one"""
+    session = json.loads(line)
+    if not isinstance(session, dict):
+        raise ValueError("not a JSON object")
+    missing = [field for field in SESSION_FIELDS if not isinstance(session.get(field), str)]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    if not isinstance(session.get('metadata') or {}, dict):
+        raise ValueError("metadata must be an object")
+    messages = session.get('messages', [])
+    if not isinstance(messages, list):
+        raise ValueError("messages must be a list")
+    for index, message in enumerate(messages):
+        if not isinstance(message, dict):
+            raise ValueError(f"message {index} is not an object")
+        if not all(isinstance(message.get(field), str) for field in MESSAGE_FIELDS):
+            raise ValueError(f"message {index} needs string role and content")
+        # Stored as given when present, so they must be strings too
+        if not all(message.get(field) is None or isinstance(message[field], str) for field in OPTIONAL_MESSAGE_FIELDS):
+            raise ValueError(f"message {index} has a non-string id or timestamp")
+        if not isinstance(message.get('metadata') or {}, dict):
+            raise ValueError(f"message {index} metadata must be an object")
+    return session
+
+
+def import_ndjson(session_manager, stream, batch_size: int = 100) -> Dict[str, Any]:
+    """Store the sessions in an NDJSON stream (plain or gzipped).
+
+    Lines that are not valid sessions are skipped and reported. Batches are
+    committed as they fill up, so if the input breaks off, what was read
+    before stays stored and ``error`` says why it stopped.
+    """
+    report: Dict[str, Any] = {'invalid': 0, 'errors': []}
+
+    def sessions():
+        try:
+            for number, line in enumerate(open_input(stream), start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield parse_session(line)
+                except ValueError as e:
+                    report['invalid'] += 1
+                    if len(report['errors']) < MAX_REPORTED_ERRORS:
+                        report['errors'].append({'line': number, 'error': str(e)})
+        except (OSError, EOFError, zlib.error) as e:
+            report['error'] = f"Could not read input: {e}"
+
+    counts = session_manager.import_sessions(sessions(), batch_size=batch_size)
+    return {**counts, **report}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export or import stored sessions as NDJSON")
+    parser.add_argument('--storage', default='sessions', help="session storage directory")
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export', help="write sessions as NDJSON")
+    export.add_argument('--since', help="only sessions updated after this watermark")
+    export.add_argument('--gzip', action='store_true', help="gzip the output")
+    export.add_argument('-o', '--output', help="output file (default: stdout)")
+    load = commands.add_parser('import', help="store sessions from NDJSON, gzipped or not")
+    load.add_argument('input', help="input file, or - for stdin")
+    load.add_argument('--batch-size', type=int, default=100, help="sessions per write transaction")
+    args = parser.parse_args(argv)
+
+    from utils.session_manager import SessionManager
+    session_manager = SessionManager(storage_path=args.storage)
+
+    if args.command == 'export':
+        watermark, chunks = export_ndjson(session_manager, since=args.since, compress=args.gzip)
+        out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                out.write(chunk)
+        finally:
+            if args.output:
+                out.close()
+            else:
+                out.flush()
+        print(f"Exported sessions up to {watermark}; pass --since {watermark} to export later changes",
+              file=sys.stderr)
+        return
+
+    source = sys.stdin.buffer if args.input == '-' else open(args.input, 'rb')
+    try:
+        report = import_ndjson(session_manager, source, batch_size=args.batch_size)
+    finally:
+        if source is not sys.stdin.buffer:
+            source.close()
+    print(json.dumps(report, indent=2))
+    if report['invalid'] or 'error' in report:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,91 +1,505 @@
+import re
+import html
 import json
 import uuid
+import base64
+import sqlite3
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, Iterator, List, Optional
+from config import config
+from utils.metrics import SESSION_STORE, timed
+
+# ``seq`` is the stable key the title index points at; an implicit rowid
+# may be renumbered by VACUUM
+SESSIONS_TABLE = """
+CREATE TABLE IF NOT EXISTS {table} (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    metadata TEXT NOT NULL DEFAULT '{{}}'
+);
+"""
+
+SCHEMA = SESSIONS_TABLE.format(table='sessions') + """
+CREATE TABLE IF NOT EXISTS messages (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    session_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    metadata TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, seq);
+CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions (updated_at DESC, id DESC);
+"""
+
+# Stemmed, case- and accent-insensitive words
+_TOKENIZER = 'porter unicode61 remove_diacritics 2'
+
+SEARCH_SCHEMA = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content, content='messages', content_rowid='seq', tokenize='{_TOKENIZER}'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS sessions_fts USING fts5(
+    title, content='sessions', content_rowid='seq', tokenize='{_TOKENIZER}'
+);
+"""
+
+# Bump to rebuild the full-text index from the stored sessions on next start
+SEARCH_INDEX_VERSION = 2
+
+# Snippet markers from SQLite, swapped for <mark> tags once the text is escaped
+_MARK_OPEN, _MARK_CLOSE = '\ue000', '\ue001'
 
 class SessionManager:
-    def __init__(self, storage_path: str = "sessions"):
+    """Chat session store backed by SQLite in WAL mode.
+
+    Appending a message is a single-row insert, writes are transactional, and
+    concurrent readers never block the writer. Legacy ``<id>.json`` session
+    files found in ``storage_path`` are imported on startup.
+
+    Titles and message contents are indexed with FTS5 as they are written;
+    the index tables are external-content, so the text itself is stored once.
+    """
+
+    def __init__(self, storage_path: str = "sessions", search_candidates: int = None):
+        self.search_candidates = config.SESSION_SEARCH_MAX_CANDIDATES if search_candidates is None else search_candidates
         self.storage_path = Path(storage_path)
         self.storage_path.mkdir(exist_ok=True)
-    
+        self.db_path = self.storage_path / "sessions.db"
+        self._local = threading.local()
+        conn = self._connect()
+        self._migrate_session_keys(conn)
+        conn.executescript(SCHEMA + SEARCH_SCHEMA)
+        if conn.execute("PRAGMA user_version").fetchone()[0] < SEARCH_INDEX_VERSION:
+            self.rebuild_search_index()
+        self._migrate_json_sessions()
+
+    @timed(SESSION_STORE, 'create_session')
     def create_session(self, title: str = None) -> str:
         """Create a new session"""
         session_id = str(uuid.uuid4())
-        session_data = {
-            'id': session_id,
-            'title': title or f"Session {datetime.now().strftime('%Y-%m-%d %H:%M')}",
-            'created_at': datetime.now().isoformat(),
-            'updated_at': datetime.now().isoformat(),
-            'messages': [],
-            'metadata': {}
-        }
-        
-        self._save_session(session_id, session_data)
+        title = title or f"Session {datetime.now().strftime('%Y-%m-%d %H:%M')}"
+        with self._transaction() as conn:
+            now = datetime.now().isoformat()
+            seq = conn.execute(
+                "INSERT INTO sessions (id, title, created_at, updated_at, message_count, metadata) VALUES (?, ?, ?, ?, 0, '{}')",
+                (session_id, title, now, now)
+            ).lastrowid
+            conn.execute("INSERT INTO sessions_fts (rowid, title) VALUES (?, ?)", (seq, title))
         return session_id
-    
+
+    @timed(SESSION_STORE, 'add_message')
     def add_message(self, session_id: str, role: str, content: str, metadata: dict = None):
         """Add message to session"""
-        session = self._load_session(session_id)
-        if not session:
-            return False
-        
-        message = {
-            'id': str(uuid.uuid4()),
-            'role': role,
-            'content': content,
-            'timestamp': datetime.now().isoformat(),
-            'metadata': metadata or {}
-        }
-        
-        session['messages'].append(message)
-        session['updated_at'] = datetime.now().isoformat()
-        self._save_session(session_id, session)
+        with self._transaction() as conn:
+            now = datetime.now().isoformat()
+            updated = conn.execute(
+                "UPDATE sessions SET updated_at = ?, message_count = message_count + 1 WHERE id = ?",
+                (now, session_id)
+            ).rowcount
+            if not updated:
+                return False
+            seq = conn.execute(
+                "INSERT INTO messages (id, session_id, role, content, timestamp, metadata) VALUES (?, ?, ?, ?, ?, ?)",
+                (str(uuid.uuid4()), session_id, role, content, now, json.dumps(metadata or {}))
+            ).lastrowid
+            conn.execute("INSERT INTO messages_fts (rowid, content) VALUES (?, ?)", (seq, content))
         return True
-    
+
+    @timed(SESSION_STORE, 'update_session_metadata')
+    def update_session_metadata(self, session_id: str, metadata: dict) -> bool:
+        """Merge ``metadata`` into a session's metadata"""
+        with self._transaction() as conn:
+            row = conn.execute("SELECT metadata FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if not row:
+                return False
+            conn.execute(
+                "UPDATE sessions SET metadata = ?, updated_at = ? WHERE id = ?",
+                (json.dumps({**json.loads(row['metadata']), **metadata}), datetime.now().isoformat(), session_id)
+            )
+        return True
+
+    @timed(SESSION_STORE, 'get_session')
     def get_session(self, session_id: str) -> Optional[dict]:
         """Get session by ID"""
-        return self._load_session(session_id)
-    
+        conn = self._connect()
+        row = conn.execute("SELECT * FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if not row:
+            return None
+        return self._load_session(conn, row)
+
+    @staticmethod
+    def _load_session(conn: sqlite3.Connection, row: sqlite3.Row) -> dict:
+        messages = conn.execute(
+            "SELECT id, role, content, timestamp, metadata FROM messages WHERE session_id = ? ORDER BY seq",
+            (row['id'],)
+        ).fetchall()
+        return {
+            'id': row['id'],
+            'title': row['title'],
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at'],
+            'messages': [{
+                'id': m['id'],
+                'role': m['role'],
+                'content': m['content'],
+                'timestamp': m['timestamp'],
+                'metadata': json.loads(m['metadata'])
+            } for m in messages],
+            'metadata': json.loads(row['metadata'])
+        }
+
     def list_sessions(self, limit: int = 50) -> List[dict]:
         """List all sessions"""
-        sessions = []
+        return self.list_sessions_page(limit=limit)['sessions']
+
+    @timed(SESSION_STORE, 'list_sessions')
+    def list_sessions_page(self, limit: int = 50, cursor: str = None) -> dict:
+        """One page of sessions, most recently updated first.
+
+        Uses keyset pagination on (updated_at, id), so the cost depends on the
+        page size rather than the number of stored sessions. Pass the returned
+        ``next_cursor`` to fetch the following page. Raises ValueError for a
+        malformed cursor.
+        """
+        query = "SELECT id, title, created_at, updated_at, message_count FROM sessions"
+        params = []
+        if cursor:
+            updated_at, session_id = self._decode_cursor(cursor)
+            query += " WHERE (updated_at, id) < (?, ?)"
+            params += [updated_at, session_id]
+        query += " ORDER BY updated_at DESC, id DESC LIMIT ?"
+        params.append(limit + 1)
+        rows = [dict(row) for row in self._connect().execute(query, params).fetchall()]
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = self._encode_cursor(rows[-1]['updated_at'], rows[-1]['id'])
+        return {'sessions': rows, 'next_cursor': next_cursor}
+
+    @staticmethod
+    def _encode_cursor(updated_at: str, session_id: str) -> str:
+        return base64.urlsafe_b64encode(json.dumps([updated_at, session_id]).encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def _decode_cursor(cursor: str):
+        try:
+            updated_at, session_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+            return str(updated_at), str(session_id)
+        except Exception:
+            raise ValueError("Invalid cursor")
+
+    def iter_sessions(self, since: str = None, until: str = None, page_size: int = 100) -> Iterator[dict]:
+        """Full sessions with ``since < updated_at <= until``, least recently updated first.
+
+        Sessions are read a page at a time with keyset pagination on
+        (updated_at, id), so memory stays at one page however many are stored.
+        """
+        conn = self._connect()
+        bounds, params = [], []
+        if since:
+            bounds.append("updated_at > ?")
+            params.append(since)
+        if until:
+            bounds.append("updated_at <= ?")
+            params.append(until)
+        key = None
+        while True:
+            where = bounds + ["(updated_at, id) > (?, ?)"] if key else bounds
+            query = "SELECT * FROM sessions"
+            if where:
+                query += " WHERE " + " AND ".join(where)
+            query += " ORDER BY updated_at, id LIMIT ?"
+            rows = conn.execute(query, params + list(key or ()) + [page_size]).fetchall()
+            for row in rows:
+                yield self._load_session(conn, row)
+            if len(rows) < page_size:
+                return
+            key = (rows[-1]['updated_at'], rows[-1]['id'])
+
+    def latest_update(self) -> Optional[str]:
+        """``updated_at`` of the most recently updated session"""
+        row = self._connect().execute("SELECT MAX(updated_at) FROM sessions").fetchone()
+        return row[0]
+
+    def import_sessions(self, sessions: Iterable[dict], batch_size: int = 100) -> Dict[str, int]:
+        """Store full session dicts (as returned by get_session), ``batch_size`` per transaction.
+
+        A session that is not stored yet is inserted. One that is stored is
+        replaced if the incoming copy has a newer ``updated_at`` and skipped
+        otherwise, so re-importing an export, or importing an incremental one
+        on top of it, is safe.
+        """
+        counts = {'inserted': 0, 'replaced': 0, 'skipped': 0}
+        batch = []
+        for session in sessions:
+            batch.append(session)
+            if len(batch) >= batch_size:
+                self._import_batch(batch, counts)
+                batch = []
+        if batch:
+            self._import_batch(batch, counts)
+        return counts
+
+    @timed(SESSION_STORE, 'import_batch')
+    def _import_batch(self, sessions: List[dict], counts: Dict[str, int]):
+        with self._transaction() as conn:
+            for session in sessions:
+                row = conn.execute("SELECT updated_at FROM sessions WHERE id = ?", (session['id'],)).fetchone()
+                if row is None:
+                    outcome = 'inserted'
+                elif row['updated_at'] < session['updated_at']:
+                    self._delete_session(conn, session['id'])
+                    outcome = 'replaced'
+                else:
+                    counts['skipped'] += 1
+                    continue
+                self._insert_session(conn, session)
+                counts[outcome] += 1
+
+    @timed(SESSION_STORE, 'delete_session')
+    def delete_session(self, session_id: str) -> bool:
+        """Delete a session"""
+        with self._transaction() as conn:
+            return self._delete_session(conn, session_id)
+
+    @staticmethod
+    def _delete_session(conn: sqlite3.Connection, session_id: str) -> bool:
+        # External-content FTS5 needs the old text to drop its index entries
+        conn.execute(
+            "INSERT INTO messages_fts (messages_fts, rowid, content) "
+            "SELECT 'delete', seq, content FROM messages WHERE session_id = ?",
+            (session_id,)
+        )
+        conn.execute(
+            "INSERT INTO sessions_fts (sessions_fts, rowid, title) "
+            "SELECT 'delete', seq, title FROM sessions WHERE id = ?",
+            (session_id,)
+        )
+        conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+        return conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,)).rowcount > 0
+
+    @timed(SESSION_STORE, 'search_sessions')
+    def search_sessions(self, query: str, limit: int = 20, offset: int = 0) -> dict:
+        """Sessions matching ``query`` in their title or messages, best match first.
+
+        Every word of the query must match (the last one as a prefix, for
+        search-as-you-type); words are stemmed, so "papers" finds "paper".
+        Each result carries its title and best matching message snippet as
+        HTML-escaped text with the matches wrapped in ``<mark>``. Ranking is
+        by BM25 over the title (weighted double) plus the best matching
+        message; snippets are built only for the returned page.
+
+        BM25 has to score every match before sorting, so a query matching
+        more than ``search_candidates`` messages only ranks the newest of them;
+        they are found by walking the index in rowid order, which is cheap.
+        """
+        match = self._match_expression(query)
+        if not match:
+            return {'results': [], 'offset': offset, 'next_offset': None}
+        conn = self._connect()
+        cutoff = None
+        if self.search_candidates:
+            cutoff = conn.execute(
+                "SELECT rowid FROM messages_fts WHERE messages_fts MATCH ? ORDER BY rowid DESC LIMIT 1 OFFSET ?",
+                (match, self.search_candidates)
+            ).fetchone()
+        rows = conn.execute(
+            """
+            WITH scored AS MATERIALIZED (
+                -- Materialized, so bm25() is not flattened into the aggregate below
+                SELECT m.session_id AS session_id, messages_fts.rowid AS seq, bm25(messages_fts) AS score
+                FROM messages_fts JOIN messages m ON m.seq = messages_fts.rowid
+                WHERE messages_fts MATCH :match AND messages_fts.rowid > :cutoff
+            ),
+            message_hits AS (
+                -- Each session's best matching message
+                SELECT session_id, MIN(score) AS score, seq FROM scored GROUP BY session_id
+            ),
+            title_hits AS (
+                SELECT s.id AS session_id, 2 * bm25(sessions_fts) AS score
+                FROM sessions_fts JOIN sessions s ON s.seq = sessions_fts.rowid
+                WHERE sessions_fts MATCH :match
+            )
+            SELECT s.id, s.title, s.updated_at, s.message_count, SUM(hits.score) AS score, MAX(hits.seq) AS seq
+            FROM (
+                SELECT session_id, score, seq FROM message_hits
+                UNION ALL
+                SELECT session_id, score, NULL FROM title_hits
+            ) AS hits
+            JOIN sessions s ON s.id = hits.session_id
+            GROUP BY s.id
+            ORDER BY score, s.updated_at DESC
+            LIMIT :limit OFFSET :offset
+            """,
+            {'match': match, 'cutoff': cutoff[0] if cutoff else 0, 'limit': limit + 1, 'offset': offset}
+        ).fetchall()
+        next_offset = offset + limit if len(rows) > limit else None
+        rows = rows[:limit]
+        if not rows:
+            return {'results': [], 'offset': offset, 'next_offset': None}
+
+        seqs = [row['seq'] for row in rows if row['seq'] is not None]
+        messages = {m['seq']: m for m in conn.execute(
+            f"SELECT seq, id, role, timestamp, content FROM messages WHERE seq IN ({','.join('?' * len(seqs))})", seqs
+        )}
+        # Snippets need a MATCH, and against the full index each one costs as
+        # much as loading the doclists of the query's terms; a scratch index
+        # holding only this page makes them cheap
+        conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS temp.search_page USING fts5(title, content, tokenize='{_TOKENIZER}')")
+        conn.execute("DELETE FROM temp.search_page")
+        conn.executemany(
+            "INSERT INTO temp.search_page (rowid, title, content) VALUES (?, ?, ?)",
+            [(i, row['title'], messages[row['seq']]['content'] if row['seq'] in messages else '')
+             for i, row in enumerate(rows)]
+        )
+        marked = {i: (title, snippet) for i, title, snippet in conn.execute(
+            "SELECT rowid, highlight(search_page, 0, ?, ?), snippet(search_page, 1, ?, ?, '…', 16) "
+            "FROM temp.search_page WHERE search_page MATCH ?",
+            (_MARK_OPEN, _MARK_CLOSE, _MARK_OPEN, _MARK_CLOSE, match)
+        )}
+
+        results = []
+        for i, row in enumerate(rows):
+            hit = messages.get(row['seq'])
+            title, snippet = marked.get(i, (row['title'], hit and hit['content'][:200]))
+            results.append({
+                'id': row['id'],
+                'title': self._highlight(title),
+                'updated_at': row['updated_at'],
+                'message_count': row['message_count'],
+                'score': round(-row['score'], 3),
+                'message': {
+                    'id': hit['id'],
+                    'role': hit['role'],
+                    'timestamp': hit['timestamp'],
+                    'snippet': self._highlight(snippet)
+                } if hit else None
+            })
+        return {'results': results, 'offset': offset, 'next_offset': next_offset}
+
+    @staticmethod
+    def _match_expression(query: str) -> str:
+        """FTS5 MATCH expression for free text: each word quoted, the last one as a prefix"""
+        words = re.findall(r'\w+', query or '')
+        if not words:
+            return ''
+        return ' '.join(f'"{word}"' for word in words) + '*'
+
+    @staticmethod
+    def _highlight(text: str) -> str:
+        return html.escape(text).replace(_MARK_OPEN, '<mark>').replace(_MARK_CLOSE, '</mark>')
+
+    def rebuild_search_index(self):
+        """Re-index every session from scratch"""
+        with self._transaction() as conn:
+            conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+            conn.execute("INSERT INTO sessions_fts (sessions_fts) VALUES ('rebuild')")
+            conn.execute(f"PRAGMA user_version = {SEARCH_INDEX_VERSION}")
+
+    def _connect(self) -> sqlite3.Connection:
+        """Per-thread connection; SQLite connections must not be shared across threads"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """Serialized write transaction, committed atomically or rolled back.
+
+        Take ``updated_at`` timestamps inside it, once the write lock is held:
+        commits then land in timestamp order, and an export watermark read
+        from ``latest_update()`` never gets overtaken by an older write.
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    def _migrate_session_keys(self, conn: sqlite3.Connection):
+        """Give sessions created before ``seq`` existed an explicit integer key.
+
+        The old title index pointed at the implicit rowids, so it is dropped
+        here and rebuilt on ``seq`` by the SEARCH_INDEX_VERSION bump.
+        """
+        columns = [row['name'] for row in conn.execute("PRAGMA table_info(sessions)")]
+        if not columns or 'seq' in columns:
+            return
+        with self._transaction() as conn:
+            conn.execute(SESSIONS_TABLE.format(table='sessions_keyed'))
+            conn.execute(
+                "INSERT INTO sessions_keyed (seq, id, title, created_at, updated_at, message_count, metadata) "
+                "SELECT rowid, id, title, created_at, updated_at, message_count, metadata FROM sessions ORDER BY rowid"
+            )
+            conn.execute("DROP TABLE IF EXISTS sessions_fts")
+            conn.execute("DROP TABLE sessions")
+            conn.execute("ALTER TABLE sessions_keyed RENAME TO sessions")
+
+    def _migrate_json_sessions(self):
+        """Import legacy one-file-per-session JSON storage, renaming each file once imported"""
+        migrated = 0
         for file_path in self.storage_path.glob("*.json"):
             try:
                 with open(file_path, 'r') as f:
                     session = json.load(f)
-                    sessions.append({
-                        'id': session['id'],
-                        'title': session['title'],
-                        'created_at': session['created_at'],
-                        'updated_at': session['updated_at'],
-                        'message_count': len(session['messages'])
-                    })
-            except:
-                continue
-        
-        # Sort by updated_at descending
-        sessions.sort(key=lambda x: x['updated_at'], reverse=True)
-        return sessions[:limit]
-    
-    def delete_session(self, session_id: str) -> bool:
-        """Delete a session"""
-        file_path = self.storage_path / f"{session_id}.json"
-        if file_path.exists():
-            file_path.unlink()
-            return True
-        return False
-    
-    def _save_session(self, session_id: str, data: dict):
-        """Save session to disk"""
-        file_path = self.storage_path / f"{session_id}.json"
-        with open(file_path, 'w') as f:
-            json.dump(data, f, indent=2)
-    
-    def _load_session(self, session_id: str) -> Optional[dict]:
-        """Load session from disk"""
-        file_path = self.storage_path / f"{session_id}.json"
-        if file_path.exists():
-            with open(file_path, 'r') as f:
-                return json.load(f)
-        return None
\ No newline at end of file
+                with self._transaction() as conn:
+                    self._insert_session(conn, session)
+                file_path.rename(file_path.with_suffix('.json.migrated'))
+                migrated += 1
+            except Exception as e:
+                print(f"[{datetime.now().strftime('%H:%M:%S')}] Could not migrate session {file_path.name}: {e}")
+        if migrated:
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] Migrated {migrated} JSON sessions to {self.db_path}")
+
+    @staticmethod
+    def _insert_session(conn: sqlite3.Connection, session: Dict) -> bool:
+        """Insert a full session dict (as returned by get_session); skips sessions that already exist.
+
+        Message ids are unique across sessions, so a message whose id is taken
+        (a session copied under a new id, or legacy files sharing ids) is
+        stored under a fresh one rather than dropped.
+        """
+        inserted = conn.execute(
+            "INSERT OR IGNORE INTO sessions (id, title, created_at, updated_at, message_count, metadata) VALUES (?, ?, ?, ?, 0, ?)",
+            (session['id'], session['title'], session['created_at'], session['updated_at'],
+             json.dumps(session.get('metadata') or {}))
+        ).rowcount
+        if not inserted:
+            return False
+        insert_message = "INSERT OR IGNORE INTO messages (id, session_id, role, content, timestamp, metadata) VALUES (?, ?, ?, ?, ?, ?)"
+        for m in session.get('messages', []):
+            row = (session['id'], m['role'], m['content'],
+                   m.get('timestamp') or session['updated_at'], json.dumps(m.get('metadata') or {}))
+            if not conn.execute(insert_message, (m.get('id') or str(uuid.uuid4()), *row)).rowcount:
+                conn.execute(insert_message, (str(uuid.uuid4()), *row))
+        conn.execute(
+            "UPDATE sessions SET message_count = (SELECT COUNT(*) FROM messages WHERE session_id = ?) WHERE id = ?",
+            (session['id'], session['id'])
+        )
+        conn.execute(
+            "INSERT INTO sessions_fts (rowid, title) SELECT seq, title FROM sessions WHERE id = ?",
+            (session['id'],)
+        )
+        conn.execute(
+            "INSERT INTO messages_fts (rowid, content) SELECT seq, content FROM messages WHERE session_id = ?",
+            (session['id'],)
+        )
+        return True